@@ -3,11 +3,35 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import functools
+import glob
+import hashlib
+import json
+import logging
 import math
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import unicodedata
+import openpyxl
 
 # === CONFIGURACIÓN INICIAL ===
 st.set_page_config(page_title="Control de Mantenimientos", layout="wide")
 
+# Registro del vigilante de archivos (corre en un hilo sin sesión de Streamlit).
+# El script se re-ejecuta en cada interacción: el handler se agrega una sola vez.
+logger = logging.getLogger("control_mantenimientos")
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
 # === CONSTANTES ===
 ARCHIVO = "ultimo diciembre.xlsx"
 HOJA = "Data"
@@ -18,6 +42,41 @@ HOJA_ANULACIONES = "anulaciones"
 ARCHIVO_FRECUENCIAS= "frecuencias_2025.xlsx"
 HOJA_FRECUENCIAS = "Hoja1"
 
+# Carpeta con un extracto mensual por archivo (opcional). Si se define, reemplaza a
+# ARCHIVO: cada extracto nuevo se ingiere una sola vez en particiones por mes.
+CARPETA_EXTRACTOS = ""
+CARPETA_PARTICIONES = "particiones"
+
+# Meses más recientes que se cargan desde las particiones o se consultan a la base
+# (None = todo el historial)
+MESES_HISTORIAL = None
+
+# Carpeta donde se guarda el último análisis completo (vacío = sin snapshot). Se
+# reutiliza al reiniciar la app mientras no cambien los archivos, el código ni el día.
+# Es un pickle: usar una carpeta en la que solo escriba esta app.
+CARPETA_SNAPSHOTS = ""
+
+# Cada cuántos segundos se revisa si cambiaron los archivos fuente
+INTERVALO_VIGILANCIA = 30
+
+# API JSON local de solo lectura con los resultados del análisis (0 = desactivada)
+HOST_API = "127.0.0.1"
+PUERTO_API = 0
+REGISTROS_POR_PAGINA_API = 100
+MAX_REGISTROS_POR_PAGINA_API = 1000
+
+# Filas del Excel principal que se procesan por bloque durante la carga
+FILAS_POR_BLOQUE = 50_000
+
+# Base de datos SQLite local (opcional). Si se define, los Excel se ingieren una vez
+# en este archivo y las consultas por sitio/especialidad se resuelven con índices.
+# Vacío = todo se procesa en memoria con pandas.
+ARCHIVO_BD = ""
+
+# Al reconstruir la base se comparan sus agregados con los calculados en memoria y
+# se registran las diferencias (los dos caminos deben dar lo mismo)
+VERIFICAR_BD = True
+
 # Nombres de columnas
 COL_ESPECIALIDAD = "SUB_ESPECIALIDAD"
 COL_SITE_ID = "Site Id"
@@ -35,6 +94,9 @@ columnas_relevantes = [
     COL_COMPLETE_TIME
 ]
 
+# Columnas que identifican una orden de trabajo entre extractos (ver ingerir_extractos)
+COLUMNAS_CLAVE_ORDEN = [COL_SITE_ID, COL_ESPECIALIDAD, COL_FECHA]
+
 columnas_anulaciones = [
     "Site Id", "Mes de la anulación", "Especialidad eliminada", "Tipo de anulación", "Justificación", 
 ]
@@ -45,6 +107,67 @@ ESPECIALIDADES = [
     "UPS", "INV-AVR", "LT", "RADIO", "SOL-EOL"
 ]
 
+GRUPOS_PRIORIDADES = {
+    "P1": "P_1", "P2": "P_2", "P3": "P_3",
+    "D1": "D_1", "D2": "D_2", "D3": "D_3",
+    "B1": "B_1", "B2": "B_2", "B3": "B_3"
+}
+
+NIVELES_RIESGO = ["ALTO RIESGO", "MEDIO RIESGO", "BAJO RIESGO"]
+
+# Score mínimo de cada nivel de riesgo
+UMBRAL_ALTO_RIESGO = 10
+UMBRAL_MEDIO_RIESGO = 5
+
+COLOR_RIESGO = {
+    "ALTO RIESGO": "red",
+    "MEDIO RIESGO": "orange",
+    "BAJO RIESGO": "green"
+}
+
+# Sitios que se dibujan por página en las vistas de sitios problemáticos
+SITIOS_POR_PAGINA = 20
+
+# Búsqueda de sitios: cantidad de resultados y fracción mínima de los trigramas
+# del texto buscado que debe tener un sitio en la búsqueda aproximada
+RESULTADOS_BUSQUEDA = 10
+SIMILITUD_MINIMA_BUSQUEDA = 0.3
+
+# Filas por página en las tablas grandes (solo se envía y se estiliza la página visible)
+FILAS_POR_PAGINA_TABLA = 200
+
+# Estilos de celdas por categoría
+ESTILO_ROJO = 'background-color: #fee2e2; color: #991b1b; font-weight: bold'
+ESTILO_NARANJA = 'background-color: #fed7aa; color: #9a3412; font-weight: bold'
+ESTILO_AMARILLO = 'background-color: #fef3c7; color: #92400e; font-weight: bold'
+ESTILO_VERDE = 'background-color: #d1fae5; color: #065f46; font-weight: bold'
+ESTILO_AZUL = 'background-color: #e6f3ff; color: #0066cc; font-weight: bold'
+
+# Severidades de las alertas de pendientes, de mayor a menor
+ORDEN_SEVERIDAD = ["CRÍTICA", "ALTA", "MEDIA"]
+
+ESTILOS_SEVERIDAD = {"CRÍTICA": ESTILO_ROJO, "ALTA": ESTILO_NARANJA, "MEDIA": ESTILO_AMARILLO}
+ESTILOS_CRITICIDAD = {"CRÍTICO": ESTILO_ROJO, "ALERTA": ESTILO_AMARILLO}
+
+# Días que deben pasar desde el último mantenimiento del mes para considerar
+# que la ejecución de un sitio quedó incompleta
+DIAS_GRACIA_EJECUCION_INCOMPLETA = 2
+
+# Meses anteriores que forman el promedio histórico de las tendencias (None = todo el historial)
+VENTANA_TENDENCIA = None
+
+# Meses hacia adelante que se evalúan en el backtest de las predicciones
+HORIZONTE_BACKTEST = 3
+
+# Meses de adelanto o atraso admitidos alrededor de cada vencimiento en las predicciones
+# (0 = mes exacto, repartido entre dos meses si el intervalo es fraccionario)
+TOLERANCIA_PREDICCION = 1
+
+# Excluir de especialidades eliminadas, mantenimientos perdidos, tendencias y riesgo
+# los pares (sitio, especialidad) anulados y los sitios anulados completos, desde el
+# mes de la anulación
+EXCLUIR_ANULADAS = False
+
 MESES = {
     'ene':'01', 'feb':'02', 'mar':'03', 'abr':'04', 'may':'05', 'jun':'06',
     'jul':'07', 'ago':'08', 'set':'09', 'oct':'10', 'nov':'11', 'dic':'12'
@@ -110,7 +233,7 @@ def obtener_ultimo_mes_valido(df):
     return pd.DataFrame(resultados, columns=[COL_SITE, "ULTIMO_MES_VALIDO"])
 
 
-def calcular_score_riesgo(site, eliminadas, mantenimientos_perdidos, diferencias_mtto, prioridad_df):
+def calcular_score_riesgo(site, eliminadas, mantenimientos_perdidos, diferencias_mtto):
     """
     Calcula el score de riesgo considerando:
     - Mantenimientos perdidos históricos
@@ -130,13 +253,162 @@ def calcular_score_riesgo(site, eliminadas, mantenimientos_perdidos, diferencias
             score += abs(dif) * 2  # Multiplicador para dar más peso
     
     # Clasificación de riesgo
-    if score >= 10:
+    if score >= UMBRAL_ALTO_RIESGO:
         return "ALTO RIESGO", score
-    elif score >= 5:
+    elif score >= UMBRAL_MEDIO_RIESGO:
         return "MEDIO RIESGO", score
     else:
         return "BAJO RIESGO", score
 
+def calcular_historial_riesgo(conteo_df, col_site_id, especialidades):
+    """
+    Score y nivel de riesgo de cada sitio en cada mes de su historia, con las reglas
+    de calcular_score_riesgo evaluadas con los datos disponibles a ese mes:
+    - especialidad eliminada desde que acumula 3 meses seguidos por debajo de su
+      máximo histórico; aporta (máximo histórico - valor del mes)
+    - caída del TOTAL respecto al mes anterior, con peso doble
+    
+    Todo se calcula con operaciones acumuladas agrupadas por sitio, sin recorrer
+    sitios ni meses. El último mes de cada sitio coincide con `scores`/`riesgos`.
+    """
+    conteo = conteo_df.sort_values([col_site_id, "MES"], kind="stable").reset_index(drop=True)
+    sitios = conteo[col_site_id]
+    # NaN = especialidad anulada desde ese mes (ver marcar_anuladas): no cae ni aporta perdidos
+    valores = conteo[especialidades]
+    
+    # Máximo histórico hasta cada mes y meses por debajo de él
+    maximo_acumulado = valores.groupby(sitios, sort=False).cummax()
+    caidas = valores < maximo_acumulado
+    
+    # Racha de caídas que termina en cada mes: posición actual menos la del último mes sin caída
+    posicion = conteo.groupby(col_site_id, sort=False).cumcount().to_numpy()
+    posiciones = pd.DataFrame(
+        np.repeat(posicion[:, None], len(especialidades), axis=1), columns=especialidades
+    )
+    ultima_sin_caida = posiciones.where(~caidas).groupby(sitios, sort=False).ffill().fillna(-1)
+    racha = posiciones - ultima_sin_caida
+    
+    # Una vez eliminada, la especialidad sigue eliminada en los meses siguientes
+    eliminada = (racha >= 3).groupby(sitios, sort=False).cummax()
+    perdidos = (maximo_acumulado - valores).where(eliminada, 0).sum(axis=1)
+    
+    # Caída respecto al mes anterior, solo con las especialidades vigentes en el mes
+    diferencia = (valores - valores.groupby(sitios, sort=False).shift(1)).sum(axis=1)
+    score = perdidos + np.where(diferencia < 0, -diferencia * 2, 0)
+    
+    nivel = np.select(
+        [score >= UMBRAL_ALTO_RIESGO, score >= UMBRAL_MEDIO_RIESGO],
+        ["ALTO RIESGO", "MEDIO RIESGO"],
+        default="BAJO RIESGO"
+    )
+    
+    return pd.DataFrame({
+        col_site_id: sitios,
+        "MES": conteo["MES"].astype("category"),
+        "score": score.astype("int32"),
+        "nivel": pd.Categorical(nivel, categories=NIVELES_RIESGO[::-1], ordered=True),
+        "perdidos": perdidos.astype("int32"),
+        "diferencia": diferencia.astype("int32")
+    }).set_index(col_site_id)
+
+def pivotar_conteo(conteo_largo, filas=None):
+    """
+    Conteo largo (sitio, mes, especialidad, cantidad) → una fila por sitio y mes,
+    una columna por especialidad y TOTAL. Con `filas` (MultiIndex sitio, mes) se
+    fuerzan esas filas, con cero donde no hubo ejecuciones.
+    """
+    conteo_ejecutadas = conteo_largo.pivot_table(
+        index=[COL_SITE_ID, "MES"],
+        columns=COL_ESPECIALIDAD,
+        values="cantidad",
+        aggfunc="sum",
+        fill_value=0
+    )
+    conteo_ejecutadas.columns.name = None
+    
+    if filas is not None:
+        conteo_ejecutadas = conteo_ejecutadas.reindex(filas, fill_value=0)
+    
+    for especialidad in ESPECIALIDADES:
+        if especialidad not in conteo_ejecutadas.columns:
+            conteo_ejecutadas[especialidad] = 0
+    
+    conteo_ejecutadas = conteo_ejecutadas[ESPECIALIDADES]
+    conteo_ejecutadas["TOTAL"] = conteo_ejecutadas.sum(axis=1)
+    conteo_ejecutadas.reset_index(inplace=True)
+    
+    return conteo_ejecutadas
+
+def indexar_anulaciones(df_anulaciones):
+    """
+    Índice de anulaciones para el anti-join, con el primer mes anulado ("YYYY-MM";
+    vacío si la anulación no indica mes, y entonces aplica a todos):
+    - pares: Series indexada por (Site Id, especialidad) de las anulaciones de una especialidad
+    - sitios_completos: Series indexada por Site Id de los sitios anulados por completo
+      ("Sitio completo" o sin especialidad indicada)
+    """
+    especialidad = df_anulaciones["Especialidad eliminada"].astype(str).str.strip().str.upper()
+    sitio_completo = (
+        df_anulaciones["Tipo de anulación"].astype(str).str.lower().str.contains("sitio completo")
+        | df_anulaciones["Especialidad eliminada"].isna()
+    )
+    site_id = df_anulaciones["Site Id"].astype(str).str.strip()
+    mes_anulacion = (
+        pd.to_datetime(df_anulaciones["Mes de la anulación"], errors="coerce").dt.strftime("%Y-%m").fillna("")
+    )
+    
+    return {
+        'pares': pd.Series(
+            mes_anulacion[~sitio_completo].to_numpy(),
+            index=pd.MultiIndex.from_arrays(
+                [site_id[~sitio_completo], especialidad[~sitio_completo]],
+                names=[COL_SITE_ID, COL_ESPECIALIDAD]
+            ),
+            dtype=str
+        ).groupby(level=[0, 1]).min(),
+        'sitios_completos': pd.Series(
+            mes_anulacion[sitio_completo].to_numpy(),
+            index=pd.Index(site_id[sitio_completo], name=COL_SITE_ID),
+            dtype=str
+        ).groupby(level=0).min()
+    }
+
+def anulado_desde(meses, desde):
+    """
+    True donde el mes es el de la anulación o uno posterior. `desde` viene alineado
+    con `meses` (NaN = sin anulación). "Fecha desconocida" cuenta como posterior.
+    """
+    desde = np.asarray(desde, dtype=object)
+    anulado = ~pd.isna(desde)
+    anulado[anulado] = np.broadcast_to(np.asarray(meses, dtype=object), desde.shape)[anulado] >= desde[anulado]
+    return anulado
+
+def excluir_anuladas(conteo_largo, anulaciones_indexadas):
+    """Anti-join por mes: quita del conteo largo lo ejecutado desde la anulación del par o del sitio completo"""
+    pares = pd.MultiIndex.from_frame(conteo_largo[[COL_SITE_ID, COL_ESPECIALIDAD]])
+    anulado = (
+        anulado_desde(conteo_largo["MES"], anulaciones_indexadas['pares'].reindex(pares))
+        | anulado_desde(conteo_largo["MES"], anulaciones_indexadas['sitios_completos'].reindex(conteo_largo[COL_SITE_ID]))
+    )
+    return conteo_largo[~anulado]
+
+def marcar_anuladas(conteo_ejecutadas, anulaciones_indexadas):
+    """
+    Deja sin valor (NaN) cada especialidad anulada de un sitio desde el mes de la
+    anulación, para que los detectores no la lean como una caída, y recalcula TOTAL
+    con las especialidades que siguen vigentes.
+    """
+    desde = (
+        anulaciones_indexadas['pares']
+        .unstack(COL_ESPECIALIDAD)
+        .reindex(index=conteo_ejecutadas[COL_SITE_ID], columns=ESPECIALIDADES)
+    )
+    anulado = anulado_desde(conteo_ejecutadas["MES"].to_numpy()[:, None], desde)
+    
+    conteo = conteo_ejecutadas.copy()
+    conteo[ESPECIALIDADES] = conteo[ESPECIALIDADES].mask(anulado)
+    conteo["TOTAL"] = conteo[ESPECIALIDADES].sum(axis=1).astype(int)
+    return conteo
 
 def detectar_especialidades_eliminadas(conteo_df,col_site_id,  especialidades):
     """Detecta especialidades que han sido eliminadas permanentemente (3+ meses consecutivos de caída)"""
@@ -152,7 +424,8 @@ def detectar_especialidades_eliminadas(conteo_df,col_site_id,  especialidades):
             if especialidad not in site_data.columns:
                 continue
                 
-            serie = site_data[especialidad].fillna(0).astype(int)
+            # Los meses sin valor son los de una especialidad anulada (ver marcar_anuladas)
+            serie = site_data[especialidad].dropna().astype(int)
             
             if len(serie) < 3:
                 continue
@@ -181,55 +454,69 @@ def detectar_especialidades_eliminadas(conteo_df,col_site_id,  especialidades):
     
     return eliminadas, mantenimientos_perdidos
 
-def calcular_tendencias(conteo_df, col_site_id):
-    """Calcula la tendencia mes a mes para cada sitio basado en el 80% del promedio histórico"""
-    tendencias = {}
+def calcular_historial_tendencias(conteo_df, col_site_id, especialidades, ventana=None):
+    """
+    Clasifica la tendencia de cada sitio en cada mes (desde su segundo mes) con la
+    regla del 80% del promedio histórico:
+    - ESTABLE si los 3 últimos meses tienen el mismo TOTAL
+    - CRECIENDO si el mes alcanza el promedio de los meses anteriores
+    - ESTABLE si alcanza el 80% de ese promedio
+    - DECRECIENDO en otro caso
     
-    for site in conteo_df[col_site_id].unique():
-        site_data = conteo_df[conteo_df[col_site_id] == site].sort_values("MES")
-        
-        if len(site_data) < 2:
-            continue
-            
-        # Calcular el promedio histórico (excluyendo el último mes)
-        mantenimientos_historicos = site_data.iloc[:-1]["TOTAL"]
-        promedio_historico = mantenimientos_historicos.mean()
-        
-        # Umbral del 80% del promedio histórico
-        umbral_80_porciento = promedio_historico * 0.8
-        
-        mantenimiento_actual = site_data.iloc[-1]["TOTAL"]
-        mantenimiento_anterior = site_data.iloc[-2]["TOTAL"]
-        diferencia = mantenimiento_actual - mantenimiento_anterior
-        
-        # Verificar si hay 3 meses consecutivos sin variación
-        tiene_3_meses_estables = False
-        if len(site_data) >= 3:
-            ultimos_3_meses = site_data.tail(3)["TOTAL"].values
-            # Verificar si los últimos 3 meses tienen el mismo valor
-            if len(set(ultimos_3_meses)) == 1:  # Todos los valores son iguales
-                tiene_3_meses_estables = True
-        
-        # Determinar tendencia
-        if tiene_3_meses_estables:
-            estado = "ESTABLE"
-        elif mantenimiento_actual >= promedio_historico:
-            estado = "CRECIENDO"
-        elif mantenimiento_actual >= umbral_80_porciento:
-            estado = "ESTABLE"
-        else:
-            estado = "DECRECIENDO"
-        
-        tendencias[site] = {
-            "tendencia": estado,
-            "valor": diferencia,
-            "ultimo_mes": mantenimiento_actual,
-            "promedio_historico": round(promedio_historico, 1),
-            "umbral_80p": round(umbral_80_porciento, 1),
-            "3_meses_estables": tiene_3_meses_estables
-        }
+    `ventana` limita el promedio a los N meses anteriores (None = todo el historial).
+    El promedio solo suma las especialidades vigentes en el mes evaluado: una
+    especialidad anulada (NaN, ver marcar_anuladas) sale también de su historia.
+    Los promedios salen de sumas acumuladas por sitio, sin recorrer sitios ni meses.
+    """
+    conteo = conteo_df.sort_values([col_site_id, "MES"], kind="stable").reset_index(drop=True)
+    sitios = conteo[col_site_id]
+    total = conteo["TOTAL"]
+    por_sitio = total.groupby(sitios, sort=False)
+    valores = conteo[especialidades]
+    
+    # Suma (por especialidad) y cantidad de los meses anteriores dentro de la ventana
+    meses_previos = conteo.groupby(col_site_id, sort=False).cumcount()
+    acumulado = valores.fillna(0).groupby(sitios, sort=False).cumsum()
+    suma_previa = acumulado - valores.fillna(0)
+    if ventana is not None:
+        suma_previa = suma_previa - acumulado.groupby(sitios, sort=False).shift(ventana + 1).fillna(0)
+        meses_previos = meses_previos.clip(upper=ventana)
+    suma_previa = suma_previa.where(valores.notna()).sum(axis=1)
+    promedio_historico = suma_previa / meses_previos.where(meses_previos > 0)
+    umbral_80_porciento = promedio_historico * 0.8
+    
+    anterior = por_sitio.shift(1)
+    tres_meses_estables = (total == anterior) & (anterior == por_sitio.shift(2))
+    
+    estado = np.select(
+        [tres_meses_estables, total >= promedio_historico, total >= umbral_80_porciento],
+        ["ESTABLE", "CRECIENDO", "ESTABLE"],
+        default="DECRECIENDO"
+    )
+    
+    historial = pd.DataFrame({
+        col_site_id: sitios,
+        "MES": conteo["MES"],
+        "tendencia": estado,
+        "valor": total - anterior,
+        "ultimo_mes": total,
+        "promedio_historico": promedio_historico.round(1),
+        "umbral_80p": umbral_80_porciento.round(1),
+        "3_meses_estables": tres_meses_estables
+    })
     
-    return tendencias
+    # El primer mes de cada sitio no tiene historia con la cual comparar
+    historial = historial[anterior.notna()]
+    
+    return historial.astype({
+        "MES": "category", "tendencia": "category", "valor": "int32", "ultimo_mes": "int32"
+    }).set_index(col_site_id)
+
+def calcular_tendencias(historial_tendencias):
+    """Tendencia del último mes de cada sitio a partir de calcular_historial_tendencias"""
+    ultimos = historial_tendencias[~historial_tendencias.index.duplicated(keep="last")]
+    return ultimos.drop(columns="MES").astype({"tendencia": str}).to_dict("index")
+
 def diferencia_mtto_anterior(conteo_df, col_site_id):
     """
     Analiza la diferencia de mantenimientos con respecto al mes anterior.
@@ -250,7 +537,9 @@ def diferencia_mtto_anterior(conteo_df, col_site_id):
             }
             continue
         
-        mes_anterior = site_data.iloc[-2]["TOTAL"]
+        # El mes anterior suma solo las especialidades vigentes en el actual (ver marcar_anuladas)
+        vigentes = site_data.iloc[-1][ESPECIALIDADES].notna()
+        mes_anterior = site_data.iloc[-2][ESPECIALIDADES][vigentes].sum()
         mes_actual = site_data.iloc[-1]["TOTAL"]
         diferencia = mes_actual - mes_anterior
         
@@ -263,396 +552,2338 @@ def diferencia_mtto_anterior(conteo_df, col_site_id):
     
     return diferencias
 
-def detectar_sitios_con_ejecucion_incompleta(df, conteo_df, col_site_id):
+def resumir_mes_corte(df, fecha_corte):
+    """
+    Ejecutados del mes de `fecha_corte` por sitio (hasta la fecha de corte): cantidad
+    y fecha del último mantenimiento, en una sola agregación (ver resumir_mes_corte_bd)
+    """
+    fecha_corte = pd.Timestamp(fecha_corte)
+    df_mes = df[(df["MES"] == fecha_corte.strftime("%Y-%m")) & (df[COL_ESTADO].str.lower() == "ejecutado")]
+    complete_time = pd.to_datetime(df_mes[COL_COMPLETE_TIME], errors='coerce')
+    df_mes = df_mes.assign(**{COL_COMPLETE_TIME: complete_time})[~(complete_time > fecha_corte)]
+    
+    return df_mes.groupby(COL_SITE_ID).agg(
+        mes_actual_realizados=(COL_COMPLETE_TIME, "size"),
+        ultimo_mtto=(COL_COMPLETE_TIME, "max")
+    )
+
+def detectar_sitios_con_ejecucion_incompleta(mes_actual, conteo_df, col_site_id, as_of=None,
+                                             dias_gracia=DIAS_GRACIA_EJECUCION_INCOMPLETA):
     """
     Detecta sitios que:
-    1. Ya tuvieron al menos un mantenimiento ejecutado este mes
-    2. El último mantenimiento fue hace más de 2 días
+    1. Ya tuvieron al menos un mantenimiento ejecutado en el mes de as_of
+    2. El último mantenimiento fue hace más de `dias_gracia` días
     3. Aún no completan la cantidad de mantenimientos del mes anterior
     
-    Returns:
-        dict: Diccionario con información de sitios con ejecución incompleta
+    Args:
+        mes_actual: Ejecutados del mes de as_of por sitio (ver resumir_mes_corte)
+        as_of: Fecha de corte del análisis (default: ahora). Permite reconstruir
+               el resultado para meses pasados y hace el cálculo determinista.
+        dias_gracia: Días que se esperan desde el último mantenimiento antes de alertar
+    
+    Returns:
+        dict: Diccionario con información de sitios con ejecución incompleta
+    """
+    fecha_corte = pd.Timestamp.now() if as_of is None else pd.Timestamp(as_of)
+    mes_actual_str = fecha_corte.strftime("%Y-%m")
+    
+    # Historial hasta el mes de corte: el mes anterior es el penúltimo mes con datos
+    conteo_hasta_corte = conteo_df[conteo_df["MES"] <= mes_actual_str].sort_values([col_site_id, "MES"])
+    historial = (
+        conteo_hasta_corte.groupby(col_site_id).tail(2)
+        .groupby(col_site_id)
+        .agg(meses=("MES", "size"), mes_anterior_total=("TOTAL", "first"))
+    )
+    historial = historial[historial["meses"] >= 2]
+    
+    resumen = historial.join(mes_actual, how="inner").dropna(subset=["ultimo_mtto"])
+    resumen["dias_desde_ultimo"] = (fecha_corte - resumen["ultimo_mtto"]).dt.days
+    
+    # Criterios:
+    # 1. Tiene al menos 1 mantenimiento este mes
+    # 2. Último mtto hace más de `dias_gracia` días
+    # 3. No alcanza la cantidad del mes anterior
+    resumen = resumen[
+        (resumen["mes_actual_realizados"] > 0) &
+        (resumen["dias_desde_ultimo"] > dias_gracia) &
+        (resumen["mes_actual_realizados"] < resumen["mes_anterior_total"])
+    ]
+    
+    sitios_incompletos = {}
+    
+    for site, fila in resumen.iterrows():
+        mes_anterior_total = int(fila["mes_anterior_total"])
+        mttos_realizados_mes_actual = int(fila["mes_actual_realizados"])
+        
+        sitios_incompletos[site] = {
+            "mes_anterior_total": mes_anterior_total,
+            "mes_actual_realizados": mttos_realizados_mes_actual,
+            "faltantes": mes_anterior_total - mttos_realizados_mes_actual,
+            "ultimo_mtto_fecha": fila["ultimo_mtto"].strftime("%Y-%m-%d"),
+            "dias_desde_ultimo": int(fila["dias_desde_ultimo"]),
+            "porcentaje_completado": round(
+                (mttos_realizados_mes_actual / mes_anterior_total) * 100, 1
+            )
+        }
+    
+    return sitios_incompletos
+
+def construir_dimension_sitios(df):
+    """
+    Tabla de dimensión de sitios, indexada por Site Id (ordenada), con el nombre,
+    la prioridad, el contratista y el FLM de cada sitio.
+    Se toma el registro más reciente de cada sitio (por MES).
+    """
+    # Los meses desconocidos se ordenan antes que cualquier mes válido
+    orden_mes = df["MES"].where(df["MES"] != "Fecha desconocida", "")
+    
+    dim_sitios = (
+        df.assign(_orden_mes=orden_mes)
+        .sort_values("_orden_mes", kind="stable")
+        .drop_duplicates(COL_SITE_ID, keep="last")
+        .set_index(COL_SITE_ID)[[COL_SITE, COL_PRIORIDAD, COL_CONTRATISTA, COL_FLM_ESPECIFICO]]
+        .sort_index()
+    )
+    return dim_sitios
+
+def indexar_sitios_por_prioridad(dim_sitios):
+    """Índice prioridad → arreglo ordenado de Site Ids de esa prioridad"""
+    return {
+        codigo_prioridad: sitios.index.to_numpy()
+        for codigo_prioridad, sitios in dim_sitios.groupby(COL_PRIORIDAD, sort=False)
+    }
+
+def agrupar_sitios_problematicos(dim_sitios, sitios_por_prioridad, eliminadas, tendencias, sitios_incompletos, riesgos):
+    """
+    Agrupa una sola vez los sitios con alerta por prioridad (y por nivel de riesgo),
+    ya ordenados tal como se muestran en la página de Sitios Problemáticos.
+    
+    Returns:
+        dict: {"eliminadas": {prioridad: {riesgo: [sitios]}},
+               "decreciendo": {prioridad: {riesgo: [sitios]}},
+               "incompletos": {prioridad: [sitios]}}
+    """
+    sitios = pd.DataFrame(index=dim_sitios.index)
+    
+    sitios["riesgo"] = pd.Series(riesgos).reindex(sitios.index).fillna("BAJO RIESGO")
+    sitios["eliminada"] = pd.Series(
+        {site: bool(esps) for site, esps in eliminadas.items()}, dtype=bool
+    ).reindex(sitios.index, fill_value=False)
+    sitios["decreciendo"] = pd.Series(
+        {site: "DECRECIENDO" in tend["tendencia"] for site, tend in tendencias.items()}, dtype=bool
+    ).reindex(sitios.index, fill_value=False)
+    sitios["caida"] = pd.Series(
+        {site: abs(tend["valor"]) for site, tend in tendencias.items()}, dtype=float
+    ).reindex(sitios.index)
+    sitios["porcentaje_completado"] = pd.Series(
+        {site: info["porcentaje_completado"] for site, info in sitios_incompletos.items()}, dtype=float
+    ).reindex(sitios.index)
+    
+    def por_riesgo(df):
+        return {
+            nivel: df.index[df["riesgo"] == nivel].tolist()
+            for nivel in NIVELES_RIESGO
+        }
+    
+    grupos = {"eliminadas": {}, "decreciendo": {}, "incompletos": {}}
+    
+    for codigo_prioridad, sitios_codigo in sitios_por_prioridad.items():
+        sitios_prioridad = sitios.loc[sitios_codigo]
+        
+        grupos["eliminadas"][codigo_prioridad] = por_riesgo(
+            sitios_prioridad[sitios_prioridad["eliminada"]]
+        )
+        # Dentro de cada nivel de riesgo, primero los de mayor caída
+        grupos["decreciendo"][codigo_prioridad] = por_riesgo(
+            sitios_prioridad[sitios_prioridad["decreciendo"]]
+            .sort_values("caida", ascending=False, kind="stable")
+        )
+        # Los más atrasados primero
+        grupos["incompletos"][codigo_prioridad] = (
+            sitios_prioridad["porcentaje_completado"].dropna()
+            .sort_values(kind="stable")
+            .index.tolist()
+        )
+    
+    return grupos
+
+def alertar_pendientes(resolucion, registros_por_mes, dim_sitios):
+    """
+    Alertas de pendientes que el SIGUIENTE mantenimiento programado (el siguiente mes
+    con registros del mismo sitio y especialidad, sin importar cuántos meses después)
+    no resolvió: ese mes no es el de la resolución que encontró resolver_pendientes.
+    Una alerta por sitio, especialidad y mes pendiente.
+    
+    Args:
+        resolucion: ver resolver_pendientes
+        registros_por_mes: ver pendientes_y_ejecuciones
+    """
+    claves = [COL_SITE_ID, COL_ESPECIALIDAD]
+    
+    pendientes = (
+        resolucion[claves + ["MES", "mes_resolucion"]]
+        .astype({COL_ESPECIALIDAD: str})
+        .drop_duplicates(claves + ["MES"])
+        .merge(registros_por_mes, on=claves + ["MES"], how="left")
+    )
+    pendientes["mes"] = numero_mes(pendientes["MES"])
+    
+    siguientes = registros_por_mes.rename(columns={
+        "MES": "mes_siguiente_mtto", "programados": "programados2",
+        "ejecutados": "ejecutados2", "estado": "estado_siguiente"
+    })
+    siguientes["mes_siguiente"] = numero_mes(siguientes["mes_siguiente_mtto"])
+    
+    # Siguiente mes (estrictamente posterior) con registros del mismo par
+    alertas = pd.merge_asof(
+        pendientes.drop(columns="estado").sort_values("mes", kind="stable"),
+        siguientes.sort_values("mes_siguiente", kind="stable"),
+        left_on="mes",
+        right_on="mes_siguiente",
+        by=claves,
+        direction="forward",
+        allow_exact_matches=False
+    )
+    alertas = alertas[
+        alertas["mes_siguiente"].notna() & (alertas["mes_resolucion"] != alertas["mes_siguiente_mtto"])
+    ].sort_values(claves + ["mes"], kind="stable")
+    
+    meses = (alertas["mes_siguiente"] - alertas["mes"]).astype(int)
+    severidad = np.select(
+        [alertas["estado_siguiente"] == "cancelado", meses >= 6, meses >= 3],
+        ["MEDIA", "CRÍTICA", "ALTA"],
+        default="MEDIA"
+    )
+    
+    return pd.DataFrame({
+        "site ID": alertas[COL_SITE_ID],
+        "site": alertas[COL_SITE_ID].map(dim_sitios[COL_SITE]),
+        "especialidad": alertas[COL_ESPECIALIDAD],
+        "mes_pendiente": alertas["MES"],
+        "mes_siguiente_mtto": alertas["mes_siguiente_mtto"],
+        "meses_entre_mttos": meses,
+        "estado_siguiente": alertas["estado_siguiente"].str.upper(),
+        "dias_sin_ejecutar": (meses * 30).astype(str) + "+",
+        "severidad": severidad,
+        "recuento_ejecutados": (
+            alertas["ejecutados"].astype(int).astype(str) + "/" + alertas["programados"].astype(int).astype(str)
+        ),
+        "recuento_ejecutados2": (
+            alertas["ejecutados2"].astype(int).astype(str) + "/" + alertas["programados2"].astype(int).astype(str)
+        )
+    })
+
+COLUMNAS_ALERTAS = [
+    "site ID", "site", "prioridad", "especialidad",
+    "mes_pendiente", "recuento_ejecutados",
+    "mes_siguiente_mtto", "recuento_ejecutados2",
+    "meses_entre_mttos", "estado_siguiente",
+    "dias_sin_ejecutar", "severidad"
+]
+
+def construir_tabla_alertas(alertas_pendientes, dim_sitios):
+    """
+    Tabla columnar tipada de alertas de pendientes (una vez por carga), con la
+    prioridad del sitio: categorías para los textos repetidos, severidad ordenada
+    (CRÍTICA > ALTA > MEDIA) y enteros para la distancia en meses.
+    """
+    tabla = pd.DataFrame(alertas_pendientes, columns=[c for c in COLUMNAS_ALERTAS if c != "prioridad"])
+    tabla["prioridad"] = tabla["site ID"].map(dim_sitios[COL_PRIORIDAD])
+    
+    for columna in ["site ID", "site", "prioridad", "especialidad", "estado_siguiente",
+                    "mes_pendiente", "mes_siguiente_mtto"]:
+        tabla[columna] = tabla[columna].astype("category")
+    
+    tabla["meses_entre_mttos"] = tabla["meses_entre_mttos"].astype("int16")
+    tabla["severidad"] = pd.Categorical(tabla["severidad"], categories=ORDEN_SEVERIDAD, ordered=True)
+    
+    return tabla[COLUMNAS_ALERTAS]
+
+def consultar_alertas(tabla, severidades=None, especialidades=None, prioridades=None,
+                      meses_entre=None, orden="severidad", descendente=False):
+    """
+    Filtra y ordena la tabla de alertas. Cada filtro es opcional; meses_entre es
+    un rango (mínimo, máximo). Ordenar por severidad pone primero las CRÍTICAS.
+    """
+    filtro = np.ones(len(tabla), dtype=bool)
+    
+    if severidades is not None:
+        filtro &= tabla["severidad"].isin(severidades).to_numpy()
+    if especialidades is not None:
+        filtro &= tabla["especialidad"].isin(especialidades).to_numpy()
+    if prioridades is not None:
+        filtro &= tabla["prioridad"].isin(prioridades).to_numpy()
+    if meses_entre is not None:
+        filtro &= tabla["meses_entre_mttos"].between(*meses_entre).to_numpy()
+    
+    resultado = tabla[filtro]
+    
+    # Desempate estable por sitio y mes para que las páginas no cambien entre ejecuciones
+    columnas_orden = [orden] + [c for c in ["site ID", "mes_pendiente"] if c != orden]
+    return resultado.sort_values(
+        columnas_orden,
+        ascending=[not descendente] + [True] * (len(columnas_orden) - 1),
+        kind="stable"
+    )
+
+# === ÍNDICE DE BÚSQUEDA DE SITIOS ===
+def normalizar_texto(texto):
+    """Minúsculas, sin tildes y con espacios simples"""
+    texto = unicodedata.normalize("NFKD", str(texto)).encode("ascii", "ignore").decode()
+    return " ".join(texto.lower().split())
+
+def trigramas(texto):
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def construir_indice_busqueda(dim_sitios):
+    """
+    Índice de búsqueda sobre Site Id y nombre del sitio (una vez por carga):
+    - claves normalizadas ordenadas, para encontrar por búsqueda binaria todas las
+      que empiezan con el texto escrito (equivalente a recorrer un trie de prefijos)
+    - trigrama → posiciones de los sitios que lo contienen, para la búsqueda aproximada.
+      Los trigramas presentes en más de la mitad de los sitios (p. ej. el prefijo
+      común de los Site Id) guardan la lista inversa: los sitios que NO lo tienen.
+    """
+    sitios = dim_sitios.index.to_numpy()
+    ids = [normalizar_texto(site) for site in sitios]
+    nombres = [normalizar_texto(nombre) for nombre in dim_sitios[COL_SITE].fillna("")]
+    
+    claves = np.array(ids + nombres)
+    posiciones = np.tile(np.arange(len(sitios), dtype=np.int32), 2)
+    es_nombre = np.repeat([False, True], len(sitios))
+    orden = np.argsort(claves, kind="stable")
+    
+    listas_trigramas = {}
+    n_trigramas = np.zeros(len(sitios), dtype=np.int32)
+    for posicion, (site_id, nombre) in enumerate(zip(ids, nombres)):
+        trigramas_sitio = trigramas(f"{site_id} {nombre}")
+        n_trigramas[posicion] = len(trigramas_sitio)
+        for trigrama in trigramas_sitio:
+            listas_trigramas.setdefault(trigrama, []).append(posicion)
+    
+    indice_trigramas = {}
+    for trigrama, lista in listas_trigramas.items():
+        lista = np.array(lista, dtype=np.int32)
+        if len(lista) > len(sitios) // 2:
+            indice_trigramas[trigrama] = (True, np.setdiff1d(np.arange(len(sitios), dtype=np.int32), lista))
+        else:
+            indice_trigramas[trigrama] = (False, lista)
+    
+    return {
+        'sitios': sitios,
+        'claves': claves[orden],
+        'posiciones': posiciones[orden],
+        'es_nombre': es_nombre[orden],
+        'trigramas': indice_trigramas,
+        'n_trigramas': n_trigramas
+    }
+
+def buscar_sitios(indice, texto, limite=RESULTADOS_BUSQUEDA):
+    """
+    Devuelve hasta `limite` Site Ids para el texto buscado, en este orden:
+    prefijo del Site Id, prefijo del nombre y, si faltan, los más parecidos por
+    trigramas (ordenados por similitud de Jaccard, entre los que contienen al
+    menos SIMILITUD_MINIMA_BUSQUEDA de los trigramas buscados).
+    """
+    consulta = normalizar_texto(texto)
+    if not consulta:
+        return []
+    
+    # Coincidencias por prefijo: un rango contiguo de las claves ordenadas
+    inicio = np.searchsorted(indice['claves'], consulta, side="left")
+    fin = np.searchsorted(indice['claves'], consulta + "\uffff", side="left")
+    posiciones = indice['posiciones'][inicio:fin]
+    es_nombre = indice['es_nombre'][inicio:fin]
+    
+    encontrados = dict.fromkeys(np.concatenate([
+        posiciones[~es_nombre][:limite], posiciones[es_nombre][:limite]
+    ]).tolist())
+    
+    # Búsqueda aproximada por trigramas solo si no alcanzan los resultados exactos
+    if len(encontrados) < limite:
+        trigramas_consulta = trigramas(consulta)
+        n_sitios = len(indice['sitios'])
+        coincidencias = np.zeros(n_sitios, dtype=np.int32)
+        
+        for trigrama in trigramas_consulta:
+            if trigrama not in indice['trigramas']:
+                continue
+            es_inversa, lista = indice['trigramas'][trigrama]
+            if es_inversa:
+                # Todos suman uno, menos los pocos sitios que no tienen el trigrama
+                coincidencias += 1
+                coincidencias[lista] -= 1
+            else:
+                coincidencias[lista] += 1
+        
+        candidatos = np.flatnonzero(coincidencias >= SIMILITUD_MINIMA_BUSQUEDA * len(trigramas_consulta))
+        if len(candidatos):
+            similitud = coincidencias[candidatos] / (
+                len(trigramas_consulta) + indice['n_trigramas'][candidatos] - coincidencias[candidatos]
+            )
+            
+            # Solo se ordenan los mejores candidatos, no todos
+            k = min(2 * limite, len(candidatos))
+            mejores = np.argpartition(-similitud, k - 1)[:k]
+            mejores = mejores[np.argsort(-similitud[mejores], kind="stable")]
+            for posicion in candidatos[mejores].tolist():
+                encontrados.setdefault(posicion)
+    
+    return indice['sitios'][list(encontrados)[:limite]].tolist()
+
+# === FUNCIÓN DE PREDICCIÓN ===
+def numero_mes(meses):
+    """'YYYY-MM' → meses desde el año 0, para restar meses con enteros"""
+    return meses.str[:4].astype(int) * 12 + meses.str[5:7].astype(int) - 1
+
+def texto_mes(numeros):
+    """Inverso de numero_mes: meses desde el año 0 → 'YYYY-MM'"""
+    numeros = pd.Series(numeros)
+    return (numeros // 12).astype(str) + "-" + (numeros % 12 + 1).astype(str).str.zfill(2)
+
+def indexar_frecuencias(df_frecuencias, dim_sitios):
+    """
+    Índice de frecuencias anuales (mantenimientos por año) por sitio y especialidad.
+    
+    Si el libro de frecuencias trae la columna de especialidad, cada fila vale para su
+    par (sitio, especialidad); las filas sin especialidad, o un libro sin esa columna,
+    valen para todas las especialidades del sitio. Las claves repetidas se quedan con la
+    última fila.
+    
+    Returns:
+        dict: {'por_especialidad': Serie (Site Id, especialidad) → frecuencia,
+               'por_sitio': Serie Site Id → frecuencia,
+               'duplicados': filas con clave repetida,
+               'invalidas': filas sin Site Id o con frecuencia no numérica o negativa,
+               'sitios_sin_frecuencia': sitios de los datos sin frecuencia,
+               'sitios_desconocidos': sitios del libro que no aparecen en los datos}
+    """
+    columnas = [c for c in [COL_SITE_ID, COL_ESPECIALIDAD] if c in df_frecuencias.columns]
+    if COL_SITE_ID not in columnas or "frecuencia" not in df_frecuencias.columns:
+        frecuencias = pd.DataFrame(columns=[COL_SITE_ID, COL_ESPECIALIDAD, "frecuencia"])
+    else:
+        frecuencias = df_frecuencias[columnas + ["frecuencia"]].copy()
+    if COL_ESPECIALIDAD not in frecuencias.columns:
+        frecuencias[COL_ESPECIALIDAD] = np.nan
+    
+    frecuencias[COL_SITE_ID] = frecuencias[COL_SITE_ID].astype(str).str.strip().where(frecuencias[COL_SITE_ID].notna())
+    frecuencias["frecuencia"] = pd.to_numeric(frecuencias["frecuencia"], errors="coerce")
+    
+    validas = frecuencias[COL_SITE_ID].notna() & (frecuencias["frecuencia"] >= 0)
+    invalidas = frecuencias[~validas]
+    frecuencias = frecuencias[validas]
+    
+    clave = [COL_SITE_ID, COL_ESPECIALIDAD]
+    repetidas = frecuencias.duplicated(clave, keep=False)
+    duplicados = frecuencias[repetidas]
+    frecuencias = frecuencias.drop_duplicates(clave, keep="last")
+    
+    general = frecuencias[COL_ESPECIALIDAD].isna()
+    por_sitio = frecuencias[general].set_index(COL_SITE_ID)["frecuencia"].sort_index()
+    por_especialidad = frecuencias[~general].set_index(clave)["frecuencia"].sort_index()
+    
+    sitios_archivo = por_sitio.index.union(por_especialidad.index.unique(COL_SITE_ID))
+    return {
+        'por_especialidad': por_especialidad,
+        'por_sitio': por_sitio,
+        'duplicados': duplicados,
+        'invalidas': invalidas,
+        'sitios_sin_frecuencia': dim_sitios.index.difference(sitios_archivo),
+        'sitios_desconocidos': sitios_archivo.difference(dim_sitios.index)
+    }
+
+def frecuencia_anual(indice_frecuencias, sitios, especialidades):
+    """
+    Frecuencia anual de cada par (sitio, especialidad): la de la especialidad si el
+    libro la trae, si no la del sitio; NaN si el sitio no tiene frecuencia.
+    """
+    sitios = pd.Index(sitios)
+    frecuencia = indice_frecuencias['por_sitio'].reindex(sitios).to_numpy(dtype=float)
+    
+    por_especialidad = indice_frecuencias['por_especialidad']
+    if not por_especialidad.empty:
+        especialidades = np.broadcast_to(np.asarray(especialidades, dtype=object), len(sitios))
+        propia = por_especialidad.reindex(pd.MultiIndex.from_arrays([sitios, especialidades])).to_numpy(dtype=float)
+        frecuencia = np.where(np.isnan(propia), frecuencia, propia)
+    
+    return frecuencia
+
+def meses_entre_mantenimientos(indice_frecuencias, sitios, especialidades):
+    """Meses entre mantenimientos (12 / frecuencia anual) de cada par; NaN si no tiene frecuencia"""
+    frecuencia = frecuencia_anual(indice_frecuencias, sitios, especialidades)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(frecuencia > 0, 12 / frecuencia, np.nan)
+
+def proyectar_vencimientos(ultimo, intervalo, desde, hasta, tolerancia=TOLERANCIA_PREDICCION):
+    """
+    Proyecta los vencimientos de mantenimiento de varios sitio-especialidad a la vez.
+    
+    Los vencimientos son ultimo + k * intervalo (k = 1, 2, ...), con intervalos
+    fraccionarios. Cada vencimiento reparte un mantenimiento entre los meses a menos de
+    `tolerancia` + 1 meses, con pesos triangulares que suman 1: con tolerancia 0 y un
+    intervalo entero cae todo en el mes exacto; con intervalos fraccionarios se reparte
+    entre los dos meses vecinos.
+    
+    Args:
+        ultimo: mes (numero_mes) del último mantenimiento de cada fila
+        intervalo: meses entre mantenimientos de cada fila (> 0)
+        desde, hasta: meses (inclusive) en los que interesa la proyección de cada fila
+        tolerancia: meses de adelanto o atraso admitidos alrededor de cada vencimiento
+    
+    Returns:
+        tuple: (fila, mes, peso) con la fracción de mantenimiento esperada de cada fila en cada mes
+    """
+    ancho = tolerancia + 1
+    ultimo = np.asarray(ultimo, dtype=float)
+    intervalo = np.asarray(intervalo, dtype=float)
+    desde = np.asarray(desde, dtype=float)
+    hasta = np.asarray(hasta, dtype=float)
+    
+    # Vencimientos cuyo reparto alcanza [desde, hasta]
+    k_min = np.maximum(1, np.floor((desde - ancho - ultimo) / intervalo) + 1)
+    k_max = np.ceil((hasta + ancho - ultimo) / intervalo) - 1
+    cantidad = np.clip(k_max - k_min + 1, 0, None).astype(int)
+    fila = np.repeat(np.arange(len(ultimo)), cantidad)
+    inicio = np.cumsum(cantidad) - cantidad
+    k = k_min[fila] + (np.arange(len(fila)) - inicio[fila])
+    vencimiento = ultimo[fila] + k * intervalo[fila]
+    
+    # Meses alrededor de cada vencimiento y su peso triangular
+    desplazamientos = np.arange(1 - ancho, ancho + 1)
+    mes = np.floor(vencimiento)[:, None] + desplazamientos[None, :]
+    peso = np.clip(1 - np.abs(mes - vencimiento[:, None]) / ancho, 0, None) / ancho
+    fila = np.broadcast_to(fila[:, None], mes.shape)
+    
+    dentro = (peso > 0) & (mes >= desde[fila]) & (mes <= hasta[fila])
+    return fila[dentro], mes[dentro].astype(int), peso[dentro]
+
+def predecir_mantenimientos_especialidad(conteo_largo, indice_frecuencias, especialidad, meses_a_predecir=1,
+                                         tolerancia=TOLERANCIA_PREDICCION):
+    """
+    Predice la cantidad de mantenimientos esperados para una especialidad en los próximos meses.
+    
+    Args:
+        conteo_largo: Ejecutados por (Site Id, MES, especialidad)
+        indice_frecuencias: Índice de frecuencias anuales (ver indexar_frecuencias)
+        especialidad: Especialidad a predecir
+        meses_a_predecir: Cantidad de meses a predecir (default: 1)
+        tolerancia: Meses de tolerancia alrededor de cada vencimiento (ver proyectar_vencimientos)
+    
+    Returns:
+        DataFrame con predicciones por mes
+    """
+    # Solo los ejecutados de la especialidad con mes conocido
+    conteo_esp = conteo_largo[(conteo_largo[COL_ESPECIALIDAD] == especialidad) &
+                              (conteo_largo["MES"] != "Fecha desconocida")]
+    
+    if conteo_esp.empty:
+        return pd.DataFrame()
+    
+    # Último mantenimiento y promedio real (total mttos / cantidad de meses con datos) por sitio
+    por_sitio = conteo_esp.groupby(COL_SITE_ID, observed=True).agg(
+        size=("cantidad", "sum"), nunique=("MES", "nunique"), max=("MES", "max")
+    )
+    sitios = por_sitio.index.to_numpy()
+    ultimo = numero_mes(por_sitio["max"]).to_numpy()
+    promedio = np.ceil(por_sitio["size"] / por_sitio["nunique"]).to_numpy()
+    intervalo = meses_entre_mantenimientos(indice_frecuencias, sitios, especialidad)
+    
+    # Último mes con datos de la especialidad
+    ultimo_mes = ultimo.max()
+    
+    con_frecuencia = np.flatnonzero(~np.isnan(intervalo))
+    fila, mes, peso = proyectar_vencimientos(
+        ultimo[con_frecuencia], intervalo[con_frecuencia],
+        np.full(len(con_frecuencia), ultimo_mes + 1), np.full(len(con_frecuencia), ultimo_mes + meses_a_predecir),
+        tolerancia
+    )
+    fila = con_frecuencia[fila]
+    
+    detalle = pd.DataFrame({
+        "site": sitios[fila],
+        "ultimo_mtto": por_sitio["max"].to_numpy()[fila],
+        "meses_transcurridos": mes - ultimo[fila],
+        "frecuencia_esperada_meses": intervalo[fila].round(1),
+        "probabilidad": peso.round(2),
+        "mttos_esperados": (promedio[fila] * peso).round(2),
+        "mes": mes
+    })
+    
+    predicciones = []
+    for i in range(1, meses_a_predecir + 1):
+        mes_prediccion = ultimo_mes + i
+        detalle_mes = detalle[detalle["mes"] == mes_prediccion].drop(columns="mes")
+        
+        predicciones.append({
+            "mes": texto_mes([mes_prediccion]).iloc[0],
+            "total_esperado": round(detalle_mes["mttos_esperados"].sum(), 1),
+            "cantidad_sitios": len(detalle_mes),
+            "detalle_sitios": detalle_mes.to_dict("records")
+        })
+    
+    return pd.DataFrame(predicciones)
+
+def backtest_predicciones(conteo_largo, indice_frecuencias, dim_sitios, horizonte=HORIZONTE_BACKTEST,
+                          tolerancia=TOLERANCIA_PREDICCION):
+    """
+    Reproduce predecir_mantenimientos_especialidad en cada mes de corte de la historia,
+    usando solo los datos hasta ese mes, y compara lo predicho para los `horizonte`
+    meses siguientes con lo ejecutado realmente.
+    
+    Cada ejecución de un sitio-especialidad fija su estado (último mantenimiento y
+    promedio por mes) para los cortes hasta su siguiente ejecución, y se proyecta una
+    sola vez sobre todos los meses que esos cortes pueden predecir. Así todos los cortes
+    se evalúan a la vez, sin repetir la predicción por corte.
+    
+    Returns:
+        DataFrame con una fila por especialidad, prioridad, corte y horizonte:
+        predichos, reales y error (predichos - reales)
+    """
+    conteo = conteo_largo[conteo_largo["MES"] != "Fecha desconocida"]
+    if conteo.empty:
+        return pd.DataFrame()
+    
+    conteo = (
+        conteo.groupby([COL_ESPECIALIDAD, COL_SITE_ID, "MES"], observed=True)["cantidad"]
+        .sum().rename("reales").reset_index()
+    )
+    conteo["mes"] = numero_mes(conteo["MES"])
+    conteo = conteo.sort_values([COL_ESPECIALIDAD, COL_SITE_ID, "mes"], kind="stable", ignore_index=True)
+    conteo["prioridad"] = conteo[COL_SITE_ID].map(dim_sitios[COL_PRIORIDAD]).fillna("Sin prioridad")
+    primer_mes, ultimo_mes = conteo["mes"].min(), conteo["mes"].max()
+    
+    # Estado del sitio-especialidad después de cada ejecución, vigente hasta la siguiente
+    por_sitio = conteo.groupby([COL_ESPECIALIDAD, COL_SITE_ID], sort=False)
+    conteo["promedio"] = np.ceil(por_sitio["reales"].cumsum() / (por_sitio.cumcount() + 1))
+    ultimo_corte = (por_sitio["mes"].shift(-1) - 1).fillna(ultimo_mes).to_numpy()
+    
+    # Proyección de cada estado sobre los meses que predicen sus cortes
+    intervalo = meses_entre_mantenimientos(indice_frecuencias, conteo[COL_SITE_ID], conteo[COL_ESPECIALIDAD])
+    con_frecuencia = np.flatnonzero(~np.isnan(intervalo))
+    mes_estado = conteo["mes"].to_numpy()
+    fila, mes, peso = proyectar_vencimientos(
+        mes_estado[con_frecuencia], intervalo[con_frecuencia],
+        mes_estado[con_frecuencia] + 1, np.minimum(ultimo_corte[con_frecuencia] + horizonte, ultimo_mes),
+        tolerancia
+    )
+    fila = con_frecuencia[fila]
+    
+    # Cortes desde los que cada mes proyectado queda a 1..horizonte meses
+    horizontes = np.arange(1, horizonte + 1)
+    corte = mes[:, None] - horizontes[None, :]
+    vigente = (corte >= mes_estado[fila][:, None]) & (corte <= ultimo_corte[fila][:, None])
+    i, j = np.nonzero(vigente)
+    predichos = (
+        pd.DataFrame({
+            "especialidad": conteo[COL_ESPECIALIDAD].to_numpy()[fila[i]],
+            "prioridad": conteo["prioridad"].to_numpy()[fila[i]],
+            "corte": corte[i, j],
+            "horizonte": horizontes[j],
+            "predichos": conteo["promedio"].to_numpy()[fila[i]] * peso[i]
+        })
+        .groupby(["especialidad", "prioridad", "corte", "horizonte"])["predichos"].sum()
+    )
+    reales = conteo.groupby([COL_ESPECIALIDAD, "prioridad", "mes"])["reales"].sum()
+    
+    # Todos los cortes con su mes objetivo dentro de la historia, para cada especialidad y prioridad
+    grilla = pd.MultiIndex.from_product(
+        [conteo[COL_ESPECIALIDAD].unique(), conteo["prioridad"].unique(),
+         np.arange(primer_mes, ultimo_mes), horizontes],
+        names=["especialidad", "prioridad", "corte", "horizonte"]
+    ).to_frame(index=False)
+    grilla = grilla[grilla["corte"] + grilla["horizonte"] <= ultimo_mes]
+    
+    mes_objetivo = grilla["corte"] + grilla["horizonte"]
+    grilla["predichos"] = predichos.reindex(pd.MultiIndex.from_frame(grilla), fill_value=0).to_numpy()
+    grilla["reales"] = reales.reindex(
+        pd.MultiIndex.from_arrays([grilla["especialidad"], grilla["prioridad"], mes_objetivo]),
+        fill_value=0
+    ).to_numpy()
+    grilla["error"] = grilla["predichos"] - grilla["reales"]
+    grilla["mes"] = texto_mes(mes_objetivo).to_numpy()
+    grilla["corte"] = texto_mes(grilla["corte"]).to_numpy()
+    
+    return grilla.astype({"especialidad": "category", "prioridad": "category"})
+
+def resumir_backtest(backtest, columnas):
+    """MAE y sesgo (predichos - reales, promedio) del backtest agrupado por `columnas`"""
+    return (
+        backtest.assign(error_absoluto=backtest["error"].abs())
+        .groupby(columnas, observed=True)
+        .agg(
+            cortes=("error", "size"),
+            reales_promedio=("reales", "mean"),
+            predichos_promedio=("predichos", "mean"),
+            mae=("error_absoluto", "mean"),
+            sesgo=("error", "mean")
+        )
+        .round(2)
+        .reset_index()
+    )
+
+# === CUMPLIMIENTO DE FRECUENCIAS ===
+def resumir_ejecuciones_por_par(df, fecha_corte):
+    """
+    Ejecuciones de cada par (sitio, especialidad) con registros: cantidad en el año de
+    `fecha_corte` y fecha del último mantenimiento hasta el corte (el inicio del mes si
+    no tiene Complete Time). Ver resumir_ejecuciones_por_par_bd.
+    """
+    fecha_corte = pd.Timestamp(fecha_corte)
+    inicio_anio = pd.Timestamp(year=fecha_corte.year, month=1, day=1)
+    
+    fecha = pd.to_datetime(df[COL_COMPLETE_TIME], errors="coerce").fillna(
+        pd.to_datetime(df["MES"], format="%Y-%m", errors="coerce")
+    )
+    fecha = fecha.where((df[COL_ESTADO].str.lower() == "ejecutado") & (fecha <= fecha_corte))
+    
+    return (
+        df[[COL_SITE_ID, COL_ESPECIALIDAD]].assign(fecha=fecha, en_anio=fecha >= inicio_anio)
+        .groupby([COL_SITE_ID, COL_ESPECIALIDAD], observed=True)
+        .agg(ejecutados=("en_anio", "sum"), ultimo_mtto=("fecha", "max"))
+    )
+
+def calcular_cumplimiento_frecuencias(ejecuciones_por_par, indice_frecuencias, dim_sitios, fecha_corte):
+    """
+    Compara, para cada par (sitio, especialidad) con frecuencia planificada, los
+    mantenimientos que ya deberían haberse hecho en el año de `fecha_corte` con los
+    ejecutados en ese año, y los días de atraso respecto al próximo vencimiento.
+    
+    - esperados: vencimientos del año hasta la fecha de corte, floor(frecuencia × fracción del año)
+    - próximo vencimiento: último mantenimiento + 365.25 / frecuencia días
+      (sin mantenimientos, desde el inicio del año)
+    
+    Todo sale de conteos agregados por par (resumir_ejecuciones_por_par) y de un
+    único join, así se recalcula en cada recarga de datos.
+    
+    Returns:
+        DataFrame con una fila por par: frecuencia, esperados, ejecutados, faltantes,
+        cumplimiento (%), último mantenimiento, próximo vencimiento y días vencido
+    """
+    fecha_corte = pd.Timestamp(fecha_corte)
+    inicio_anio = pd.Timestamp(year=fecha_corte.year, month=1, day=1)
+    dias_anio = 366 if fecha_corte.is_leap_year else 365
+    fraccion_anio = ((fecha_corte - inicio_anio).days + 1) / dias_anio
+    
+    # Pares (sitio, especialidad) con registros y su frecuencia planificada
+    pares = ejecuciones_por_par.index
+    frecuencia = frecuencia_anual(
+        indice_frecuencias, pares.get_level_values(0), pares.get_level_values(1)
+    )
+    planificados = frecuencia > 0
+    cumplimiento = pd.DataFrame(
+        {"frecuencia": frecuencia[planificados]}, index=pares[planificados]
+    )
+    
+    cumplimiento = cumplimiento.join(ejecuciones_por_par, how="left")
+    cumplimiento["ejecutados"] = cumplimiento["ejecutados"].fillna(0).astype("int32")
+    cumplimiento["esperados"] = np.floor(cumplimiento["frecuencia"] * fraccion_anio).astype("int32")
+    cumplimiento["faltantes"] = (cumplimiento["esperados"] - cumplimiento["ejecutados"]).clip(lower=0)
+    cumplimiento["cumplimiento"] = (
+        cumplimiento["ejecutados"] / cumplimiento["esperados"].where(cumplimiento["esperados"] > 0) * 100
+    ).round(1)
+    
+    intervalo = pd.to_timedelta(365.25 / cumplimiento["frecuencia"], unit="D")
+    cumplimiento["proximo_vencimiento"] = (
+        cumplimiento["ultimo_mtto"].fillna(inicio_anio) + intervalo
+    ).dt.normalize()
+    cumplimiento["dias_vencido"] = (
+        (fecha_corte.normalize() - cumplimiento["proximo_vencimiento"]).dt.days.clip(lower=0).astype("int32")
+    )
+    
+    cumplimiento = cumplimiento.reset_index().join(
+        dim_sitios[[COL_SITE, COL_PRIORIDAD, COL_CONTRATISTA, COL_FLM_ESPECIFICO]], on=COL_SITE_ID
+    )
+    for columna in [COL_ESPECIALIDAD, COL_PRIORIDAD, COL_CONTRATISTA, COL_FLM_ESPECIFICO]:
+        cumplimiento[columna] = cumplimiento[columna].astype("category")
+    
+    return cumplimiento[[
+        COL_SITE_ID, COL_SITE, COL_ESPECIALIDAD, COL_PRIORIDAD, COL_CONTRATISTA, COL_FLM_ESPECIFICO,
+        "frecuencia", "esperados", "ejecutados", "faltantes", "cumplimiento",
+        "ultimo_mtto", "proximo_vencimiento", "dias_vencido"
+    ]]
+
+def resumir_cumplimiento(cumplimiento, columna):
+    """
+    Cumplimiento de frecuencias agrupado por `columna` (contratista, prioridad, ...).
+    Los ejecutados de más en un par no compensan los faltantes de otro.
+    """
+    return (
+        cumplimiento.assign(
+            cumplidos=np.minimum(cumplimiento["ejecutados"], cumplimiento["esperados"]),
+            vencido=cumplimiento["dias_vencido"] > 0,
+            dias_vencido=cumplimiento["dias_vencido"].where(cumplimiento["dias_vencido"] > 0)
+        )
+        .groupby(columna, observed=True)
+        .agg(
+            pares=("esperados", "size"),
+            sitios=(COL_SITE_ID, "nunique"),
+            esperados=("esperados", "sum"),
+            ejecutados=("ejecutados", "sum"),
+            cumplidos=("cumplidos", "sum"),
+            faltantes=("faltantes", "sum"),
+            pares_vencidos=("vencido", "sum"),
+            dias_vencido_promedio=("dias_vencido", "mean")
+        )
+        .assign(cumplimiento=lambda resumen: (
+            resumen["cumplidos"] / resumen["esperados"].where(resumen["esperados"] > 0) * 100
+        ).round(1))
+        .round({"dias_vencido_promedio": 1})
+        .sort_values("cumplimiento")
+        .reset_index()
+    )
+
+# === RESOLUCIÓN DE PENDIENTES ===
+def pendientes_y_ejecuciones(df):
+    """
+    Entradas de resolver_pendientes y alertar_pendientes (ver pendientes_y_ejecuciones_bd):
+    - pendientes: registros pendientes con mes conocido ("registro" = índice en df)
+    - ejecuciones: primera ejecución de cada (sitio, especialidad, mes), con su
+      Complete Time (el inicio de su mes si no la tiene)
+    - registros_por_mes: por (sitio, especialidad, mes) los registros programados,
+      los ejecutados y el estado del primer registro
+    """
+    estado = df[COL_ESTADO].str.lower()
+    validos = df["MES"] != "Fecha desconocida"
+    claves = [COL_SITE_ID, COL_ESPECIALIDAD]
+    
+    pendientes = df.loc[
+        (estado == "pendiente") & validos,
+        claves + ["MES", COL_PRIORIDAD, COL_CONTRATISTA, COL_FLM_ESPECIFICO]
+    ].rename_axis("registro").reset_index()
+    
+    ejecutados = df.loc[(estado == "ejecutado") & validos, claves + ["MES", COL_COMPLETE_TIME]]
+    complete_time = pd.to_datetime(ejecutados[COL_COMPLETE_TIME], errors="coerce")
+    ejecuciones = (
+        ejecutados.assign(
+            fecha_resolucion=complete_time.fillna(pd.to_datetime(ejecutados["MES"], format="%Y-%m")),
+            fecha_aproximada=complete_time.isna()
+        )
+        .sort_values("fecha_resolucion", kind="stable")
+        .drop_duplicates(claves + ["MES"])
+        .rename(columns={"MES": "mes_resolucion"})
+        [claves + ["mes_resolucion", "fecha_resolucion", "fecha_aproximada"]]
+    )
+    
+    registros_por_mes = (
+        df.loc[validos, claves + ["MES"]]
+        .assign(estado=estado[validos].fillna(""), ejecutado=(estado[validos] == "ejecutado"))
+        .groupby(claves + ["MES"], sort=False)
+        .agg(programados=("ejecutado", "size"), ejecutados=("ejecutado", "sum"), estado=("estado", "first"))
+        .reset_index()
+    )
+    
+    return pendientes, ejecuciones, registros_por_mes
+
+def resolver_pendientes(pendientes, ejecuciones, fecha_corte):
+    """
+    Para cada registro pendiente busca cuándo se resolvió: el primer mantenimiento
+    ejecutado del mismo sitio y especialidad programado en un mes posterior. La fecha
+    de resolución es su Complete Time (el inicio de su mes si no la tiene) y los días
+    se cuentan desde el fin del mes pendiente.
+    
+    Un único merge_asof hacia adelante por (sitio, especialidad) resuelve todos los
+    pendientes a la vez.
+    
+    Args:
+        pendientes, ejecuciones: ver pendientes_y_ejecuciones
+    
+    Returns:
+        tuple: (resolucion, backlog_abierto)
+        - resolucion: una fila por registro pendiente (índice "registro") con
+          mes y fecha de resolución, meses y días hasta resolverse
+        - backlog_abierto: pendientes aún sin resolver, indexados por (Site Id, especialidad)
+    """
+    fecha_corte = pd.Timestamp(fecha_corte)
+    claves = [COL_SITE_ID, COL_ESPECIALIDAD]
+    
+    pendientes = pendientes.assign(mes=numero_mes(pendientes["MES"]))
+    ejecuciones = ejecuciones.assign(mes_ejecucion=numero_mes(ejecuciones["mes_resolucion"]))
+    
+    # Siguiente mes (estrictamente posterior) con ejecución del mismo par
+    resolucion = pd.merge_asof(
+        pendientes.sort_values("mes", kind="stable"),
+        ejecuciones.sort_values("mes_ejecucion", kind="stable"),
+        left_on="mes",
+        right_on="mes_ejecucion",
+        by=claves,
+        direction="forward",
+        allow_exact_matches=False
+    ).set_index("registro").sort_index()
+    
+    fin_mes_pendiente = pd.to_datetime(texto_mes(resolucion["mes"] + 1).to_numpy(), format="%Y-%m")
+    resolucion["resuelto"] = resolucion["mes_ejecucion"].notna()
+    resolucion["meses_resolucion"] = resolucion["mes_ejecucion"] - resolucion["mes"]
+    resolucion["dias_resolucion"] = (resolucion["fecha_resolucion"] - fin_mes_pendiente).dt.days.clip(lower=0)
+    resolucion = resolucion.drop(columns=["mes", "mes_ejecucion"])
+    for columna in [COL_ESPECIALIDAD, COL_PRIORIDAD, COL_CONTRATISTA, COL_FLM_ESPECIFICO]:
+        resolucion[columna] = resolucion[columna].astype("category")
+    
+    # Pendientes abiertos a la fecha de corte, con búsqueda por sitio y especialidad
+    abiertos = ~resolucion["resuelto"].to_numpy()
+    backlog_abierto = resolucion.loc[
+        abiertos, claves + ["MES", COL_PRIORIDAD, COL_CONTRATISTA, COL_FLM_ESPECIFICO]
+    ].assign(
+        meses_abierto=(
+            numero_mes(pd.Series([fecha_corte.strftime("%Y-%m")])).iloc[0]
+            - numero_mes(resolucion.loc[abiertos, "MES"])
+        ).astype("int16"),
+        dias_abierto=np.maximum((fecha_corte - fin_mes_pendiente[abiertos]).days.to_numpy(), 0)
+    ).set_index(claves).sort_index()
+    
+    return resolucion, backlog_abierto
+
+def distribuir_latencia(resolucion, columna):
+    """Distribución de los días hasta resolver un pendiente (promedio y percentiles) por `columna`"""
+    por_grupo = resolucion.groupby(columna, observed=True)
+    resueltos = resolucion[resolucion["resuelto"]].groupby(columna, observed=True)
+    percentiles = resueltos["dias_resolucion"].quantile([0.5, 0.75, 0.9]).unstack()
+    
+    return pd.DataFrame({
+        "pendientes": por_grupo.size(),
+        "resueltos": resueltos.size(),
+        "abiertos": (~resolucion["resuelto"]).groupby(resolucion[columna], observed=True).sum(),
+        "meses_promedio": resueltos["meses_resolucion"].mean(),
+        "dias_promedio": resueltos["dias_resolucion"].mean(),
+        "dias_p50": percentiles.get(0.5),
+        "dias_p75": percentiles.get(0.75),
+        "dias_p90": percentiles.get(0.9),
+        "dias_maximo": resueltos["dias_resolucion"].max()
+    }).fillna({"resueltos": 0}).astype({"resueltos": int}).round(1).rename_axis(columna).reset_index()
+
+# === DESEMPEÑO POR CONTRATISTA Y FLM ===
+def contar_estados(df):
+    """Registros por (contratista, FLM, estado en minúsculas), incluidos los vacíos (ver contar_estados_bd)"""
+    return (
+        df.groupby(
+            [df[COL_CONTRATISTA], df[COL_FLM_ESPECIFICO], df[COL_ESTADO].str.lower().rename("estado")],
+            dropna=False, observed=True
+        )
+        .size()
+        .reset_index(name="cantidad")
+    )
+
+def resumir_desempeno(conteo_estados, dim_sitios, eliminadas, sitios_incompletos, resolucion_pendientes,
+                      cumplimiento, columna):
+    """
+    Indicadores por contratista o FLM (`columna`), con agregaciones por grupo:
+    - de los registros (según el contratista/FLM de cada registro, ver contar_estados):
+      % de ejecución, pendientes aún sin ejecutar, % de cancelación y meses promedio
+      de pendiente a ejecutado (resolver_pendientes)
+    - de los sitios (según su contratista/FLM actual): sitios con especialidades
+      eliminadas y sitios con ejecución incompleta
+    - cumplimiento de frecuencias del año (resumir_cumplimiento)
+    """
+    estado = conteo_estados["estado"]
+    cantidad = conteo_estados["cantidad"]
+    resueltos = resolucion_pendientes[resolucion_pendientes["resuelto"]].groupby(columna, observed=True)
+    registros = (
+        pd.DataFrame({
+            columna: conteo_estados[columna],
+            "registros": cantidad,
+            "ejecutados": cantidad.where(estado == "ejecutado", 0),
+            "pendientes": cantidad.where(estado == "pendiente", 0),
+            "cancelados": cantidad.where(estado == "cancelado", 0)
+        })
+        .groupby(columna, observed=True)
+        .sum()
+    )
+    # Los pendientes sin resolver incluyen los de mes desconocido
+    registros["backlog_pendiente"] = registros["pendientes"] - resueltos.size().reindex(registros.index, fill_value=0)
+    registros["meses_promedio_resolucion"] = resueltos["meses_resolucion"].mean().reindex(registros.index)
+    
+    especialidades_eliminadas = pd.Series(
+        {site: len(esps) for site, esps in eliminadas.items() if esps}, dtype=int
+    )
+    sitios = dim_sitios[[columna]].assign(
+        especialidades_eliminadas=especialidades_eliminadas.reindex(dim_sitios.index, fill_value=0),
+        con_eliminadas=lambda tabla: tabla["especialidades_eliminadas"] > 0,
+        ejecucion_incompleta=dim_sitios.index.isin(list(sitios_incompletos))
+    ).groupby(columna, observed=True).agg(
+        sitios=("con_eliminadas", "size"),
+        sitios_con_eliminadas=("con_eliminadas", "sum"),
+        especialidades_eliminadas=("especialidades_eliminadas", "sum"),
+        sitios_ejecucion_incompleta=("ejecucion_incompleta", "sum")
+    )
+    
+    frecuencias = resumir_cumplimiento(cumplimiento, columna).set_index(columna)[["cumplimiento"]]
+    
+    resumen = sitios.join(registros, how="outer").join(
+        frecuencias.rename(columns={"cumplimiento": "cumplimiento_frecuencia"}), how="left"
+    )
+    conteos = [c for c in resumen.columns if c not in ("meses_promedio_resolucion", "cumplimiento_frecuencia")]
+    resumen[conteos] = resumen[conteos].fillna(0).astype(int)
+    
+    registros_totales = resumen["registros"].where(resumen["registros"] > 0)
+    resumen["porcentaje_ejecucion"] = (resumen["ejecutados"] / registros_totales * 100).round(1)
+    resumen["porcentaje_cancelacion"] = (resumen["cancelados"] / registros_totales * 100).round(1)
+    resumen["meses_promedio_resolucion"] = resumen["meses_promedio_resolucion"].round(1)
+    
+    return resumen.rename_axis(columna).reset_index()
+
+# === LECTURA POR BLOQUES DEL EXCEL PRINCIPAL ===
+def leer_excel_por_bloques(archivo, hoja, columnas, filas_por_bloque=FILAS_POR_BLOQUE, progreso=None):
+    """
+    Lee una hoja de Excel en modo solo lectura, fila por fila, quedándose solo con
+    `columnas`. Devuelve un generador de DataFrames de hasta `filas_por_bloque` filas,
+    así nunca se materializan las demás columnas del archivo.
+    
+    Args:
+        progreso: Función opcional que recibe la fracción leída (0 a 1)
+    """
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    
+    try:
+        hoja_excel = libro[hoja]
+        filas = hoja_excel.iter_rows(values_only=True)
+        
+        encabezado = [str(celda).strip() if celda is not None else "" for celda in next(filas)]
+        columnas_faltantes = [col for col in columnas if col not in encabezado]
+        if columnas_faltantes:
+            raise KeyError(f"Columnas no encontradas en {archivo}: {columnas_faltantes}")
+        
+        posiciones = [encabezado.index(col) for col in columnas]
+        total_filas = max((hoja_excel.max_row or 2) - 1, 1)
+        filas_leidas = 0
+        bloque = []
+        
+        for fila in filas:
+            valores = [fila[i] if i < len(fila) else None for i in posiciones]
+            
+            # Filas vacías (celdas solo con formato)
+            if all(valor is None for valor in valores):
+                continue
+            
+            bloque.append(valores)
+            
+            if len(bloque) == filas_por_bloque:
+                filas_leidas += len(bloque)
+                yield pd.DataFrame(bloque, columns=columnas)
+                bloque = []
+                if progreso:
+                    progreso(min(filas_leidas / total_filas, 1.0))
+        
+        if bloque:
+            yield pd.DataFrame(bloque, columns=columnas)
+        
+        if progreso:
+            progreso(1.0)
+    finally:
+        libro.close()
+
+def normalizar_bloque(bloque):
+    """Prepara la columna de fecha y agrega la columna MES (formato YYYY-MM)"""
+    bloque[COL_FECHA] = bloque[COL_FECHA].astype(str).str.strip().str.lower()
+    
+    # Se convierte cada valor distinto una sola vez
+    meses = {valor: convertir_mes_ano(valor) for valor in bloque[COL_FECHA].unique()}
+    bloque["MES"] = bloque[COL_FECHA].map(meses)
+    
+    return bloque
+
+def cargar_mantenimientos(archivo, hoja, progreso=None):
+    """
+    Carga el Excel principal por bloques: cada bloque se normaliza y se agrega
+    (conteo de ejecutados por sitio, mes y especialidad) antes de leer el siguiente.
+    
+    La lectura por bloques solo evita materializar las columnas no relevantes: los
+    bloques se concatenan al final, así que en memoria queda el archivo completo
+    (las columnas relevantes de todas sus filas), que las páginas filtran después.
+    
+    Returns:
+        tuple: (df con las columnas relevantes, conteo largo de ejecutados)
+    """
+    bloques = []
+    conteos = []
+    
+    for bloque in leer_excel_por_bloques(archivo, hoja, columnas_relevantes, progreso=progreso):
+        bloque = normalizar_bloque(bloque)
+        bloques.append(bloque)
+        
+        ejecutados = bloque[bloque[COL_ESTADO].str.lower() == "ejecutado"]
+        conteos.append(
+            ejecutados.groupby([COL_SITE_ID, "MES", COL_ESPECIALIDAD]).size()
+        )
+    
+    if not bloques:
+        df = pd.DataFrame(columns=columnas_relevantes + ["MES"])
+        return df, pd.DataFrame(columns=[COL_SITE_ID, "MES", COL_ESPECIALIDAD, "cantidad"])
+    
+    df = pd.concat(bloques, ignore_index=True)
+    conteo_largo = (
+        pd.concat(conteos)
+        .groupby(level=[0, 1, 2])
+        .sum()
+        .reset_index(name="cantidad")
+    )
+    
+    return df, conteo_largo
+
+def leer_fuentes_en_paralelo(progreso=None):
+    """
+    Lee los tres libros fuente a la vez. El parseo de openpyxl usa CPU, así que
+    frecuencias y anulaciones se leen en procesos aparte mientras el libro
+    principal se lee por bloques en este proceso.
+    
+    Returns:
+        tuple: (df, conteo_largo, df_frecuencias, df_anulaciones, tiempos)
+               donde tiempos = {archivo: segundos hasta terminar su lectura}
+    """
+    tiempos = {}
+    inicio = time.perf_counter()
+    
+    def registrar_tiempo(archivo):
+        return lambda _: tiempos.__setitem__(archivo, time.perf_counter() - inicio)
+    
+    # "spawn" evita hacer fork del servidor de Streamlit (que tiene varios hilos)
+    contexto = multiprocessing.get_context("spawn")
+    
+    with ProcessPoolExecutor(max_workers=2, mp_context=contexto) as pool:
+        futuro_frecuencias = pool.submit(pd.read_excel, ARCHIVO_FRECUENCIAS, sheet_name=HOJA_FRECUENCIAS)
+        futuro_frecuencias.add_done_callback(registrar_tiempo(ARCHIVO_FRECUENCIAS))
+        
+        futuro_anulaciones = pool.submit(pd.read_excel, ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
+        futuro_anulaciones.add_done_callback(registrar_tiempo(ARCHIVO_ANULACIONES))
+        
+        df, conteo_largo = cargar_mantenimientos(ARCHIVO, HOJA, progreso=progreso)
+        tiempos[ARCHIVO] = time.perf_counter() - inicio
+        
+        df_frecuencias = futuro_frecuencias.result()
+        df_anulaciones = futuro_anulaciones.result()
+    
+    return df, conteo_largo, df_frecuencias, df_anulaciones, tiempos
+
+# === EXTRACTOS MENSUALES EN PARTICIONES POR MES ===
+def ruta_manifiesto(carpeta_particiones):
+    """Archivo JSON que registra qué extractos se ingirieron y de cuál sale cada mes"""
+    return os.path.join(carpeta_particiones, "manifiesto.json")
+
+def leer_manifiesto(carpeta_particiones):
+    ruta = ruta_manifiesto(carpeta_particiones)
+    if not os.path.exists(ruta):
+        return {"extractos": {}, "particiones": {}}
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+def guardar_manifiesto(carpeta_particiones, manifiesto):
+    ruta = ruta_manifiesto(carpeta_particiones)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as archivo:
+        json.dump(manifiesto, archivo, ensure_ascii=False, indent=2)
+    os.replace(ruta + ".tmp", ruta)
+
+def ruta_particion(carpeta_particiones, mes):
+    return os.path.join(carpeta_particiones, f"MES={mes}", "datos.parquet")
+
+def filas_vigentes(particion):
+    """
+    Filas de una partición sin órdenes repetidas: si una orden de trabajo
+    (COLUMNAS_CLAVE_ORDEN) viene en varios extractos, quedan las del más reciente.
+    """
+    ordenadas = particion.sort_values(["_mtime_extracto", "_extracto"], kind="stable")
+    mas_reciente = ordenadas.groupby(COLUMNAS_CLAVE_ORDEN, dropna=False)["_extracto"].transform("last")
+    
+    return (
+        ordenadas[ordenadas["_extracto"] == mas_reciente]
+        .sort_index()
+        .drop(columns=["_extracto", "_mtime_extracto"])
+        .reset_index(drop=True)
+    )
+
+def columnas_en_excel(archivo, hoja, columnas):
+    """Nombres tal como aparecen en el encabezado (con espacios) de las columnas buscadas"""
+    libro = openpyxl.load_workbook(archivo, read_only=True)
+    try:
+        encabezado = next(libro[hoja].iter_rows(max_row=1, values_only=True))
+    finally:
+        libro.close()
+    
+    originales = {str(celda).strip(): celda for celda in encabezado if celda is not None}
+    columnas_faltantes = [col for col in columnas if col not in originales]
+    if columnas_faltantes:
+        raise KeyError(f"Columnas no encontradas en {archivo}: {columnas_faltantes}")
+    
+    return [originales[col] for col in columnas]
+
+def ingerir_extractos(carpeta_extractos, carpeta_particiones):
+    """
+    Ingiere en particiones Parquet por mes los extractos nuevos o modificados de la carpeta.
+    
+    - Los extractos ya ingeridos (mismo nombre y fecha de modificación) no se vuelven a leer.
+    - Los nuevos se parsean en paralelo (un proceso por archivo, solo columnas relevantes).
+    - Solo se reescriben las particiones de los meses que trae cada extracto. Cada
+      partición guarda las filas de todos los extractos que traen ese mes (reemplazando
+      las de un extracto que se vuelve a ingerir); las órdenes repetidas se resuelven
+      al leer (ver filas_vigentes), así un extracto corregido no pierde filas de otro.
+    
+    Returns:
+        dict: {extracto: segundos de lectura} de los extractos ingeridos en esta llamada
+    """
+    os.makedirs(carpeta_particiones, exist_ok=True)
+    manifiesto = leer_manifiesto(carpeta_particiones)
+    
+    extractos = sorted(
+        ruta for ruta in glob.glob(os.path.join(carpeta_extractos, "*.xlsx"))
+        if not os.path.basename(ruta).startswith("~$")
+    )
+    nuevos = [
+        ruta for ruta in extractos
+        if manifiesto["extractos"].get(os.path.basename(ruta), {}).get("mtime") != os.path.getmtime(ruta)
+    ]
+    
+    if not nuevos:
+        return {}
+    
+    tiempos = {}
+    inicio = time.perf_counter()
+    
+    def registrar_tiempo(nombre):
+        return lambda _: tiempos.__setitem__(nombre, time.perf_counter() - inicio)
+    
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(len(nuevos), os.cpu_count() or 1), mp_context=contexto) as pool:
+        futuros = {}
+        for ruta in nuevos:
+            nombre = os.path.basename(ruta)
+            futuros[ruta] = pool.submit(
+                pd.read_excel, ruta, sheet_name=HOJA,
+                usecols=columnas_en_excel(ruta, HOJA, columnas_relevantes)
+            )
+            futuros[ruta].add_done_callback(registrar_tiempo(nombre))
+        
+        for ruta in nuevos:
+            nombre = os.path.basename(ruta)
+            mtime = os.path.getmtime(ruta)
+            
+            extracto = futuros[ruta].result()
+            extracto.columns = extracto.columns.str.strip()
+            extracto = normalizar_bloque(extracto[columnas_relevantes])
+            # Cada fila recuerda de qué extracto viene, para resolver órdenes repetidas
+            extracto = extracto.assign(_extracto=nombre, _mtime_extracto=mtime)
+            
+            meses_extracto = sorted(extracto["MES"].unique().tolist())
+            # Un extracto modificado puede haber dejado de traer algún mes que ya aportó
+            meses_anteriores = manifiesto["extractos"].get(nombre, {}).get("meses", [])
+            por_mes = dict(tuple(extracto.groupby("MES", sort=False)))
+            
+            for mes in sorted(set(meses_extracto) | set(meses_anteriores)):
+                ruta_mes = ruta_particion(carpeta_particiones, mes)
+                filas_mes = por_mes.get(mes, extracto.iloc[:0])
+                if os.path.exists(ruta_mes):
+                    existentes = pd.read_parquet(ruta_mes)
+                    filas_mes = pd.concat([existentes[existentes["_extracto"] != nombre], filas_mes], ignore_index=True)
+                
+                os.makedirs(os.path.dirname(ruta_mes), exist_ok=True)
+                filas_mes.to_parquet(ruta_mes + ".tmp", index=False)
+                os.replace(ruta_mes + ".tmp", ruta_mes)
+                
+                manifiesto["particiones"][mes] = {
+                    "extractos": sorted(filas_mes["_extracto"].unique().tolist()),
+                    "filas": len(filas_vigentes(filas_mes))
+                }
+            
+            manifiesto["extractos"][nombre] = {"mtime": mtime, "meses": meses_extracto}
+            guardar_manifiesto(carpeta_particiones, manifiesto)
+    
+    return tiempos
+
+def leer_particiones(carpeta_particiones, ultimos_meses=None):
+    """
+    Lee solo las particiones de los `ultimos_meses` más recientes (MESES_HISTORIAL).
+    Sin ventana se lee todo el historial.
+    """
+    disponibles = sorted(leer_manifiesto(carpeta_particiones)["particiones"])
+    
+    if ultimos_meses:
+        # "Fecha desconocida" queda fuera de la ventana de meses recientes
+        disponibles = [mes for mes in disponibles if mes[:1].isdigit()][-ultimos_meses:]
+    
+    rutas = [ruta_particion(carpeta_particiones, mes) for mes in disponibles]
+    if not rutas:
+        return pd.DataFrame(columns=columnas_relevantes + ["MES"])
+    
+    return pd.concat([filas_vigentes(pd.read_parquet(ruta)) for ruta in rutas], ignore_index=True)
+
+# === BASE DE DATOS EMBEBIDA (opcional) ===
+def bd_desactualizada(ruta_bd, archivos):
+    """True si la base no existe o si alguno de los Excel fuente es más nuevo que ella"""
+    if not os.path.exists(ruta_bd):
+        return True
+    
+    fecha_bd = os.path.getmtime(ruta_bd)
+    return any(
+        os.path.getmtime(archivo) > fecha_bd
+        for archivo in archivos if os.path.exists(archivo)
+    )
+
+def guardar_en_bd(ruta_bd, df, df_frecuencias, df_anulaciones):
+    """
+    Guarda órdenes de trabajo, frecuencias y anulaciones en una base SQLite local,
+    con índices por (Site Id, MES, SUB_ESPECIALIDAD) para las consultas de las páginas.
+    La base se escribe en un archivo temporal y se reemplaza al final.
+    """
+    ruta_temporal = ruta_bd + ".tmp"
+    if os.path.exists(ruta_temporal):
+        os.remove(ruta_temporal)
+    
+    with closing(sqlite3.connect(ruta_temporal)) as con:
+        df.to_sql("mantenimientos", con, index=False)
+        df_frecuencias.to_sql("frecuencias", con, index=False)
+        df_anulaciones.to_sql("anulaciones", con, index=False)
+        
+        con.executescript(f"""
+            CREATE INDEX idx_mantenimientos_site ON mantenimientos ("{COL_SITE_ID}", MES, "{COL_ESPECIALIDAD}");
+            CREATE INDEX idx_mantenimientos_especialidad ON mantenimientos ("{COL_ESPECIALIDAD}", MES);
+            CREATE INDEX idx_mantenimientos_mes ON mantenimientos (MES, "{COL_ESTADO}");
+            CREATE INDEX idx_frecuencias_site ON frecuencias ("{COL_SITE_ID}");
+            CREATE INDEX idx_anulaciones_site ON anulaciones ("Site Id");
+        """)
+        con.commit()
+    
+    os.replace(ruta_temporal, ruta_bd)
+
+def cargar_desde_bd(con):
+    """Lee de la base las frecuencias y anulaciones ya normalizadas (sin volver a parsear los Excel)"""
+    df_frecuencias = pd.read_sql_query("SELECT * FROM frecuencias", con)
+    df_anulaciones = pd.read_sql_query(
+        "SELECT * FROM anulaciones", con, parse_dates=["Mes de la anulación"]
+    )
+    return df_frecuencias, df_anulaciones
+
+def ventana_bd(con, ultimos_meses=None):
+    """
+    Condición SQL (y sus parámetros) que limita las consultas a los `ultimos_meses`
+    más recientes, como leer_particiones. Sin ventana se analiza todo el historial.
+    """
+    if not ultimos_meses:
+        return "1", ()
+    
+    desde = con.execute("""
+        SELECT MIN(MES) FROM (
+            SELECT DISTINCT MES FROM mantenimientos
+            WHERE MES GLOB '[0-9]*' ORDER BY MES DESC LIMIT ?
+        )
+    """, (ultimos_meses,)).fetchone()[0]
+    return "MES >= ? AND MES GLOB '[0-9]*'", (desde or "",)
+
+def texto_fecha_bd(fecha):
+    """
+    Fecha en el formato en que to_sql guarda los Complete Time, para compararla como
+    texto: sin microsecondos cuando son cero ("2025-01-01 00:00:00"), igual que las
+    fechas armadas con MES || '-01 00:00:00'.
+    """
+    return pd.Timestamp(fecha).floor("us").to_pydatetime().isoformat(" ")
+
+def contar_ejecutadas_bd(con, ventana, anulaciones_indexadas=None):
+    """
+    Conteo de ejecutados por (Site Id, MES, especialidad), agregado dentro de la base.
+    Con `anulaciones_indexadas` el anti-join por mes de excluir_anuladas se hace en la consulta.
+    """
+    condicion, parametros = ventana
+    anti_join = ""
+    
+    if anulaciones_indexadas is not None:
+        con.executescript("""
+            DROP TABLE IF EXISTS temp.pares_anulados;
+            DROP TABLE IF EXISTS temp.sitios_anulados;
+            CREATE TEMP TABLE pares_anulados (
+                sitio TEXT, especialidad TEXT, desde TEXT, PRIMARY KEY (sitio, especialidad)
+            );
+            CREATE TEMP TABLE sitios_anulados (sitio TEXT PRIMARY KEY, desde TEXT);
+        """)
+        con.executemany(
+            "INSERT INTO temp.pares_anulados VALUES (?, ?, ?)",
+            [(sitio, especialidad, desde) for (sitio, especialidad), desde in anulaciones_indexadas['pares'].items()]
+        )
+        con.executemany(
+            "INSERT INTO temp.sitios_anulados VALUES (?, ?)",
+            list(anulaciones_indexadas['sitios_completos'].items())
+        )
+        # MES se compara como texto ("YYYY-MM"), igual que en anulado_desde
+        anti_join = f"""
+            AND NOT EXISTS (
+                SELECT 1 FROM temp.sitios_anulados AS s
+                WHERE s.sitio = m."{COL_SITE_ID}" AND m.MES >= s.desde
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM temp.pares_anulados AS p
+                WHERE p.sitio = m."{COL_SITE_ID}" AND p.especialidad = m."{COL_ESPECIALIDAD}" AND m.MES >= p.desde
+            )
+        """
+    
+    return pd.read_sql_query(f"""
+        SELECT "{COL_SITE_ID}", MES, "{COL_ESPECIALIDAD}", COUNT(*) AS cantidad
+        FROM mantenimientos AS m
+        WHERE {condicion} AND lower("{COL_ESTADO}") = 'ejecutado'
+          AND "{COL_SITE_ID}" IS NOT NULL AND MES IS NOT NULL AND "{COL_ESPECIALIDAD}" IS NOT NULL
+          {anti_join}
+        GROUP BY "{COL_SITE_ID}", MES, "{COL_ESPECIALIDAD}"
+    """, con, params=parametros)
+
+def resumir_mes_corte_bd(con, ventana, fecha_corte):
+    """Como resumir_mes_corte, con el índice por (MES, ESTADO) de la base"""
+    condicion, parametros = ventana
+    resumen = pd.read_sql_query(f"""
+        SELECT "{COL_SITE_ID}", COUNT(*) AS mes_actual_realizados, MAX("{COL_COMPLETE_TIME}") AS ultimo_mtto
+        FROM mantenimientos
+        WHERE {condicion} AND MES = ? AND lower("{COL_ESTADO}") = 'ejecutado' AND "{COL_SITE_ID}" IS NOT NULL
+          AND ("{COL_COMPLETE_TIME}" IS NULL OR "{COL_COMPLETE_TIME}" <= ?)
+        GROUP BY "{COL_SITE_ID}"
+    """, con, params=(*parametros, pd.Timestamp(fecha_corte).strftime("%Y-%m"), texto_fecha_bd(fecha_corte)))
+    
+    resumen["ultimo_mtto"] = pd.to_datetime(resumen["ultimo_mtto"], format="ISO8601", errors="coerce")
+    return resumen.set_index(COL_SITE_ID)
+
+def construir_dimension_sitios_bd(con, ventana):
+    """Como construir_dimension_sitios: el registro más reciente de cada sitio, por ROW_NUMBER"""
+    condicion, parametros = ventana
+    return pd.read_sql_query(f"""
+        SELECT "{COL_SITE_ID}", "{COL_SITE}", "{COL_PRIORIDAD}", "{COL_CONTRATISTA}", "{COL_FLM_ESPECIFICO}"
+        FROM (
+            SELECT "{COL_SITE_ID}", "{COL_SITE}", "{COL_PRIORIDAD}", "{COL_CONTRATISTA}", "{COL_FLM_ESPECIFICO}",
+                   ROW_NUMBER() OVER (
+                       PARTITION BY "{COL_SITE_ID}"
+                       ORDER BY CASE WHEN MES = 'Fecha desconocida' THEN '' ELSE MES END DESC, rowid DESC
+                   ) AS orden
+            FROM mantenimientos
+            WHERE {condicion} AND "{COL_SITE_ID}" IS NOT NULL
+        )
+        WHERE orden = 1
+        ORDER BY "{COL_SITE_ID}"
+    """, con, params=parametros).set_index(COL_SITE_ID)
+
+def resumir_ejecuciones_por_par_bd(con, ventana, fecha_corte):
+    """Como resumir_ejecuciones_por_par, agregado dentro de la base"""
+    condicion, parametros = ventana
+    fecha_corte = pd.Timestamp(fecha_corte)
+    inicio_anio = pd.Timestamp(year=fecha_corte.year, month=1, day=1)
+    corte = texto_fecha_bd(fecha_corte)
+    
+    ejecuciones = pd.read_sql_query(f"""
+        WITH registros AS (
+            SELECT "{COL_SITE_ID}" AS sitio, "{COL_ESPECIALIDAD}" AS especialidad,
+                   lower("{COL_ESTADO}") = 'ejecutado' AS ejecutado,
+                   COALESCE(
+                       "{COL_COMPLETE_TIME}",
+                       CASE WHEN MES GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]' THEN MES || '-01 00:00:00' END
+                   ) AS fecha
+            FROM mantenimientos
+            WHERE {condicion} AND "{COL_SITE_ID}" IS NOT NULL AND "{COL_ESPECIALIDAD}" IS NOT NULL
+        )
+        SELECT sitio AS "{COL_SITE_ID}", especialidad AS "{COL_ESPECIALIDAD}",
+               SUM(CASE WHEN ejecutado AND fecha >= ? AND fecha <= ? THEN 1 ELSE 0 END) AS ejecutados,
+               MAX(CASE WHEN ejecutado AND fecha <= ? THEN fecha END) AS ultimo_mtto
+        FROM registros
+        GROUP BY sitio, especialidad
+    """, con, params=(*parametros, texto_fecha_bd(inicio_anio), corte, corte))
+    
+    ejecuciones["ultimo_mtto"] = pd.to_datetime(ejecuciones["ultimo_mtto"], format="ISO8601", errors="coerce")
+    return ejecuciones.set_index([COL_SITE_ID, COL_ESPECIALIDAD])
+
+def pendientes_y_ejecuciones_bd(con, ventana):
+    """
+    Como pendientes_y_ejecuciones: "registro" es la posición del registro en la
+    tabla; la primera ejecución y los recuentos de cada mes se agregan en la base.
+    """
+    condicion, parametros = ventana
+    pendientes = pd.read_sql_query(f"""
+        SELECT rowid - 1 AS registro, "{COL_SITE_ID}", "{COL_ESPECIALIDAD}", MES,
+               "{COL_PRIORIDAD}", "{COL_CONTRATISTA}", "{COL_FLM_ESPECIFICO}"
+        FROM mantenimientos
+        WHERE {condicion} AND lower("{COL_ESTADO}") = 'pendiente' AND MES <> 'Fecha desconocida'
+        ORDER BY rowid
+    """, con, params=parametros)
+    
+    ejecuciones = pd.read_sql_query(f"""
+        SELECT "{COL_SITE_ID}", "{COL_ESPECIALIDAD}", mes_resolucion, fecha_resolucion,
+               primer_complete_time IS NULL OR primer_complete_time > fecha_resolucion AS fecha_aproximada
+        FROM (
+            SELECT "{COL_SITE_ID}", "{COL_ESPECIALIDAD}", MES AS mes_resolucion,
+                   MIN(COALESCE("{COL_COMPLETE_TIME}", MES || '-01 00:00:00')) AS fecha_resolucion,
+                   MIN("{COL_COMPLETE_TIME}") AS primer_complete_time
+            FROM mantenimientos
+            WHERE {condicion} AND lower("{COL_ESTADO}") = 'ejecutado' AND MES <> 'Fecha desconocida'
+            GROUP BY "{COL_SITE_ID}", "{COL_ESPECIALIDAD}", MES
+        )
+    """, con, params=parametros)
+    
+    ejecuciones["fecha_resolucion"] = pd.to_datetime(ejecuciones["fecha_resolucion"], format="ISO8601")
+    ejecuciones["fecha_aproximada"] = ejecuciones["fecha_aproximada"].astype(bool)
+    
+    # Con MIN(rowid), SQLite toma el estado de esa misma fila: el del primer registro del mes
+    registros_por_mes = pd.read_sql_query(f"""
+        SELECT "{COL_SITE_ID}", "{COL_ESPECIALIDAD}", MES, COUNT(*) AS programados,
+               SUM(lower("{COL_ESTADO}") = 'ejecutado') AS ejecutados,
+               COALESCE(lower("{COL_ESTADO}"), '') AS estado, MIN(rowid) AS primer_registro
+        FROM mantenimientos
+        WHERE {condicion} AND MES <> 'Fecha desconocida'
+          AND "{COL_SITE_ID}" IS NOT NULL AND "{COL_ESPECIALIDAD}" IS NOT NULL
+        GROUP BY "{COL_SITE_ID}", "{COL_ESPECIALIDAD}", MES
+    """, con, params=parametros).drop(columns="primer_registro")
+    
+    return pendientes, ejecuciones, registros_por_mes
+
+def contar_estados_bd(con, ventana):
+    """Como contar_estados, agregado dentro de la base"""
+    condicion, parametros = ventana
+    return pd.read_sql_query(f"""
+        SELECT "{COL_CONTRATISTA}", "{COL_FLM_ESPECIFICO}", lower("{COL_ESTADO}") AS estado, COUNT(*) AS cantidad
+        FROM mantenimientos
+        WHERE {condicion}
+        GROUP BY "{COL_CONTRATISTA}", "{COL_FLM_ESPECIFICO}", lower("{COL_ESTADO}")
+    """, con, params=parametros)
+
+def totales_bd(con, ventana):
+    """Cantidad de registros y de meses distintos, para el pie de la página de inicio"""
+    condicion, parametros = ventana
+    return con.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT MES) FROM mantenimientos WHERE {condicion}", parametros
+    ).fetchone()
+
+@st.cache_resource(max_entries=1)
+def conexion_bd(ruta_bd, version):
+    """
+    Conexión de solo lectura compartida entre sesiones. Se guarda solo la de la
+    versión vigente del archivo: al reemplazarse la base, la anterior se descarta.
+    """
+    return sqlite3.connect(f"file:{ruta_bd}?mode=ro", uri=True, check_same_thread=False)
+
+def consultar_bd(datos, consulta, parametros=(), parse_dates=None):
+    """Ejecuta una consulta de lectura contra la base del análisis cargado"""
+    ruta_bd = datos['ruta_bd']
+    con = conexion_bd(ruta_bd, os.path.getmtime(ruta_bd))
+    return pd.read_sql_query(consulta, con, params=parametros, parse_dates=parse_dates)
+
+def registros_sitio(datos, site):
+    """Registros de un sitio: búsqueda por índice si hay base, si no, filtro en memoria"""
+    if datos.get('ruta_bd'):
+        return consultar_bd(
+            datos,
+            f'SELECT * FROM mantenimientos WHERE "{COL_SITE_ID}" = ? ORDER BY MES',
+            (site,),
+            parse_dates=[COL_COMPLETE_TIME]
+        )
+    return datos['df'][datos['df'][COL_SITE_ID] == site]
+
+def registros_especialidad(datos, especialidad):
+    """Registros de una especialidad: búsqueda por índice si hay base, si no, filtro en memoria"""
+    if datos.get('ruta_bd'):
+        return consultar_bd(
+            datos,
+            f'SELECT * FROM mantenimientos WHERE "{COL_ESPECIALIDAD}" = ? ORDER BY MES',
+            (especialidad,),
+            parse_dates=[COL_COMPLETE_TIME]
+        )
+    return datos['df'][datos['df'][COL_ESPECIALIDAD] == especialidad]
+
+def anulaciones_sitio(datos, site):
+    """Anulaciones registradas para un sitio"""
+    if datos.get('ruta_bd'):
+        return consultar_bd(datos, 'SELECT * FROM anulaciones WHERE "Site Id" = ?', (site,))
+    return datos['df_anulaciones'][datos['df_anulaciones']["Site Id"] == site]
+
+# === SNAPSHOT DEL ANÁLISIS ===
+def hash_archivo(ruta):
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(1 << 20), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+@functools.lru_cache(maxsize=64)
+def hash_por_firma(ruta, mtime, tamano):
+    """hash_archivo memorizado por la firma (mtime, tamaño) del archivo, como en firma_fuentes"""
+    return hash_archivo(ruta)
+
+def hash_si_cambio(ruta):
+    """SHA-256 de un archivo: el contenido solo se vuelve a leer si cambió su firma"""
+    estado = os.stat(ruta)
+    return hash_por_firma(ruta, estado.st_mtime, estado.st_size)
+
+def clave_snapshot(archivos, fecha_corte):
+    """
+    Versión del análisis: cambia si cambia cualquier archivo de entrada, el código
+    de la app (incluidas sus constantes) o el día de corte de la ejecución incompleta.
+    Los archivos cuya firma (mtime, tamaño) no cambió no se vuelven a leer.
+    """
+    sha = hashlib.sha256()
+    sha.update(hash_si_cambio(__file__).encode())
+    for ruta in archivos:
+        sha.update(f"{ruta}:{hash_si_cambio(ruta)}".encode())
+    sha.update(fecha_corte.strftime("%Y-%m-%d").encode())
+    return sha.hexdigest()[:16]
+
+def ruta_snapshot(carpeta, clave):
+    return os.path.join(carpeta, f"analisis_{clave}.pkl")
+
+def cargar_snapshot(carpeta, clave):
+    """Devuelve el análisis guardado con esa clave, o None si no existe o no se puede leer"""
+    try:
+        with open(ruta_snapshot(carpeta, clave), "rb") as archivo:
+            return pickle.load(archivo)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+def guardar_snapshot(carpeta, clave, datos):
+    """Escribe el snapshot de forma atómica y elimina los de versiones anteriores"""
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = ruta_snapshot(carpeta, clave)
+    
+    with open(ruta + ".tmp", "wb") as archivo:
+        pickle.dump(datos, archivo, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(ruta + ".tmp", ruta)
+    
+    for anterior in glob.glob(os.path.join(carpeta, "analisis_*.pkl")):
+        if anterior != ruta:
+            os.remove(anterior)
+
+# === CARGA Y PROCESAMIENTO DE DATOS ===
+def agregar_registros(df, anulaciones_indexadas, fecha_corte, conteo_largo=None):
+    """
+    Agregados de los registros en memoria de los que parten los análisis. El conteo
+    para los detectores excluye lo anulado si así se configuró (las páginas siguen
+    mostrando el conteo completo). Ver agregar_registros_bd.
+    """
+    if conteo_largo is None:
+        conteo_largo = (
+            df[df[COL_ESTADO].str.lower() == "ejecutado"]
+            .groupby([COL_SITE_ID, "MES", COL_ESPECIALIDAD])
+            .size()
+            .reset_index(name="cantidad")
+        )
+    pendientes, ejecuciones, registros_por_mes = pendientes_y_ejecuciones(df)
+    
+    return {
+        'conteo_largo': conteo_largo,
+        'conteo_largo_analisis': (
+            excluir_anuladas(conteo_largo, anulaciones_indexadas) if EXCLUIR_ANULADAS else conteo_largo
+        ),
+        'mes_corte': resumir_mes_corte(df, fecha_corte),
+        'dim_sitios': construir_dimension_sitios(df),
+        'ejecuciones_por_par': resumir_ejecuciones_por_par(df, fecha_corte),
+        'pendientes': pendientes,
+        'ejecuciones': ejecuciones,
+        'registros_por_mes': registros_por_mes,
+        'conteo_estados': contar_estados(df),
+        'totales': (len(df), df["MES"].nunique())
+    }
+
+def agregar_registros_bd(con, ventana, anulaciones_indexadas, fecha_corte):
+    """Los mismos agregados que agregar_registros, cada uno con una consulta a la base"""
+    conteo_largo = contar_ejecutadas_bd(con, ventana)
+    pendientes, ejecuciones, registros_por_mes = pendientes_y_ejecuciones_bd(con, ventana)
+    
+    return {
+        'conteo_largo': conteo_largo,
+        'conteo_largo_analisis': (
+            contar_ejecutadas_bd(con, ventana, anulaciones_indexadas) if EXCLUIR_ANULADAS else conteo_largo
+        ),
+        'mes_corte': resumir_mes_corte_bd(con, ventana, fecha_corte),
+        'dim_sitios': construir_dimension_sitios_bd(con, ventana),
+        'ejecuciones_por_par': resumir_ejecuciones_por_par_bd(con, ventana, fecha_corte),
+        'pendientes': pendientes,
+        'ejecuciones': ejecuciones,
+        'registros_por_mes': registros_por_mes,
+        'conteo_estados': contar_estados_bd(con, ventana),
+        'totales': totales_bd(con, ventana)
+    }
+
+def comparar_agregados(agregados, referencia):
+    """
+    Nombres de los agregados que difieren entre dos cálculos (base y memoria). Se
+    comparan las filas como texto, sin importar su orden, el índice ni los tipos.
+    """
+    def filas(tabla):
+        if not isinstance(tabla, pd.DataFrame):
+            return sorted(map(str, tabla))
+        tabla = tabla.reset_index(drop=tabla.index.names == [None]).astype(object)
+        tabla = tabla[sorted(tabla.columns)]
+        return sorted(map(str, tabla.where(tabla.notna(), None).itertuples(index=False, name=None)))
+    
+    return [nombre for nombre in agregados if filas(agregados[nombre]) != filas(referencia[nombre])]
+
+def cargar_datos(metadatos, progreso=None):
+    """
+    Carga el análisis completo: desde el snapshot en disco si las entradas no
+    cambiaron, o procesando los archivos fuente (y guardando un snapshot nuevo).
+    `metadatos` (versión y fecha de los datos) se agrega antes de guardar el snapshot.
+    `progreso` recibe la fracción leída del libro principal (ver procesar_datos).
+    """
+    if not (ARCHIVO or CARPETA_EXTRACTOS):
+        return None
+    
+    if CARPETA_EXTRACTOS:
+        # Solo se leen los extractos que aún no están en las particiones
+        tiempos_ingesta = ingerir_extractos(CARPETA_EXTRACTOS, CARPETA_PARTICIONES)
+        archivos_fuente = [ruta_manifiesto(CARPETA_PARTICIONES), ARCHIVO_FRECUENCIAS, ARCHIVO_ANULACIONES]
+    else:
+        tiempos_ingesta = {}
+        archivos_fuente = [ARCHIVO, ARCHIVO_FRECUENCIAS, ARCHIVO_ANULACIONES]
+    
+    fecha_corte = pd.Timestamp.now()
+    
+    if CARPETA_SNAPSHOTS:
+        inicio = time.perf_counter()
+        clave = clave_snapshot(archivos_fuente, fecha_corte)
+        datos = cargar_snapshot(CARPETA_SNAPSHOTS, clave)
+        
+        if datos is not None:
+            # La base embebida solo se consulta si sigue al día con los archivos
+            datos['ruta_bd'] = ARCHIVO_BD if ARCHIVO_BD and not bd_desactualizada(ARCHIVO_BD, archivos_fuente) else ""
+            datos['tiempos_carga'] = {
+                **tiempos_ingesta, ruta_snapshot(CARPETA_SNAPSHOTS, clave): time.perf_counter() - inicio
+            }
+            datos.update(metadatos)
+            # Un análisis hecho desde la base no trae los registros: sin base al día se recalcula
+            if datos['ruta_bd'] or datos['df'] is not None:
+                return datos
+    
+    datos = procesar_datos(archivos_fuente, tiempos_ingesta, fecha_corte, progreso=progreso)
+    datos.update(metadatos)
+    
+    if CARPETA_SNAPSHOTS:
+        guardar_snapshot(CARPETA_SNAPSHOTS, clave, datos)
+    
+    return datos
+
+def procesar_datos(archivos_fuente, tiempos_ingesta, fecha_corte, progreso=None):
+    """
+    Lee los archivos fuente y calcula todos los análisis que usan las páginas.
+    Con ARCHIVO_BD los registros no se cargan en memoria: los análisis parten de
+    agregados consultados a la base (solo la ventana de MESES_HISTORIAL).
+    
+    `progreso` es una función opcional que recibe la fracción leída del libro
+    principal; no dibuja nada por sí misma, así se puede llamar desde el vigilante.
+    """
+    conteo_largo = None
+    
+    if ARCHIVO_BD and not bd_desactualizada(ARCHIVO_BD, archivos_fuente):
+        # La base ya tiene los datos normalizados: no hace falta leer los Excel
+        with closing(sqlite3.connect(ARCHIVO_BD)) as con:
+            df_frecuencias, df_anulaciones = cargar_desde_bd(con)
+        df = None
+        tiempos_carga = {}
+    elif CARPETA_EXTRACTOS:
+        inicio = time.perf_counter()
+        df = leer_particiones(CARPETA_PARTICIONES, ultimos_meses=MESES_HISTORIAL)
+        tiempos_carga = {**tiempos_ingesta, CARPETA_PARTICIONES: time.perf_counter() - inicio}
+        
+        df_frecuencias = pd.read_excel(ARCHIVO_FRECUENCIAS, sheet_name=HOJA_FRECUENCIAS)
+        df_anulaciones = pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
+        df_frecuencias.columns = df_frecuencias.columns.str.strip()
+        df_anulaciones.columns = df_anulaciones.columns.str.strip()
+
+        df_anulaciones = df_anulaciones[columnas_anulaciones]
+        
+        if ARCHIVO_BD:
+            guardar_en_bd(ARCHIVO_BD, df, df_frecuencias, df_anulaciones)
+    else:
+        # Los tres libros se leen en paralelo; el principal por bloques y solo
+        # con las columnas relevantes, ya normalizadas
+        df, conteo_largo, df_frecuencias, df_anulaciones, tiempos_carga = leer_fuentes_en_paralelo(
+            progreso=progreso
+        )
+
+        df_frecuencias.columns = df_frecuencias.columns.str.strip()
+        df_anulaciones.columns = df_anulaciones.columns.str.strip()
+
+        df_anulaciones = df_anulaciones[columnas_anulaciones]
+        
+        if ARCHIVO_BD:
+            guardar_en_bd(ARCHIVO_BD, df, df_frecuencias, df_anulaciones)
+
+    
+    anulaciones_indexadas = indexar_anulaciones(df_anulaciones)
+    
+    # === AGREGADOS DE LOS REGISTROS ===
+    if ARCHIVO_BD:
+        # Los registros quedan en la base: cada agregado se resuelve con una consulta
+        inicio = time.perf_counter()
+        with closing(sqlite3.connect(ARCHIVO_BD)) as con:
+            ventana = ventana_bd(con, MESES_HISTORIAL)
+            agregados = agregar_registros_bd(con, ventana, anulaciones_indexadas, fecha_corte)
+            
+            # Recién reconstruida la base, los registros siguen en memoria: ambos caminos deben coincidir
+            if VERIFICAR_BD and df is not None:
+                condicion, parametros = ventana
+                if parametros:
+                    df = df[(df["MES"] >= parametros[0]) & df["MES"].str[:1].str.isdigit()]
+                diferencias = comparar_agregados(
+                    agregados, agregar_registros(df, anulaciones_indexadas, fecha_corte)
+                )
+                if diferencias:
+                    logger.warning("La base y la memoria difieren en: %s", ", ".join(diferencias))
+        tiempos_carga[ARCHIVO_BD] = time.perf_counter() - inicio
+        df = None
+    else:
+        agregados = agregar_registros(df, anulaciones_indexadas, fecha_corte, conteo_largo)
+    
+    conteo_largo = agregados['conteo_largo']
+    total_registros, meses_disponibles = agregados['totales']
+    
+    # === CONTEO DE ESPECIALIDADES EJECUTADAS ===
+    conteo_ejecutadas = pivotar_conteo(conteo_largo)
+    
+    if EXCLUIR_ANULADAS:
+        # Se conservan los meses de cada sitio aunque solo tuvieran ejecuciones anuladas,
+        # salvo los de un sitio anulado completo desde el mes de su anulación
+        filas = pd.MultiIndex.from_frame(conteo_ejecutadas[[COL_SITE_ID, "MES"]])
+        filas = filas[~anulado_desde(
+            filas.get_level_values(1),
+            anulaciones_indexadas['sitios_completos'].reindex(filas.get_level_values(0))
+        )]
+        conteo_analisis = marcar_anuladas(
+            pivotar_conteo(agregados['conteo_largo_analisis'], filas), anulaciones_indexadas
+        )
+    else:
+        conteo_analisis = conteo_ejecutadas
+    
+    # === ANÁLISIS ===
+    eliminadas, mantenimientos_perdidos = detectar_especialidades_eliminadas(
+        conteo_analisis, COL_SITE_ID, ESPECIALIDADES
+    )
+    diferencias_mtto = diferencia_mtto_anterior(conteo_analisis, COL_SITE_ID)
+    historial_tendencias = calcular_historial_tendencias(
+        conteo_analisis, COL_SITE_ID, ESPECIALIDADES, VENTANA_TENDENCIA
+    )
+    tendencias = calcular_tendencias(historial_tendencias)
+    sitios_incompletos = detectar_sitios_con_ejecucion_incompleta(
+        agregados['mes_corte'], conteo_ejecutadas, COL_SITE_ID, as_of=fecha_corte
+    )
+    
+    # Dimensión de sitios e índice prioridad → sitios (compartidos por todas las páginas)
+    dim_sitios = agregados['dim_sitios']
+    sitios_por_prioridad = indexar_sitios_por_prioridad(dim_sitios)
+    indice_frecuencias = indexar_frecuencias(df_frecuencias, dim_sitios)
+    indice_busqueda = construir_indice_busqueda(dim_sitios)
+    
+    # Calcular riesgos
+    riesgos = {}
+    scores = {}
+    for site in dim_sitios.index:
+        riesgo, score = calcular_score_riesgo(
+            site, eliminadas, mantenimientos_perdidos, diferencias_mtto
+        )
+        riesgos[site] = riesgo
+        scores[site] = score
+    
+    # Score y nivel de riesgo de todos los meses (línea de tiempo por sitio)
+    historial_riesgo = calcular_historial_riesgo(conteo_analisis, COL_SITE_ID, ESPECIALIDADES)
+    
+    # Cumplimiento de las frecuencias planificadas en el año y sus resúmenes
+    cumplimiento = calcular_cumplimiento_frecuencias(
+        agregados['ejecuciones_por_par'], indice_frecuencias, dim_sitios, fecha_corte
+    )
+    cumplimiento_contratista = resumir_cumplimiento(cumplimiento, COL_CONTRATISTA)
+    cumplimiento_prioridad = resumir_cumplimiento(cumplimiento, COL_PRIORIDAD)
+    
+    # Resolución de pendientes: latencia por especialidad, contratista y prioridad, y backlog abierto
+    resolucion_pendientes, backlog_pendientes = resolver_pendientes(
+        agregados['pendientes'], agregados['ejecuciones'], fecha_corte
+    )
+    
+    # Pendientes que el siguiente mantenimiento no resolvió (tabla tipada para filtrar y paginar en el servidor)
+    alertas_pendientes = construir_tabla_alertas(
+        alertar_pendientes(resolucion_pendientes, agregados['registros_por_mes'], dim_sitios), dim_sitios
+    )
+    latencia_resolucion = {
+        columna: distribuir_latencia(resolucion_pendientes, columna)
+        for columna in [COL_ESPECIALIDAD, COL_CONTRATISTA, COL_PRIORIDAD]
+    }
+    
+    # Indicadores por contratista y por FLM
+    desempeno = {
+        columna: resumir_desempeno(
+            agregados['conteo_estados'], dim_sitios, eliminadas, sitios_incompletos,
+            resolucion_pendientes, cumplimiento, columna
+        )
+        for columna in [COL_CONTRATISTA, COL_FLM_ESPECIFICO]
+    }
+    
+    # Agrupar sitios problemáticos por prioridad y riesgo (una sola vez)
+    grupos_problematicos = agrupar_sitios_problematicos(
+        dim_sitios, sitios_por_prioridad, eliminadas, tendencias, sitios_incompletos, riesgos
+    )
+    
+    return {
+        'df': df,
+        'total_registros': total_registros,
+        'meses_disponibles': meses_disponibles,
+        'df_frecuencias': df_frecuencias,  # ← ESTA LÍNEA ES NUEVA
+        'df_anulaciones': df_anulaciones,
+        'ruta_bd': ARCHIVO_BD,
+        'tiempos_carga': tiempos_carga,
+        'conteo_largo': conteo_largo,
+        'conteo_ejecutadas': conteo_ejecutadas,
+        'conteo_analisis': conteo_analisis,
+        'anulaciones_indexadas': anulaciones_indexadas,
+        'eliminadas': eliminadas,
+        'mantenimientos_perdidos': mantenimientos_perdidos,
+        'diferencias_mtto': diferencias_mtto,
+        'tendencias': tendencias,
+        'historial_tendencias': historial_tendencias,
+        'sitios_incompletos': sitios_incompletos,
+        'fecha_corte': fecha_corte,
+        'alertas_pendientes': alertas_pendientes,
+        'dim_sitios': dim_sitios,
+        'sitios_por_prioridad': sitios_por_prioridad,
+        'indice_frecuencias': indice_frecuencias,
+        'indice_busqueda': indice_busqueda,
+        'riesgos': riesgos,
+        'scores': scores,
+        'historial_riesgo': historial_riesgo,
+        'cumplimiento': cumplimiento,
+        'cumplimiento_contratista': cumplimiento_contratista,
+        'cumplimiento_prioridad': cumplimiento_prioridad,
+        'resolucion_pendientes': resolucion_pendientes,
+        'backlog_pendientes': backlog_pendientes,
+        'latencia_resolucion': latencia_resolucion,
+        'desempeno': desempeno,
+        'grupos_problematicos': grupos_problematicos
+    }
+
+# === RECARGA AUTOMÁTICA DE DATOS ===
+def archivos_vigilados():
+    """Archivos cuyo cambio obliga a recalcular el análisis"""
+    if CARPETA_EXTRACTOS:
+        extractos = sorted(
+            ruta for ruta in glob.glob(os.path.join(CARPETA_EXTRACTOS, "*.xlsx"))
+            if not os.path.basename(ruta).startswith("~$")
+        )
+        return extractos + [ARCHIVO_FRECUENCIAS, ARCHIVO_ANULACIONES]
+    return [ARCHIVO, ARCHIVO_FRECUENCIAS, ARCHIVO_ANULACIONES]
+
+def firma_fuentes():
+    """Fecha de modificación y tamaño de cada archivo fuente, más el día de corte"""
+    firma = []
+    for ruta in archivos_vigilados():
+        try:
+            estado = os.stat(ruta)
+            firma.append((ruta, estado.st_mtime, estado.st_size))
+        except OSError:
+            firma.append((ruta, None, None))
+    
+    # El cambio de día también recalcula (la ejecución incompleta depende de la fecha)
+    return tuple(firma), datetime.now().strftime("%Y-%m-%d")
+
+def publicar_datos(compartidos, firma, progreso=None):
     """
-    from datetime import datetime, timedelta
-    
-    # Obtener el mes actual en formato YYYY-MM
-    fecha_actual = datetime.now()
-    mes_actual_str = fecha_actual.strftime("%Y-%m")
-    
-    sitios_incompletos = {}
-    
-    # Filtrar solo mantenimientos ejecutados
-    df_ejecutados = df[df[COL_ESTADO].str.lower() == "ejecutado"].copy()
+    Calcula el análisis y lo publica con un único reemplazo de referencia: las
+    sesiones siguen usando la versión anterior hasta que la nueva está completa.
+    """
+    anterior = compartidos.get('actual')
+    version = anterior['version'] + 1 if anterior else 1
+    fechas = [mtime for _, mtime, _ in firma[0] if mtime is not None]
     
-    # Convertir Complete Time a datetime
-    df_ejecutados[COL_COMPLETE_TIME] = pd.to_datetime(
-        df_ejecutados[COL_COMPLETE_TIME], 
-        errors='coerce'
+    # El diccionario queda completo antes del snapshot; después ya no se modifica
+    datos = cargar_datos(
+        {
+            # Clave para memorizar los cálculos derivados de esta versión en las páginas
+            'version': version,
+            'fecha_datos': datetime.fromtimestamp(max(fechas)) if fechas else None
+        },
+        progreso=progreso
     )
     
-    for site in conteo_df[col_site_id].unique():
-        site_data = conteo_df[conteo_df[col_site_id] == site].sort_values("MES")
-        
-        # Verificar que tenga al menos 2 meses de historial
-        if len(site_data) < 2:
-            continue
-        
-        # Obtener datos del mes anterior
-        mes_anterior_total = site_data.iloc[-2]["TOTAL"]
-        
-        # Filtrar mantenimientos del sitio en el mes actual
-        mttos_mes_actual = df_ejecutados[
-            (df_ejecutados[col_site_id] == site) &
-            (df_ejecutados["MES"] == mes_actual_str)
-        ]
+    compartidos['actual'] = {
+        'datos': datos,
+        'version': version,
+        'firma': firma
+    }
+    compartidos['error'] = None
+
+def vigilar_fuentes(compartidos, intervalo):
+    """Hilo de fondo: recalcula cuando la firma de los archivos cambia y se mantiene estable"""
+    pendiente = None
+    fallida = None
+    
+    while True:
+        time.sleep(intervalo)
+        firma = firma_fuentes()
         
-        if mttos_mes_actual.empty:
+        if firma == compartidos['actual']['firma'] or firma == fallida:
+            pendiente = None
             continue
         
-        # Obtener el último mantenimiento ejecutado
-        ultimo_mtto = mttos_mes_actual[COL_COMPLETE_TIME].max()
-        
-        # Verificar si es válido
-        if pd.isna(ultimo_mtto):
+        if firma != pendiente:
+            # Se espera una revisión más por si el archivo todavía se está copiando
+            pendiente = firma
             continue
         
-        # Calcular días desde el último mantenimiento
-        dias_desde_ultimo = (fecha_actual - ultimo_mtto).days
-        
-        # Cantidad de mantenimientos ejecutados este mes
-        mttos_realizados_mes_actual = len(mttos_mes_actual)
-        
-        # Criterios:
-        # 1. Tiene al menos 1 mantenimiento este mes
-        # 2. Último mtto hace más de 2 días
-        # 3. No alcanza la cantidad del mes anterior
-        if (mttos_realizados_mes_actual > 0 and 
-            dias_desde_ultimo > 2 and 
-            mttos_realizados_mes_actual < mes_anterior_total):
-            
-            faltantes = mes_anterior_total - mttos_realizados_mes_actual
-            
-            sitios_incompletos[site] = {
-                "mes_anterior_total": mes_anterior_total,
-                "mes_actual_realizados": mttos_realizados_mes_actual,
-                "faltantes": faltantes,
-                "ultimo_mtto_fecha": ultimo_mtto.strftime("%Y-%m-%d"),
-                "dias_desde_ultimo": dias_desde_ultimo,
-                "porcentaje_completado": round(
-                    (mttos_realizados_mes_actual / mes_anterior_total) * 100, 1
-                )
-            }
-    
-    return sitios_incompletos
-
-def verificar_pendientes_no_ejecutados(df, col_site_id, col_site, col_especialidad, col_estado, col_mes):
-    """
-    Verifica si los mantenimientos marcados como 'Pendiente' fueron ejecutados
-    en el SIGUIENTE mantenimiento programado (sin importar cuántos meses después).
-    
-    Busca el siguiente registro cronológico de la misma combinación sitio+especialidad
-    y verifica si el pendiente fue resuelto.
-    """
-    alertas_pendientes = []
-    
-    # Normalizar estados a minúsculas
-    df_temp = df.copy()
-    df_temp[col_estado] = df_temp[col_estado].str.lower().str.strip()
-    
-    # Ordenar por sitio, especialidad y mes
-    df_temp = df_temp.sort_values([col_site_id, col_site, col_especialidad, col_mes])
-    
-    # Filtrar solo pendientes
-    df_pendientes = df_temp[df_temp[col_estado] == "pendiente"]
-    
-    for idx, row in df_pendientes.iterrows():
-        sitio_id = row[col_site_id]
-        sitio_name = row[col_site]
-        especialidad = row[col_especialidad]
-        mes_pendiente = row[col_mes]
-        
-        # Mantenimientos programados de esta especialidad en el mes pendiente
-        mttos_programados_mes_pendiente = len(df_temp[
-            (df_temp[col_site_id] == sitio_id) &
-            (df_temp[col_site] == sitio_name) &
-            (df_temp[col_especialidad] == especialidad) &  # ← FILTRAR POR ESPECIALIDAD
-            (df_temp["MES"] == mes_pendiente)
-        ])
-        
-        # Mantenimientos ejecutados de esta especialidad en el mes pendiente
-        mttos_recuento_ejecutados = len(df_temp[
-            (df_temp[col_site_id] == sitio_id) &
-            (df_temp[col_site] == sitio_name) &
-            (df_temp[col_especialidad] == especialidad) &  # ← FILTRAR POR ESPECIALIDAD
-            (df_temp["MES"] == mes_pendiente) &
-            (df_temp[col_estado] == "ejecutado")
-        ])
-        
-        # Buscar TODOS los registros del mismo sitio+especialidad
-        registros_misma_combinacion = df_temp[
-            (df_temp[col_site_id] == sitio_id) &
-            (df_temp[col_especialidad] == especialidad)
-        ].sort_values(col_mes)
-        
-        # Encontrar el índice del registro pendiente actual
-        indices_temporales = registros_misma_combinacion.index.tolist()
-        
-        if idx in indices_temporales:
-            posicion_actual = indices_temporales.index(idx)
-            
-            # Verificar si hay un siguiente registro
-            if posicion_actual < len(indices_temporales) - 1:
-                # Obtener el SIGUIENTE registro cronológico
-                siguiente_registro = registros_misma_combinacion.iloc[posicion_actual + 1]
-                
-                mes_siguiente = siguiente_registro[col_mes]
-                estado_siguiente = siguiente_registro[col_estado]
-                
-                # === MODIFICADO: Contar mantenimientos de LA MISMA SUBESPECIALIDAD para el mes siguiente ===
-                mttos_programados_mes_siguiente = len(df_temp[
-                    (df_temp[col_site_id] == sitio_id) &
-                    (df_temp[col_site] == sitio_name) &
-                    (df_temp[col_especialidad] == especialidad) &  # ← FILTRAR POR ESPECIALIDAD
-                    (df_temp["MES"] == mes_siguiente)
-                ])
-                
-                mttos_recuento_ejecutados2 = len(df_temp[
-                    (df_temp[col_site_id] == sitio_id) &
-                    (df_temp[col_site] == sitio_name) &
-                    (df_temp[col_especialidad] == especialidad) &  # ← FILTRAR POR ESPECIALIDAD
-                    (df_temp["MES"] == mes_siguiente) &
-                    (df_temp[col_estado] == "ejecutado")
-                ])
-                
-                # Calcular diferencia de meses (aproximada)
-                try:
-                    # Extraer año y mes de formato "2023-01"
-                    año_pend, mes_pend = mes_pendiente.split('-')
-                    año_sig, mes_sig = mes_siguiente.split('-')
-                    
-                    meses_diferencia = (int(año_sig) - int(año_pend)) * 12 + (int(mes_sig) - int(mes_pend))
-                    dias_aproximados = meses_diferencia * 30
-                except:
-                    meses_diferencia = 0
-                    dias_aproximados = 0
-                
-                # VERIFICAR SI MESES_DIFERENCIA ES 0 - NO GENERAR ALERTA
-                if meses_diferencia == 0:
-                    continue  # Saltar a la siguiente iteración del bucle
-                
-                # Si NO está ejecutado en el siguiente mantenimiento, generar alerta
-                if estado_siguiente != "ejecutado":
-                    # Determinar severidad según estado y tiempo transcurrido
-                    if estado_siguiente == "cancelado":
-                        severidad = "MEDIA"
-                    elif meses_diferencia >= 6:
-                        severidad = "CRÍTICA"
-                    elif meses_diferencia >= 3:
-                        severidad = "ALTA"
-                    else:
-                        severidad = "MEDIA"
-                    
-                    alertas_pendientes.append({
-                        "site ID": sitio_id,
-                        "site": sitio_name,
-                        "especialidad": especialidad,
-                        "mes_pendiente": mes_pendiente,
-                        "mes_siguiente_mtto": mes_siguiente,
-                        "meses_entre_mttos": meses_diferencia,
-                        "estado_siguiente": estado_siguiente.upper(),
-                        "dias_sin_ejecutar": f"{dias_aproximados}+",
-                        "severidad": severidad,
-                        # === NUEVAS COLUMNAS AGREGADAS ===
-                        "recuento_ejecutados": f"{mttos_recuento_ejecutados}/{mttos_programados_mes_pendiente}",
-                        "recuento_ejecutados2": f"{mttos_recuento_ejecutados2}/{mttos_programados_mes_siguiente}"
-                    })
-    
-    return alertas_pendientes
+        # Sin barra de progreso: este hilo no tiene sesión de Streamlit donde dibujarla
+        logger.info("Cambiaron los archivos fuente; recalculando el análisis")
+        inicio = time.perf_counter()
+        try:
+            publicar_datos(compartidos, firma)
+        except Exception as e:
+            fallida = firma
+            compartidos['error'] = f"{type(e).__name__}: {e}"
+            logger.exception("No se pudo recalcular el análisis")
+        else:
+            logger.info(
+                "Análisis versión %d publicado en %.1f s",
+                compartidos['actual']['version'], time.perf_counter() - inicio
+            )
 
-# === FUNCIÓN DE PREDICCIÓN ===
-def predecir_mantenimientos_especialidad(df, df_frecuencias, especialidad, meses_a_predecir=1):
+@st.cache_resource
+def iniciar_datos_compartidos():
     """
-    Predice la cantidad de mantenimientos esperados para una especialidad en los próximos meses.
-    
-    Args:
-        df: DataFrame con los datos de mantenimientos
-        df_frecuencias: DataFrame con las frecuencias anuales por sitio
-        especialidad: Especialidad a predecir
-        meses_a_predecir: Cantidad de meses a predecir (default: 2)
-    
-    Returns:
-        DataFrame con predicciones por mes
+    Contenedor del análisis compartido por todas las sesiones. Solo crea el
+    contenedor: Streamlit repite los elementos dibujados dentro de una función
+    cacheada, así que la carga (con su barra de progreso) la hace cargar_datos_compartidos.
     """
-    # Filtrar solo mantenimientos ejecutados de la especialidad
-    df_esp = df[(df[COL_ESPECIALIDAD] == especialidad) & 
-                (df[COL_ESTADO].str.lower() == "ejecutado")].copy()
-    
-    if df_esp.empty:
-        return pd.DataFrame()
-    
-    # Convertir MES a datetime
-    df_esp["MES_DT"] = pd.to_datetime(df_esp["MES"], format="%Y-%m")
-    
-    # Calcular promedio de mantenimientos por sitio-especialidad
-    promedios_por_sitio = df_esp.groupby(COL_SITE_ID).size().to_dict()
-    conteo_meses_por_sitio = df_esp.groupby(COL_SITE_ID)["MES"].nunique().to_dict()
-    
-    # Calcular promedio real (total mttos / cantidad de meses con datos)
-    promedio_mttos_por_sitio = {
-        site: math.ceil(promedios_por_sitio[site] / conteo_meses_por_sitio.get(site, 1))
-        for site in promedios_por_sitio
-    }
+    return {'carga': threading.Lock()}
+
+def cargar_datos_compartidos(progreso=None):
+    """Carga inicial del análisis (una sola vez por proceso) y arranque del vigilante"""
+    compartidos = iniciar_datos_compartidos()
     
-    # Obtener el último mes con datos
-    ultimo_mes = df_esp["MES_DT"].max()
+    with compartidos['carga']:
+        if 'actual' not in compartidos:
+            publicar_datos(compartidos, firma_fuentes(), progreso=progreso)
+            
+            threading.Thread(
+                target=vigilar_fuentes,
+                args=(compartidos, INTERVALO_VIGILANCIA),
+                name="vigilante-datos",
+                daemon=True
+            ).start()
     
-    # Preparar diccionario de frecuencias
-    frecuencias_dict = df_frecuencias.set_index(COL_SITE_ID)["frecuencia"].to_dict() if not df_frecuencias.empty else {}
+    return compartidos
+
+# === API JSON DE SOLO LECTURA ===
+def registros_json(df):
+    """DataFrame → lista de dicts serializable (NaN → null, fechas en ISO)"""
+    if df is None or df.empty:
+        return []
+    return json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
+
+def api_alertas_pendientes(datos, parametros):
+    return registros_json(datos['alertas_pendientes'])
+
+def api_riesgos(datos, parametros):
+    riesgos = datos['dim_sitios'].reset_index()
+    riesgos["riesgo"] = riesgos[COL_SITE_ID].map(datos['riesgos'])
+    riesgos["score"] = riesgos[COL_SITE_ID].map(datos['scores'])
+    return registros_json(riesgos)
+
+def api_ejecucion_incompleta(datos, parametros):
+    return [{"site ID": site, **info} for site, info in datos['sitios_incompletos'].items()]
+
+def api_reporte_ejecucion_incompleta(datos, parametros):
+    return registros_json(generar_reporte_ejecucion_incompleta(datos))
+
+def api_reporte_mantenimientos_perdidos(datos, parametros):
+    # ?meses=2025-10,2025-11 (por defecto, el último mes disponible)
+    meses = parametros.get("meses")
+    return registros_json(generar_reporte_mantenimientos_perdidos(
+        datos, meses.split(",") if meses else None
+    ))
+
+def api_cumplimiento(datos, parametros):
+    return registros_json(datos['cumplimiento'])
+
+def api_cumplimiento_contratistas(datos, parametros):
+    return registros_json(datos['cumplimiento_contratista'])
+
+def api_cumplimiento_prioridades(datos, parametros):
+    return registros_json(datos['cumplimiento_prioridad'])
+
+def api_desempeno_contratistas(datos, parametros):
+    return registros_json(datos['desempeno'][COL_CONTRATISTA])
+
+def api_desempeno_flm(datos, parametros):
+    return registros_json(datos['desempeno'][COL_FLM_ESPECIFICO])
+
+def api_pendientes_abiertos(datos, parametros):
+    return registros_json(datos['backlog_pendientes'].reset_index())
+
+def api_latencia_resolucion(datos, parametros):
+    # ?por=especialidad|contratista|prioridad (por defecto, especialidad)
+    columnas = {"especialidad": COL_ESPECIALIDAD, "contratista": COL_CONTRATISTA, "prioridad": COL_PRIORIDAD}
+    columna = columnas.get(parametros.get("por", "especialidad"), COL_ESPECIALIDAD)
+    return registros_json(datos['latencia_resolucion'][columna])
+
+RECURSOS_API = {
+    "/api/alertas-pendientes": api_alertas_pendientes,
+    "/api/riesgos": api_riesgos,
+    "/api/ejecucion-incompleta": api_ejecucion_incompleta,
+    "/api/reportes/ejecucion-incompleta": api_reporte_ejecucion_incompleta,
+    "/api/reportes/mantenimientos-perdidos": api_reporte_mantenimientos_perdidos,
+    "/api/cumplimiento": api_cumplimiento,
+    "/api/cumplimiento/contratistas": api_cumplimiento_contratistas,
+    "/api/cumplimiento/prioridades": api_cumplimiento_prioridades,
+    "/api/desempeno/contratistas": api_desempeno_contratistas,
+    "/api/desempeno/flm": api_desempeno_flm,
+    "/api/pendientes-abiertos": api_pendientes_abiertos,
+    "/api/latencia-resolucion": api_latencia_resolucion,
+}
+
+PARAMETROS_PAGINACION = ("pagina", "por_pagina")
+
+# Parámetros que cambian el resultado de un recurso (el resto son filtros por campo)
+PARAMETROS_RECURSOS_API = {
+    "/api/reportes/mantenimientos-perdidos": ("meses",),
+    "/api/latencia-resolucion": ("por",),
+}
+
+def crear_servidor_api(compartidos, host, puerto):
+    """
+    Servidor HTTP de solo lectura sobre la versión vigente de los datos compartidos.
     
-    predicciones = []
+    - GET /api lista los recursos; cada recurso devuelve {total, pagina, paginas, datos}.
+    - ?pagina=N&por_pagina=M pagina el resultado; los parámetros propios del recurso
+      (PARAMETROS_RECURSOS_API) cambian el resultado y cualquier otro debe ser un campo,
+      que filtra por igualdad (p. ej. ?severidad=CRÍTICA). Un campo desconocido es un 400.
+    - El ETag depende de la versión de los archivos fuente, del código y de la URL:
+      con If-None-Match se responde 304 sin recalcular nada.
+    - Cada recurso se calcula sin filtrar una sola vez por versión de datos; filtros
+      y paginación se aplican en cada pedido sobre ese resultado.
+    """
+    version_codigo = hash_si_cambio(__file__)
+    resultados = {'version': 0, 'recursos': {}}
+    # Los pedidos se atienden en hilos en paralelo: el bloqueo protege el cambio de
+    # versión y el diccionario del caché, no el cálculo de los recursos
+    bloqueo = threading.Lock()
     
-    # Para cada mes a predecir
-    for i in range(1, meses_a_predecir + 1):
-        mes_prediccion = ultimo_mes + pd.DateOffset(months=i)
-        mes_str = mes_prediccion.strftime("%Y-%m")
+    def obtener_recurso(actual, ruta, parametros_recurso):
+        """Registros sin filtrar de un recurso, calculados una vez por versión de datos"""
+        clave = (ruta, tuple(sorted(parametros_recurso.items())))
+        
+        with bloqueo:
+            if actual['version'] > resultados['version']:
+                resultados.update(version=actual['version'], recursos={})
+            recursos = resultados['recursos']
+            if actual['version'] == resultados['version'] and clave in recursos:
+                return recursos[clave]
+        
+        # El cálculo va fuera del bloqueo para no frenar los pedidos de otros recursos
+        registros = RECURSOS_API[ruta](actual['datos'], parametros_recurso)
         
-        total_esperado = 0
-        sitios_con_mtto_esperado = []
+        with bloqueo:
+            # Un pedido que tomó una versión ya reemplazada no se guarda
+            if actual['version'] == resultados['version']:
+                registros = resultados['recursos'].setdefault(clave, registros)
+        return registros
+    
+    class ManejadorApi(BaseHTTPRequestHandler):
+        def responder(self, estado, cuerpo=None, etag=None):
+            contenido = json.dumps(cuerpo, ensure_ascii=False, default=str).encode("utf-8") if cuerpo is not None else b""
+            self.send_response(estado)
+            if etag:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+            if cuerpo is not None:
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
         
-        # Para cada sitio único en los datos
-        for site in df_esp[COL_SITE_ID].unique():
-            # Obtener último mantenimiento del sitio para esta especialidad
-            ultimos_mttos_sitio = df_esp[df_esp[COL_SITE_ID] == site].sort_values("MES_DT")
+        def do_GET(self):
+            url = urlparse(self.path)
+            ruta = url.path.rstrip("/")
+            parametros = {clave: valores[-1] for clave, valores in parse_qs(url.query).items()}
             
-            if ultimos_mttos_sitio.empty:
-                continue
+            if ruta == "/api":
+                self.responder(200, {"recursos": sorted(RECURSOS_API)})
+                return
+            if ruta not in RECURSOS_API:
+                self.responder(404, {"error": f"Recurso no encontrado: {url.path}"})
+                return
             
-            ultimo_mtto_sitio = ultimos_mttos_sitio["MES_DT"].max()
+            # Se toma una sola referencia: el vigilante puede publicar otra versión en paralelo
+            actual = compartidos.get('actual')
+            if actual is None or actual['datos'] is None:
+                self.responder(503, {"error": "No hay datos cargados"})
+                return
             
-            # Obtener frecuencia del sitio (default: 0 si no está en el archivo)
-            frecuencia_anual = frecuencias_dict.get(site, 0)
+            etag = '"' + hashlib.sha256(
+                f"{version_codigo}|{actual['firma']}|{ruta}|{sorted(parametros.items())}".encode()
+            ).hexdigest()[:32] + '"'
             
-            # Calcular meses entre mantenimientos
-            meses_entre_mttos = 12 / frecuencia_anual if frecuencia_anual > 0 else 0
+            if etag in self.headers.get("If-None-Match", ""):
+                self.responder(304, etag=etag)
+                return
             
-            # Calcular cuántos meses han pasado desde el último mtto
-            meses_desde_ultimo = (mes_prediccion.year - ultimo_mtto_sitio.year) * 12 + \
-                                (mes_prediccion.month - ultimo_mtto_sitio.month)
+            try:
+                pagina = int(parametros.get("pagina", 1))
+                por_pagina = min(int(parametros.get("por_pagina", REGISTROS_POR_PAGINA_API)), MAX_REGISTROS_POR_PAGINA_API)
+                if pagina < 1 or por_pagina < 1:
+                    raise ValueError
+            except ValueError:
+                self.responder(400, {"error": "pagina y por_pagina deben ser enteros positivos"})
+                return
             
-            # Si ya debería tener mantenimiento (±1 mes de tolerancia)
-            if meses_desde_ultimo == meses_entre_mttos:
-                promedio_sitio = promedio_mttos_por_sitio.get(site, 1)
-                total_esperado += promedio_sitio
-                sitios_con_mtto_esperado.append({
-                    "site": site,
-                    "ultimo_mtto": ultimo_mtto_sitio.strftime("%Y-%m"),
-                    "meses_transcurridos": meses_desde_ultimo,
-                    "frecuencia_esperada_meses": round(meses_entre_mttos, 1),
-                    "mttos_esperados": round(promedio_sitio, 2)
-                })
+            propios = PARAMETROS_RECURSOS_API.get(ruta, ())
+            registros = obtener_recurso(
+                actual, ruta, {clave: valor for clave, valor in parametros.items() if clave in propios}
+            )
+            
+            filtros = {
+                clave: valor for clave, valor in parametros.items()
+                if clave not in PARAMETROS_PAGINACION and clave not in propios
+            }
+            if registros:
+                desconocidos = sorted(set(filtros) - set(registros[0]))
+                if desconocidos:
+                    self.responder(400, {
+                        "error": f"Filtros desconocidos: {', '.join(desconocidos)}",
+                        "campos": list(registros[0]),
+                        "parametros": list(PARAMETROS_PAGINACION + propios)
+                    })
+                    return
+            for campo, valor in filtros.items():
+                registros = [registro for registro in registros if str(registro[campo]) == valor]
+            
+            inicio = (pagina - 1) * por_pagina
+            
+            fecha_datos = actual['datos'].get('fecha_datos')
+            self.responder(200, {
+                "fecha_datos": fecha_datos.isoformat() if fecha_datos else None,
+                "total": len(registros),
+                "pagina": pagina,
+                "por_pagina": por_pagina,
+                "paginas": math.ceil(len(registros) / por_pagina),
+                "datos": registros[inicio:inicio + por_pagina]
+            }, etag=etag)
         
-        predicciones.append({
-            "mes": mes_str,
-            "total_esperado": round(total_esperado, 1),
-            "cantidad_sitios": len(sitios_con_mtto_esperado),
-            "detalle_sitios": sitios_con_mtto_esperado
-        })
+        def log_message(self, formato, *args):
+            pass
     
-    return pd.DataFrame(predicciones)
+    return ThreadingHTTPServer((host, puerto), ManejadorApi)
 
-# === CARGA Y PROCESAMIENTO DE DATOS (se ejecuta una sola vez) ===
-@st.cache_data
-def cargar_datos():
-    """Carga y procesa los datos una sola vez"""
-    if ARCHIVO:
-        df = pd.read_excel(ARCHIVO, sheet_name=HOJA)
-        df.columns = df.columns.str.strip()
+@st.cache_resource
+def iniciar_api(host, puerto):
+    """Arranca la API en un hilo de fondo (una vez por proceso); None si el puerto está ocupado"""
+    try:
+        servidor = crear_servidor_api(iniciar_datos_compartidos(), host, puerto)
+    except OSError:
+        return None
+    
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="api-datos", daemon=True).start()
+    return servidor
 
-        df_frecuencias = pd.read_excel(ARCHIVO_FRECUENCIAS, sheet_name=HOJA_FRECUENCIAS)
-        df_frecuencias.columns = df_frecuencias.columns.str.strip()
+# === DATOS DERIVADOS MEMORIZADOS (por versión de datos) ===
+# Los fragmentos de cada página se vuelven a ejecutar con cada cambio de sus widgets;
+# estos cálculos se hacen una vez por versión de datos y selección.
+def excel_en_memoria(df, hoja):
+    from io import BytesIO
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name=hoja)
+    return buffer.getvalue()
 
-        df_anulaciones =pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
-        df_anulaciones.columns = df_anulaciones.columns.str.strip()
+@st.cache_data(max_entries=32)
+def reporte_perdidos_memo(_datos, version, meses):
+    """Reporte de mantenimientos perdidos y su Excel para una tupla de meses"""
+    df_reporte = generar_reporte_mantenimientos_perdidos(_datos, list(meses))
+    excel = excel_en_memoria(df_reporte, 'Mantenimientos Perdidos') if not df_reporte.empty else None
+    return df_reporte, excel
 
-        # Filtrar el DataFrame para que solo queden las columnas relevantes para el análisis 
-        df = df[columnas_relevantes]
-        df_anulaciones = df_anulaciones[columnas_anulaciones]
+@st.cache_data(max_entries=4)
+def reporte_incompleta_memo(_datos, version):
+    """Reporte de ejecución incompleta y su Excel"""
+    df_reporte = generar_reporte_ejecucion_incompleta(_datos)
+    if df_reporte is None or df_reporte.empty:
+        return df_reporte, None
+    return df_reporte, excel_en_memoria(df_reporte, 'Ejecución Incompleta')
 
-        # Preparar columna de fecha
-        df[COL_FECHA] = df[COL_FECHA].astype(str).str.strip().str.lower()
-        df["MES"] = df[COL_FECHA].apply(convertir_mes_ano)
+@st.cache_data(max_entries=32)
+def analisis_especialidad_memo(_datos, version, especialidad):
+    """Conteos, evolución, predicción e histórico de una especialidad"""
+    df_especialidad = registros_especialidad(_datos, especialidad)
+    estados = df_especialidad[COL_ESTADO].str.lower()
+    
+    return {
+        'total': len(df_especialidad),
+        'por_estado': estados.value_counts().to_dict(),
+        'evolucion': df_especialidad.groupby(["MES", COL_ESTADO]).size().unstack(fill_value=0),
+        'predicciones': predecir_mantenimientos_especialidad(
+            _datos['conteo_largo'], _datos['indice_frecuencias'], especialidad, meses_a_predecir=1
+        ),
+        'historico': df_especialidad[estados == "ejecutado"].groupby("MES").size().reset_index(name="ejecutados"),
+        'sitios_problema': [site for site in _datos['eliminadas'] if especialidad in _datos['eliminadas'][site]]
+    }
 
-        
-        # Filtrar por estado
-        df_ejecutados = df[df[COL_ESTADO].str.lower() == "ejecutado"]
-        df_cancelados = df[df[COL_ESTADO].str.lower() == "cancelado"]
-        df_pendientes = df[df[COL_ESTADO].str.lower() == "pendiente"]
+@st.cache_data(max_entries=4)
+def backtest_memo(_datos, version, horizonte):
+    """Backtest de las predicciones para todas las especialidades"""
+    return backtest_predicciones(
+        _datos['conteo_largo'], _datos['indice_frecuencias'], _datos['dim_sitios'], horizonte
+    )
 
-        #Filtrar por prioridad
-        df_P1 = df[df[COL_PRIORIDAD].str.lower() == "p_1"]
-        
-        
-        # === CONTEO DE ESPECIALIDADES EJECUTADAS ===
-      
+@st.cache_data(max_entries=32)
+def anulaciones_filtradas_memo(_datos, version, tipos, especialidades):
+    df_anulaciones = _datos['df_anulaciones']
+    return df_anulaciones[
+        (df_anulaciones["Tipo de anulación"].isin(tipos)) &
+        (df_anulaciones["Especialidad eliminada"].isin(especialidades))
+    ]
 
-        conteo_ejecutadas = (
-            df_ejecutados.groupby([COL_SITE_ID, "MES", COL_ESPECIALIDAD])
-            .size()
-            .unstack(fill_value=0)
-        )
-        
-        for especialidad in ESPECIALIDADES:
-            if especialidad not in conteo_ejecutadas.columns:
-                conteo_ejecutadas[especialidad] = 0
-        
-        conteo_ejecutadas = conteo_ejecutadas[ESPECIALIDADES]
-        conteo_ejecutadas["TOTAL"] = conteo_ejecutadas.sum(axis=1)
-        conteo_ejecutadas.reset_index(inplace=True)
-        
-        # === ANÁLISIS ===
-        eliminadas, mantenimientos_perdidos = detectar_especialidades_eliminadas(
-            conteo_ejecutadas, COL_SITE_ID, ESPECIALIDADES
-        )
-        diferencias_mtto = diferencia_mtto_anterior(conteo_ejecutadas, COL_SITE_ID)
-        tendencias = calcular_tendencias(conteo_ejecutadas, COL_SITE_ID)
-        sitios_incompletos = detectar_sitios_con_ejecucion_incompleta(df, conteo_ejecutadas, COL_SITE_ID)  
-        
-        # Verificar pendientes no ejecutados
-        alertas_pendientes = verificar_pendientes_no_ejecutados(
-            df, COL_SITE_ID, COL_SITE, COL_ESPECIALIDAD, COL_ESTADO, "MES"
-        )
-        
-        # Calcular riesgos
-        prioridad_df = df[[COL_SITE_ID, COL_SITE, COL_PRIORIDAD]].drop_duplicates()
-        riesgos = {}
-        scores = {}
-        for site in df[COL_SITE_ID].unique():
-            riesgo, score = calcular_score_riesgo(
-                site, eliminadas, mantenimientos_perdidos, diferencias_mtto, prioridad_df
-            )
-            riesgos[site] = riesgo
-            scores[site] = score
-        
-        return {
-            'df': df,
-            'df_ejecutados': df_ejecutados,
-            'df_cancelados': df_cancelados,
-            'df_pendientes': df_pendientes,
-            'df_frecuencias': df_frecuencias,  # ← ESTA LÍNEA ES NUEVA
-            'conteo_ejecutadas': conteo_ejecutadas,
-            'eliminadas': eliminadas,
-            'mantenimientos_perdidos': mantenimientos_perdidos,
-            'diferencias_mtto': diferencias_mtto,
-            'tendencias': tendencias,
-            'sitios_incompletos': sitios_incompletos,
-            'alertas_pendientes': alertas_pendientes,
-            'prioridad_df': prioridad_df,
-            'riesgos': riesgos,
-            'scores': scores
-        }
-    else:
-        return None
+# === ESTILOS Y TABLAS PAGINADAS ===
+def estilos_por_categoria(valores, estilos, por_defecto=''):
+    """CSS de cada celda según su valor, con un solo map sobre la columna"""
+    return valores.astype(object).map(estilos).fillna(por_defecto)
+
+def estilos_tipo_anulacion(tipos):
+    """Rojo para anulaciones de sitio completo o permanentes, amarillo para temporales"""
+    tipos = tipos.astype(str)
+    return pd.Series(np.select(
+        [tipos.str.contains("Sitio Completo|permanente"), tipos.str.contains("Temporal|temporal")],
+        [ESTILO_ROJO, ESTILO_AMARILLO],
+        default=''
+    ), index=tipos.index)
+
+def aplicar_estilos_columnas(df, estilos_columnas):
+    """
+    Styler con el CSS de cada columna calculado de una vez.
+    
+    estilos_columnas: {columna: función(Series) → Series de CSS, o un CSS fijo para toda la columna}
+    """
+    styler = df.style
+    for columna, estilo in estilos_columnas.items():
+        if columna not in df.columns:
+            continue
+        if callable(estilo):
+            styler = styler.apply(estilo, subset=[columna])
+        else:
+            styler = styler.apply(lambda valores, css=estilo: [css] * len(valores), subset=[columna])
+    return styler
+
+def seleccionar_pagina(total, por_pagina, key, unidad):
+    """Selector de página; devuelve la posición inicial de la página elegida"""
+    total_paginas = max(1, math.ceil(total / por_pagina))
+    
+    if total_paginas == 1:
+        return 0
+    
+    # Si un filtro redujo la cantidad de páginas, se vuelve a la primera
+    if st.session_state.get(key, 1) > total_paginas:
+        st.session_state[key] = 1
+    
+    pagina = st.number_input(
+        f"Página (de {total_paginas})",
+        min_value=1,
+        max_value=total_paginas,
+        step=1,
+        key=key
+    )
+    inicio = (pagina - 1) * por_pagina
+    st.caption(f"Mostrando {inicio + 1}–{min(inicio + por_pagina, total)} de {total} {unidad}")
+    
+    return inicio
+
+def mostrar_tabla_paginada(df, key, estilos_columnas=None, filas_por_pagina=FILAS_POR_PAGINA_TABLA, **kwargs):
+    """Dibuja solo la página seleccionada de la tabla; los estilos se calculan solo para esas filas"""
+    inicio = seleccionar_pagina(len(df), filas_por_pagina, key, "registros")
+    pagina = df.iloc[inicio:inicio + filas_por_pagina]
+    
+    if estilos_columnas:
+        pagina = aplicar_estilos_columnas(pagina, estilos_columnas)
     
+    st.dataframe(pagina, hide_index=True, **kwargs)
+
 # === PÁGINA DE BIENVENIDA ===
 def pagina_bienvenida():
     # Header principal con estilo
@@ -689,6 +2920,11 @@ def pagina_bienvenida():
                      width="stretch",  type="primary", icon=":material/download:"):
             st.session_state.pagina_actual = "Generar Reporte"
             st.rerun()
+        
+        if st.button("**Desempeño por Contratista**", 
+                     width="stretch",  type="primary", icon=":material/leaderboard:"):
+            st.session_state.pagina_actual = "Desempeño"
+            st.rerun()
     
     with col2:
         if st.button("**Análisis por Especialidades**", 
@@ -712,14 +2948,40 @@ def pagina_bienvenida():
     col_foot1, col_foot2, col_foot3 = st.columns(3)
     
     with col_foot1:
-        st.caption(f"{len(datos['df'])} registros totales")
+        st.caption(f"{datos['total_registros']} registros totales")
     
     with col_foot2:
-        meses_disponibles = datos['df']['MES'].nunique()
-        st.caption(f" {meses_disponibles} meses de historial")
+        st.caption(f" {datos['meses_disponibles']} meses de historial")
     
     with col_foot3:
         st.caption(f" Versión 1.0")
+    
+    if datos.get('fecha_datos'):
+        st.caption(f"Datos al {datos['fecha_datos']:%d/%m/%Y %H:%M}")
+    
+    error_recarga = iniciar_datos_compartidos().get('error')
+    if error_recarga:
+        st.warning(f"No se pudieron recargar los datos nuevos; se muestra la versión anterior. ({error_recarga})")
+    
+    # Validación del libro de frecuencias
+    indice_frecuencias = datos['indice_frecuencias']
+    avisos_frecuencias = [
+        f"{cantidad} {texto}" for cantidad, texto in [
+            (indice_frecuencias['duplicados'][COL_SITE_ID].nunique(), "sitios repetidos (se usa la última fila)"),
+            (len(indice_frecuencias['invalidas']), "filas sin Site Id o con frecuencia inválida"),
+            (len(indice_frecuencias['sitios_sin_frecuencia']), "sitios sin frecuencia"),
+            (len(indice_frecuencias['sitios_desconocidos']), "sitios del archivo sin mantenimientos")
+        ] if cantidad
+    ]
+    if avisos_frecuencias:
+        st.caption(f"Frecuencias ({ARCHIVO_FRECUENCIAS}): " + " · ".join(avisos_frecuencias))
+    
+    tiempos_carga = datos.get('tiempos_carga', {})
+    if tiempos_carga:
+        st.caption(
+            "Tiempos de carga: " +
+            " · ".join(f"{archivo} {segundos:.1f} s" for archivo, segundos in tiempos_carga.items())
+        )
 
     
 # === PÁGINA DE BÚSQUEDA POR SITE ID ===
@@ -732,34 +2994,46 @@ def pagina_busqueda_site():
         st.info(" Por favor carga un archivo Excel para iniciar el análisis.")
         return
     
-    # Obtener lista de todos los Site IDs disponibles
-    lista_sites = sorted(datos['df'][COL_SITE_ID].unique())
-    
-    # Buscador con autocompletado
-    site_buscado = st.selectbox(
-        "Ingresar el ID del sitio buscado:",
-        options=[""] + lista_sites,
-        format_func=lambda x: "Escribe para buscar ... " if x == "" else x
+    # Buscador: la búsqueda se resuelve en el servidor y solo se envían los mejores resultados
+    texto_busqueda = st.text_input(
+        "Ingresar el ID o el nombre del sitio buscado:",
+        placeholder="Escribe para buscar ...",
+        key="texto_busqueda_site"
     )
     
+    site_buscado = None
+    if texto_busqueda:
+        resultados = buscar_sitios(datos['indice_busqueda'], texto_busqueda)
+        
+        if not resultados:
+            st.warning(f"No se encontraron sitios para: {texto_busqueda}")
+            return
+        
+        site_buscado = st.selectbox(
+            f"Resultados ({len(resultados)}):",
+            options=resultados,
+            format_func=lambda site: f"{site} — {nombre_sitio(datos, site)}",
+            key="site_buscado"
+        )
+    
     if site_buscado and site_buscado != "":
         # Obtener información del sitio
-        site_info = datos['prioridad_df'][datos['prioridad_df'][COL_SITE_ID] == site_buscado]
-        
-        if site_info.empty:
+        if site_buscado not in datos['dim_sitios'].index:
             st.error(f"No se encontró información para el Site ID: {site_buscado}")
             return
         
-        site_name = site_info[COL_SITE].iloc[0]
-        site_prioridad = site_info[COL_PRIORIDAD].iloc[0]
+        site_info = datos['dim_sitios'].loc[site_buscado]
+        site_name = site_info[COL_SITE]
+        site_prioridad = site_info[COL_PRIORIDAD]
         
         # Filtrar datos del sitio
-        df_site = datos['df'][datos['df'][COL_SITE_ID] == site_buscado]
-        df_site_ejecutados = datos['df_ejecutados'][datos['df_ejecutados'][COL_SITE_ID] == site_buscado]
-        df_site_pendientes = datos['df_pendientes'][datos['df_pendientes'][COL_SITE_ID] == site_buscado]
-        df_site_cancelados = datos['df_cancelados'][datos['df_cancelados'][COL_SITE_ID] == site_buscado]
+        df_site = registros_sitio(datos, site_buscado)
+        estado_site = df_site[COL_ESTADO].str.lower()
+        df_site_ejecutados = df_site[estado_site == "ejecutado"]
+        df_site_pendientes = df_site[estado_site == "pendiente"]
+        df_site_cancelados = df_site[estado_site == "cancelado"]
         
-        contratista_site = df_site[COL_CONTRATISTA].iloc[0] if not df_site.empty else "No disponible"
+        contratista_site = site_info[COL_CONTRATISTA]
         
         # Encabezado con información básica
         st.header(f"{site_buscado} — {site_name}  — {site_prioridad} ")
@@ -787,6 +3061,21 @@ def pagina_busqueda_site():
         with col4:
             porcentaje = (cancelados / total_mttos * 100) if total_mttos > 0 else 0
             st.metric("Cancelados", cancelados, f"{porcentaje:.1f}%", delta_color="inverse", border=True)
+        
+        # Frecuencia anual de las especialidades del sitio
+        especialidades_site = df_site[COL_ESPECIALIDAD].dropna().unique()
+        frecuencias_site = pd.Series(
+            frecuencia_anual(datos['indice_frecuencias'], [site_buscado] * len(especialidades_site), especialidades_site),
+            index=especialidades_site
+        ).sort_index()
+        if frecuencias_site.isna().all():
+            st.caption("Sin frecuencia de mantenimiento registrada")
+        elif frecuencias_site.nunique(dropna=False) == 1:
+            st.caption(f"Frecuencia anual: {frecuencias_site.iloc[0]:g} mantenimiento(s) por año")
+        else:
+            st.caption("Frecuencia anual por especialidad: " + " · ".join(
+                f"{esp} {frecuencia:g}" for esp, frecuencia in frecuencias_site.dropna().items()
+            ))
      
         
     
@@ -804,6 +3093,74 @@ def pagina_busqueda_site():
             else:
                 st.success(f"**{riesgo_sitio}**")
         
+        # === CUMPLIMIENTO DE FRECUENCIA ===
+        cumplimiento_site = datos['cumplimiento'][datos['cumplimiento'][COL_SITE_ID] == site_buscado]
+        if not cumplimiento_site.empty:
+            st.markdown("---")
+            st.subheader(f"Cumplimiento de Frecuencia {datos['fecha_corte']:%Y}")
+            
+            st.dataframe(
+                cumplimiento_site[[
+                    COL_ESPECIALIDAD, "frecuencia", "esperados", "ejecutados", "faltantes",
+                    "cumplimiento", "ultimo_mtto", "proximo_vencimiento", "dias_vencido"
+                ]].rename(columns={
+                    COL_ESPECIALIDAD: "Especialidad",
+                    "frecuencia": "Frecuencia Anual",
+                    "esperados": "Esperados a la Fecha",
+                    "ejecutados": "Ejecutados en el Año",
+                    "faltantes": "Faltantes",
+                    "cumplimiento": "Cumplimiento %",
+                    "ultimo_mtto": "Último Mtto",
+                    "proximo_vencimiento": "Próximo Vencimiento",
+                    "dias_vencido": "Días Vencido"
+                }),
+                hide_index=True,
+                width="stretch",
+                column_config={
+                    "Último Mtto": st.column_config.DateColumn(format="YYYY-MM-DD"),
+                    "Próximo Vencimiento": st.column_config.DateColumn(format="YYYY-MM-DD")
+                }
+            )
+        
+        # === PENDIENTES ABIERTOS ===
+        backlog = datos['backlog_pendientes']
+        if site_buscado in backlog.index:
+            pendientes_site = backlog.loc[[site_buscado]].reset_index(level=0, drop=True)
+            st.markdown("---")
+            st.subheader("Pendientes sin Resolver")
+            st.dataframe(
+                pendientes_site.reset_index()[[COL_ESPECIALIDAD, "MES", "meses_abierto", "dias_abierto"]].rename(columns={
+                    COL_ESPECIALIDAD: "Especialidad",
+                    "MES": "Mes Pendiente",
+                    "meses_abierto": "Meses Abierto",
+                    "dias_abierto": "Días Abierto"
+                }),
+                hide_index=True,
+                width="stretch"
+            )
+        
+        # === EVOLUCIÓN DEL RIESGO ===
+        if site_buscado in datos['historial_riesgo'].index:
+            historial_sitio = datos['historial_riesgo'].loc[[site_buscado]]
+            
+            st.markdown("---")
+            st.subheader("Evolución del Riesgo")
+            
+            st.line_chart(
+                historial_sitio.assign(MES=historial_sitio["MES"].astype(str)),
+                x="MES",
+                y="score"
+            )
+            
+            # Desde cuándo está en el nivel actual
+            niveles = historial_sitio["nivel"].to_numpy()
+            cambios = np.flatnonzero(niveles != niveles[-1])
+            desde = historial_sitio["MES"].iloc[cambios[-1] + 1 if len(cambios) else 0]
+            st.caption(
+                f"{niveles[-1]} desde {desde} · "
+                f"Medio riesgo con score ≥ {UMBRAL_MEDIO_RIESGO}, alto riesgo con score ≥ {UMBRAL_ALTO_RIESGO}"
+            )
+        
         # === TENDENCIA ===
         
         
@@ -828,6 +3185,25 @@ def pagina_busqueda_site():
                 st.metric("Promedio Histórico", 
                          f"{tend['promedio_historico']:.1f}", 
                          border=True)
+            
+            # Mantenimientos del mes frente al promedio y al umbral del 80% en cada mes
+            historial_sitio = datos['historial_tendencias'].loc[[site_buscado]]
+            st.line_chart(
+                historial_sitio.assign(MES=historial_sitio["MES"].astype(str)).rename(columns={
+                    "ultimo_mes": "Mantenimientos",
+                    "promedio_historico": "Promedio histórico",
+                    "umbral_80p": "Umbral 80%"
+                }),
+                x="MES",
+                y=["Mantenimientos", "Promedio histórico", "Umbral 80%"]
+            )
+            
+            # Cambios de tendencia
+            estados = historial_sitio["tendencia"].astype(str)
+            transiciones = historial_sitio[estados != estados.shift(1)]
+            st.caption(" → ".join(
+                f"{fila.tendencia} ({fila.MES})" for fila in transiciones.itertuples()
+            ))
         
         # === ESPECIALIDADES ELIMINADAS ===
         if site_buscado in datos['eliminadas'] and datos['eliminadas'][site_buscado]:
@@ -876,10 +3252,7 @@ def pagina_busqueda_site():
 
         # === ANULACIONES REGISTRADAS ===
         try:
-            df_anulaciones_full = pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
-            df_anulaciones_full.columns = df_anulaciones_full.columns.str.strip()
-            
-            anulaciones_site = df_anulaciones_full[df_anulaciones_full["Site Id"] == site_buscado]
+            anulaciones_site = anulaciones_sitio(datos, site_buscado)
             
             if not anulaciones_site.empty:
                 st.markdown("---")
@@ -905,35 +3278,25 @@ def pagina_busqueda_site():
                 
                 st.dataframe(styled_anulaciones, hide_index=True, width='stretch')
         
-        except FileNotFoundError:
-            pass  # Si no existe el archivo, simplemente no mostramos la sección
         except Exception as e:
             st.warning(f"No se pudieron cargar las anulaciones: {str(e)}")
         
         
         # === ALERTAS DE PENDIENTES ===
-        alertas_site = [a for a in datos['alertas_pendientes'] if a['site ID'] == site_buscado]
+        alertas_site = datos['alertas_pendientes'][datos['alertas_pendientes']["site ID"] == site_buscado]
         
-        if alertas_site:
+        if not alertas_site.empty:
             st.markdown("---")
             st.subheader("Mantenimientos Pendientes sin Ejecutar")
             st.error(f"Este sitio tiene **{len(alertas_site)}** mantenimientos pendientes sin resolver")
             
-            df_alertas_site = pd.DataFrame(alertas_site)
-            
-            # Aplicar estilos
-            def aplicar_estilos_alertas(df):
-                styles = pd.DataFrame('', index=df.index, columns=df.columns)
-                if 'severidad' in df.columns:
-                    styles['severidad'] = df['severidad'].apply(
-                        lambda x: 'background-color: #fee2e2; color: #991b1b; font-weight: bold' if x == 'CRÍTICA' 
-                        else 'background-color: #fed7aa; color: #9a3412; font-weight: bold' if x == 'ALTA'
-                        else 'background-color: #fef3c7; color: #92400e; font-weight: bold'
-                    )
-                return styles
-            
-            styled_alertas = df_alertas_site.style.apply(aplicar_estilos_alertas, axis=None)
-            st.dataframe(styled_alertas, hide_index=True) 
+            mostrar_tabla_paginada(
+                alertas_site.drop(columns="prioridad"),
+                key=f"pagina_alertas_{site_buscado}",
+                estilos_columnas={
+                    'severidad': lambda valores: estilos_por_categoria(valores, ESTILOS_SEVERIDAD, ESTILO_AMARILLO)
+                }
+            )
 
 # === PÁGINA DE MANTENIMIENTOS PENDIENTES ===
 def pagina_pendientes():
@@ -946,67 +3309,223 @@ def pagina_pendientes():
         return
 
     # === ALERTAS DE PENDIENTES NO EJECUTADOS ===
-    if datos['alertas_pendientes']:
+    if not datos['alertas_pendientes'].empty:
         
         # Mostrar tabla de alertas
         st.subheader("Detalle de Pendientes No Ejecutados")
-        
-        df_alertas = pd.DataFrame(datos['alertas_pendientes'])
-        
-        # VERIFICAR SI LAS COLUMNAS NUEVAS EXISTEN, SI NO, CREARLAS CON VALORES POR DEFECTO
-        if 'recuento_ejecutados' not in df_alertas.columns:
-            df_alertas['recuento_ejecutados'] = 'N/A'
-        if 'recuento_ejecutados2' not in df_alertas.columns:
-            df_alertas['recuento_ejecutados2'] = 'N/A'
-        
-        # Reordenar columnas para mejor visualización
-        column_order = [
-            "site ID", "site", "especialidad", 
-            "mes_pendiente", "recuento_ejecutados",
-            "mes_siguiente_mtto", "recuento_ejecutados2",
-            "meses_entre_mttos", "estado_siguiente", 
-            "dias_sin_ejecutar", "severidad"
-        ]
-        
-        # Filtrar solo las columnas que existen en el DataFrame
-        columnas_disponibles = [col for col in column_order if col in df_alertas.columns]
-        
-        # Función para aplicar estilos
-        def aplicar_estilos(df):
-            """
-            Aplica estilos de colores al DataFrame completo
-            """
-            styles = pd.DataFrame('', index=df.index, columns=df.columns)
-            
-            # Colorear columna 'severidad'
-            if 'severidad' in df.columns:
-                styles['severidad'] = df['severidad'].apply(
-                    lambda x: 'background-color: #fee2e2; color: #991b1b; font-weight: bold' if x == 'CRÍTICA' 
-                    else 'background-color: #fed7aa; color: #9a3412; font-weight: bold' if x == 'ALTA'
-                    else 'background-color: #fef3c7; color: #92400e; font-weight: bold' if x == 'MEDIA'
-                    else ''
-                )
-            
-            # Colorear las nuevas columnas de azul
-            if 'recuento_ejecutados' in df.columns:
-                styles['recuento_ejecutados'] = 'background-color: #e6f3ff; color: #0066cc; font-weight: bold'
-            
-            if 'recuento_ejecutados2' in df.columns:
-                styles['recuento_ejecutados2'] = 'background-color: #e6f3ff; color: #0066cc; font-weight: bold'
-            
-            return styles
-        
-        # Aplicar estilos
-        styled_df = df_alertas[columnas_disponibles].style.apply(
-            aplicar_estilos, 
-            axis=None
-        )
-        
-        st.dataframe(styled_df, width='stretch', hide_index=True)
-        
+        mostrar_tabla_alertas(datos['alertas_pendientes'])
         
     else:
         st.success("   No hay mantenimientos pendientes sin ejecutar")
+    
+    # === TIEMPO DE RESOLUCIÓN Y PENDIENTES ABIERTOS ===
+    st.markdown("---")
+    mostrar_latencia_resolucion(datos)
+
+@st.fragment
+def mostrar_latencia_resolucion(datos):
+    """Distribución del tiempo hasta resolver los pendientes y pendientes aún abiertos"""
+    st.subheader("Tiempo de Resolución de Pendientes")
+    
+    resolucion = datos['resolucion_pendientes']
+    if resolucion.empty:
+        st.info("No hay registros pendientes")
+        return
+    
+    resueltos = resolucion[resolucion["resuelto"]]
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Pendientes Resueltos", len(resueltos), f"de {len(resolucion)}", delta_color="off", border=True)
+    with col2:
+        st.metric("Días hasta Resolver (mediana)",
+                  f"{resueltos['dias_resolucion'].median():.0f}" if not resueltos.empty else "—", border=True)
+    with col3:
+        st.metric("Pendientes Abiertos", len(datos['backlog_pendientes']), border=True)
+    
+    agrupar = st.segmented_control(
+        "Agrupar por:",
+        ["Especialidad", "Contratista", "Prioridad"],
+        default="Especialidad",
+        key="latencia_agrupar"
+    ) or "Especialidad"
+    columna = {"Especialidad": COL_ESPECIALIDAD, "Contratista": COL_CONTRATISTA, "Prioridad": COL_PRIORIDAD}[agrupar]
+    
+    st.dataframe(
+        datos['latencia_resolucion'][columna].rename(columns={
+            columna: agrupar,
+            "pendientes": "Pendientes",
+            "resueltos": "Resueltos",
+            "abiertos": "Abiertos",
+            "meses_promedio": "Meses Promedio",
+            "dias_promedio": "Días Promedio",
+            "dias_p50": "Días P50",
+            "dias_p75": "Días P75",
+            "dias_p90": "Días P90",
+            "dias_maximo": "Días Máximo"
+        }),
+        hide_index=True,
+        width="stretch"
+    )
+    
+    # Distribución de los meses hasta la resolución
+    st.bar_chart(
+        resueltos["meses_resolucion"].astype(int).value_counts().sort_index().rename_axis("Meses").rename("Pendientes")
+    )
+    
+    st.subheader("Pendientes Abiertos")
+    backlog = datos['backlog_pendientes']
+    if backlog.empty:
+        st.success("Todos los pendientes ya tienen un mantenimiento ejecutado posterior")
+        return
+    
+    mostrar_tabla_paginada(
+        backlog.reset_index().sort_values("meses_abierto", ascending=False, kind="stable").rename(columns={
+            COL_ESPECIALIDAD: "Especialidad",
+            "MES": "Mes Pendiente",
+            "meses_abierto": "Meses Abierto",
+            "dias_abierto": "Días Abierto"
+        }),
+        key="pagina_pendientes_abiertos",
+        width="stretch"
+    )
+
+@st.fragment
+def mostrar_tabla_alertas(tabla):
+    """
+    Filtros, orden y tabla paginada de alertas. El filtrado y el orden se hacen en
+    el servidor sobre la tabla tipada; al navegador solo llega la página visible.
+    """
+    col_filtro1, col_filtro2, col_filtro3 = st.columns(3)
+    
+    with col_filtro1:
+        severidades = st.multiselect(
+            "Severidad:", ORDEN_SEVERIDAD, default=ORDEN_SEVERIDAD, key="alertas_severidad"
+        )
+    
+    with col_filtro2:
+        especialidades = st.multiselect(
+            "Especialidad:", tabla["especialidad"].cat.categories.tolist(),
+            placeholder="Todas", key="alertas_especialidad"
+        )
+    
+    with col_filtro3:
+        prioridades = st.multiselect(
+            "Prioridad:", sorted(tabla["prioridad"].cat.categories.tolist()),
+            placeholder="Todas", key="alertas_prioridad"
+        )
+    
+    col_rango, col_orden, col_sentido = st.columns([2, 1, 1])
+    
+    with col_rango:
+        minimo, maximo = int(tabla["meses_entre_mttos"].min()), int(tabla["meses_entre_mttos"].max())
+        meses_entre = (
+            st.slider("Meses entre mantenimientos:", minimo, maximo, (minimo, maximo), key="alertas_meses")
+            if maximo > minimo else None
+        )
+    
+    with col_orden:
+        orden = st.selectbox(
+            "Ordenar por:",
+            ["severidad", "meses_entre_mttos", "mes_pendiente", "site ID", "especialidad", "prioridad"],
+            key="alertas_orden"
+        )
+    
+    with col_sentido:
+        st.write("")
+        descendente = st.toggle("Descendente", key="alertas_descendente")
+    
+    df_alertas = consultar_alertas(
+        tabla,
+        severidades=severidades,
+        especialidades=especialidades or None,
+        prioridades=prioridades or None,
+        meses_entre=meses_entre,
+        orden=orden,
+        descendente=descendente
+    )
+    
+    if df_alertas.empty:
+        st.info("Ninguna alerta cumple con los filtros seleccionados")
+        return
+    
+    # Solo la página visible se estiliza y se envía al navegador
+    mostrar_tabla_paginada(
+        df_alertas,
+        key="pagina_alertas_pendientes",
+        estilos_columnas={
+            'severidad': lambda valores: estilos_por_categoria(valores, ESTILOS_SEVERIDAD),
+            'recuento_ejecutados': ESTILO_AZUL,
+            'recuento_ejecutados2': ESTILO_AZUL
+        },
+        width='stretch'
+    )
+
+
+# === COMPONENTES COMPARTIDOS DE SITIOS PROBLEMÁTICOS ===
+def seleccionar_prioridad(grupos, key):
+    """
+    Selector de prioridad para las vistas de sitios problemáticos.
+    A diferencia de st.tabs, solo se dibuja el grupo seleccionado.
+    """
+    def contar_sitios(nombre_tab):
+        grupo = grupos.get(GRUPOS_PRIORIDADES[nombre_tab], [])
+        if isinstance(grupo, dict):
+            return sum(len(sitios) for sitios in grupo.values())
+        return len(grupo)
+    
+    nombre_tab = st.segmented_control(
+        "Prioridad",
+        options=list(GRUPOS_PRIORIDADES.keys()),
+        format_func=lambda k: f"Sites {k} ({contar_sitios(k)})",
+        default="P1",
+        required=True,
+        key=key,
+        label_visibility="collapsed"
+    )
+    
+    return nombre_tab, GRUPOS_PRIORIDADES[nombre_tab]
+
+
+def paginar_sitios(sitios, key):
+    """Devuelve solo los sitios de la página seleccionada (SITIOS_POR_PAGINA por página)"""
+    inicio = seleccionar_pagina(len(sitios), SITIOS_POR_PAGINA, key, "sitios")
+    return sitios[inicio:inicio + SITIOS_POR_PAGINA]
+
+
+def nombre_sitio(datos, site):
+    """Nombre del sitio según la dimensión de sitios (o el mismo Site Id si no se encuentra)"""
+    return datos['dim_sitios'][COL_SITE].get(site, site)
+
+
+def mostrar_anulaciones_sitio(datos, site, titulo):
+    """Lista las anulaciones registradas para un sitio, si las hay"""
+    anulaciones = anulaciones_sitio(datos, site)
+    
+    if anulaciones.empty:
+        return
+    
+    st.markdown("---")
+    st.write(titulo)
+    
+    for _, anulacion in anulaciones.iterrows():
+        tipo_color = "🔴" if "sitio completo" in str(anulacion["Tipo de anulación"]).lower() else "🟡"
+        st.write(f"{tipo_color} **{anulacion['Especialidad eliminada']}** — {anulacion['Tipo de anulación']}")
+        st.caption(f"Justificación: {anulacion['Justificación']}")
+
+
+def mostrar_grafico_evolucion(site_data):
+    """Gráfico de barras con la evolución mensual por especialidad de un sitio"""
+    columnas_grafico = [
+        c for c in site_data.columns 
+        if c not in [COL_SITE_ID, "MES", "TOTAL"]
+    ]
+    df_grafico = site_data.melt(
+        id_vars=["MES"],
+        value_vars=columnas_grafico,
+        var_name="Especialidad",
+        value_name="Cantidad"
+    )
+    st.bar_chart(df_grafico, x="MES", y="Cantidad", color="Especialidad", horizontal=True)
 
 
 def pagina_sitios_problematicos():
@@ -1018,6 +3537,14 @@ def pagina_sitios_problematicos():
         st.info(" Por favor carga un archivo Excel para iniciar el análisis.")
         return
     
+    if EXCLUIR_ANULADAS:
+        st.caption("No se consideran las especialidades ni los sitios con anulaciones registradas.")
+    
+    mostrar_sitios_problematicos(datos)
+
+@st.fragment
+def mostrar_sitios_problematicos(datos):
+    """Selector del tipo de problema y su listado (se vuelve a ejecutar solo esta parte)"""
     col_btn1, col_btn2, col_btn3 = st.columns(3)
     
     with col_btn1:
@@ -1051,7 +3578,7 @@ def mostrar_sitios_con_ejecucion_incompleta(datos):
     """Muestra sitios que iniciaron mantenimientos este mes pero no completan la cantidad del mes anterior"""
     
     st.header("Sitios con Ejecución Incompleta Este Mes")
-    st.caption("Sitios que ya ejecutaron al menos un mantenimiento hace más de 2 días, pero aún no alcanzan la cantidad del mes anterior")
+    st.caption(f"Sitios que ya ejecutaron al menos un mantenimiento hace más de {DIAS_GRACIA_EJECUCION_INCOMPLETA} días, pero aún no alcanzan la cantidad del mes anterior")
     
     sitios_incompletos = datos.get('sitios_incompletos', {})
     
@@ -1061,255 +3588,200 @@ def mostrar_sitios_con_ejecucion_incompleta(datos):
     
     st.markdown("---")
     
-    # Cargar anulaciones
-    try:
-        df_anulaciones_full = pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
-        df_anulaciones_full.columns = df_anulaciones_full.columns.str.strip()
-        tiene_anulaciones = True
-    except:
-        tiene_anulaciones = False
-
-    grupos_prioridades = {
-        "P1": "P_1", "P2": "P_2", "P3": "P_3",
-        "D1": "D_1", "D2": "D_2", "D3": "D_3",
-        "B1": "B_1", "B2": "B_2", "B3": "B_3"
-    }
-    
-    tabs = st.tabs([f"Sites {k}" for k in grupos_prioridades.keys()])
+    # Los sitios ya vienen agrupados por prioridad y ordenados por porcentaje completado
+    grupos = datos['grupos_problematicos']['incompletos']
+    nombre_tab, codigo_prioridad = seleccionar_prioridad(grupos, "prioridad_incompletos")
+    sitios_con_alerta = grupos.get(codigo_prioridad, [])
     
-    for (nombre_tab, codigo_prioridad), tab in zip(grupos_prioridades.items(), tabs):
-        with tab:
-            # Filtrar sitios de esta prioridad
-            sitios_prioridad = datos['prioridad_df'][
-                datos['prioridad_df'][COL_PRIORIDAD] == codigo_prioridad
-            ][COL_SITE_ID].unique()
+    if sitios_con_alerta:
+        st.write(f"**⚠️ {len(sitios_con_alerta)} sitios con ejecución incompleta en {nombre_tab}**")
+        
+        for site in paginar_sitios(sitios_con_alerta, f"pagina_incompletos_{codigo_prioridad}"):
+            info = sitios_incompletos[site]
+            site_name = nombre_sitio(datos, site)
             
-            # Sitios incompletos en esta prioridad
-            sitios_con_alerta = [
-                s for s in sitios_prioridad 
-                if s in sitios_incompletos
-            ]
+            # Determinar color según porcentaje
+            if info['porcentaje_completado'] < 50:
+                color_badge = "red"
+                nivel = "CRÍTICO"
+            elif info['porcentaje_completado'] < 75:
+                color_badge = "orange"
+                nivel = "ALERTA"
+            else:
+                color_badge = "yellow"
+                nivel = "MONITOREO"
             
-            if sitios_con_alerta:
-                st.write(f"**⚠️ {len(sitios_con_alerta)} sitios con ejecución incompleta en {nombre_tab}**")
+            expander = st.expander(
+                f"{site} — {site_name} — "
+                f"{info['porcentaje_completado']}% completado, "
+                f"{info['faltantes']} mttos faltantes",
+                key=f"exp_incompletos_{site}",
+                on_change="rerun"
+            )
+            with expander:
+                # El detalle solo se dibuja cuando el usuario abre el expander
+                if not expander.open:
+                    continue
                 
-                # Ordenar por porcentaje completado (los más atrasados primero)
-                sitios_ordenados = sorted(
-                    sitios_con_alerta,
-                    key=lambda s: sitios_incompletos[s]['porcentaje_completado']
-                )
+                st.markdown(f":{color_badge}-badge[{nivel}]")
                 
-                for site in sitios_ordenados:
-                    info = sitios_incompletos[site]
-                    
-                    site_name_row = datos['prioridad_df'][datos['prioridad_df'][COL_SITE_ID] == site]
-                    site_name = site_name_row[COL_SITE].iloc[0] if not site_name_row.empty else site
-                    
-                    # Determinar color según porcentaje
-                    if info['porcentaje_completado'] < 50:
-                        color_badge = "red"
-                        nivel = "CRÍTICO"
-                    elif info['porcentaje_completado'] < 75:
-                        color_badge = "orange"
-                        nivel = "ALERTA"
-                    else:
-                        color_badge = "yellow"
-                        nivel = "MONITOREO"
-                    
-                    with st.expander(
-                        f"{site} — {site_name} — "
-                        f"{info['porcentaje_completado']}% completado, "
-                        f"{info['faltantes']} mttos faltantes"
-                    ):
-                        st.markdown(f":{color_badge}-badge[{nivel}]")
-                        
-                        # Métricas
-                        col1, col2, col3, col4 = st.columns(4)
-                        
-                        with col1:
-                            st.metric(
-                                "Mes Anterior",
-                                info['mes_anterior_total'],
-                                border=True
-                            )
-                        
-                        with col2:
-                            st.metric(
-                                "Realizados Este Mes",
-                                info['mes_actual_realizados'],
-                                f"{info['porcentaje_completado']}%",
-                                border=True
-                            )
-                        
-                        with col3:
-                            st.metric(
-                                "Faltantes",
-                                info['faltantes'],
-                                delta_color="inverse",
-                                border=True
-                            )
-                        
-                        with col4:
-                            st.metric(
-                                "Días Desde Último Mtto",
-                                info['dias_desde_ultimo'],
-                                border=True
-                            )
-                        
-                        st.caption(f"Último mantenimiento: {info['ultimo_mtto_fecha']}")
-                        
-                        # Verificar si hay anulaciones registradas
-                        if tiene_anulaciones:
-                            anulaciones_sitio = df_anulaciones_full[df_anulaciones_full["Site Id"] == site]
-                            
-                            if not anulaciones_sitio.empty:
-                                st.markdown("---")
-                                st.write("**📋 Anulaciones registradas:**")
-                                
-                                for _, anulacion in anulaciones_sitio.iterrows():
-                                    tipo_color = "🔴" if "Sitio Completo" in str(anulacion["Tipo de anulación"]) else "🟡"
-                                    st.write(f"{tipo_color} **{anulacion['Especialidad eliminada']}** — {anulacion['Tipo de anulación']}")
-                                    st.caption(f"Justificación: {anulacion['Justificación']}")
-                        
-                        st.markdown("---")
-                        
-                        # Mostrar evolución histórica
-                        site_data = datos['conteo_ejecutadas'][
-                            datos['conteo_ejecutadas'][COL_SITE_ID] == site
-                        ].sort_values("MES")
-                        
-                        if not site_data.empty:
-                            st.write("**Evolución histórica:**")
-                            columnas_grafico = [
-                                c for c in site_data.columns 
-                                if c not in [COL_SITE_ID, "MES", "TOTAL"]
-                            ]
-                            
-                            df_grafico = site_data.melt(
-                                id_vars=["MES"],
-                                value_vars=columnas_grafico,
-                                var_name="Especialidad",
-                                value_name="Cantidad"
-                            )
-                            st.bar_chart(df_grafico, x="MES", y="Cantidad", color="Especialidad", horizontal=True)
-            else:
-                st.success(f"✅ No hay sitios de tipo {nombre_tab} con ejecución incompleta")
+                # Métricas
+                col1, col2, col3, col4 = st.columns(4)
+                
+                with col1:
+                    st.metric(
+                        "Mes Anterior",
+                        info['mes_anterior_total'],
+                        border=True
+                    )
+                
+                with col2:
+                    st.metric(
+                        "Realizados Este Mes",
+                        info['mes_actual_realizados'],
+                        f"{info['porcentaje_completado']}%",
+                        border=True
+                    )
+                
+                with col3:
+                    st.metric(
+                        "Faltantes",
+                        info['faltantes'],
+                        delta_color="inverse",
+                        border=True
+                    )
+                
+                with col4:
+                    st.metric(
+                        "Días Desde Último Mtto",
+                        info['dias_desde_ultimo'],
+                        border=True
+                    )
+                
+                st.caption(f"Último mantenimiento: {info['ultimo_mtto_fecha']}")
+                
+                # Verificar si hay anulaciones registradas
+                mostrar_anulaciones_sitio(datos, site, "**📋 Anulaciones registradas:**")
+                
+                st.markdown("---")
+                
+                # Mostrar evolución histórica
+                site_data = datos['conteo_ejecutadas'][
+                    datos['conteo_ejecutadas'][COL_SITE_ID] == site
+                ].sort_values("MES")
+                
+                if not site_data.empty:
+                    st.write("**Evolución histórica:**")
+                    mostrar_grafico_evolucion(site_data)
+    else:
+        st.success(f"✅ No hay sitios de tipo {nombre_tab} con ejecución incompleta")
 
 def generar_reporte_ejecucion_incompleta(datos):
     """
     Genera un reporte detallado en Excel de los sitios con ejecución incompleta,
     incluyendo las especialidades faltantes, mes de ejecución, FLM asignado y anulaciones.
     """
-    from datetime import datetime
-    
     sitios_incompletos = datos.get('sitios_incompletos', {})
     
     if not sitios_incompletos:
         return None
     
-    mes_actual_str = datetime.now().strftime("%Y-%m")
+    # Mismo mes de corte con el que se detectaron los sitios incompletos
+    mes_actual_str = datos['fecha_corte'].strftime("%Y-%m")
     
-    # Cargar archivo de anulaciones
-    try:
-        df_anulaciones_full = pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
-        df_anulaciones_full.columns = df_anulaciones_full.columns.str.strip()
-        tiene_anulaciones = True
-    except:
-        tiene_anulaciones = False
-        df_anulaciones_full = pd.DataFrame()
+    sitios = list(sitios_incompletos.keys())
     
-    reporte_data = []
+    # Matriz sitio × especialidad de los dos últimos meses hasta el mes de corte
+    conteo = datos['conteo_ejecutadas']
+    conteo = conteo[
+        conteo[COL_SITE_ID].isin(sitios) & (conteo["MES"] <= mes_actual_str)
+    ].sort_values([COL_SITE_ID, "MES"])
+    ultimos_meses = conteo.groupby(COL_SITE_ID).tail(2)
     
-    for site_id, info in sitios_incompletos.items():
-        # Obtener información del sitio
-        site_info = datos['prioridad_df'][datos['prioridad_df'][COL_SITE_ID] == site_id]
-        
-        if site_info.empty:
-            continue
-        
-        site_name = site_info[COL_SITE].iloc[0]
-        site_prioridad = site_info[COL_PRIORIDAD].iloc[0]
-        
-        # Obtener FLM del sitio
-        df_site = datos['df'][datos['df'][COL_SITE_ID] == site_id]
-        flm_sitio = df_site[COL_FLM_ESPECIFICO].iloc[0] if not df_site.empty else "Sin Asignar"
-        
-        # Obtener especialidades ejecutadas este mes
-        df_ejecutados_mes_actual = datos['df_ejecutados'][
-            (datos['df_ejecutados'][COL_SITE_ID] == site_id) &
-            (datos['df_ejecutados']["MES"] == mes_actual_str)
-        ]
-        
-        especialidades_ejecutadas_mes_actual = set(df_ejecutados_mes_actual[COL_ESPECIALIDAD].unique())
-        
-        # Obtener especialidades ejecutadas mes anterior
-        conteo_site = datos['conteo_ejecutadas'][
-            datos['conteo_ejecutadas'][COL_SITE_ID] == site_id
-        ].sort_values("MES")
-        
-        if len(conteo_site) < 2:
-            continue
-        
-        mes_anterior = conteo_site.iloc[-2]
-        
-        # Identificar especialidades faltantes (que se hicieron mes anterior pero no este mes)
-        especialidades_faltantes = []
-        for especialidad in ESPECIALIDADES:
-            if especialidad in conteo_site.columns:
-                cantidad_mes_anterior = mes_anterior[especialidad]
-                cantidad_mes_actual = len(df_ejecutados_mes_actual[
-                    df_ejecutados_mes_actual[COL_ESPECIALIDAD] == especialidad
-                ])
-                
-                if cantidad_mes_anterior > 0 and cantidad_mes_actual < cantidad_mes_anterior:
-                    faltante = cantidad_mes_anterior - cantidad_mes_actual
-                    especialidades_faltantes.append(f"{especialidad} ({faltante})")
-        
-        # Verificar si hay anulaciones registradas para este sitio
-        anulaciones_info = "No"
-        tiene_anulacion = False
-        
-        if tiene_anulaciones and not df_anulaciones_full.empty:
-            anulaciones_sitio = df_anulaciones_full[df_anulaciones_full["Site Id"] == site_id]
-            
-            if not anulaciones_sitio.empty:
-                tiene_anulacion = True
-                # Crear lista de anulaciones con tipo
-                lista_anulaciones = []
-                for _, anulacion in anulaciones_sitio.iterrows():
-                    especialidad_anulada = anulacion['Especialidad eliminada']
-                    tipo_anulacion = anulacion['Tipo de anulación']
-                    lista_anulaciones.append(f"{especialidad_anulada} ({tipo_anulacion})")
-                
-                anulaciones_info = "; ".join(lista_anulaciones)
-        
-        # Determinar nivel de criticidad
-        if info['porcentaje_completado'] < 50:
-            criticidad = "CRÍTICO"
-        elif info['porcentaje_completado'] < 75:
-            criticidad = "ALERTA"
-        else:
-            criticidad = "MONITOREO"
-        
-        reporte_data.append({
-            "Site ID": site_id,
-            "Site Name": site_name,
-            "Prioridad": site_prioridad,
-            "FLM": flm_sitio,
-            "Mes Analizado": mes_actual_str,
-            "Mttos Mes Anterior": info['mes_anterior_total'],
-            "Mttos Realizados Este Mes": info['mes_actual_realizados'],
-            "Mttos Faltantes": info['faltantes'],
-            "% Completado": f"{info['porcentaje_completado']}%",
-            "Especialidades Faltantes": ", ".join(especialidades_faltantes) if especialidades_faltantes else "Ninguna",
-            "Tiene Anulaciones": "Sí" if tiene_anulacion else "No",
-            "Detalle Anulaciones": anulaciones_info,
-            "Último Mantenimiento": info['ultimo_mtto_fecha'],
-            "Días Desde Último Mtto": info['dias_desde_ultimo'],
-            "Criticidad": criticidad
-        })
+    conteo_mes_anterior = (
+        ultimos_meses[ultimos_meses["MES"] != mes_actual_str]
+        .groupby(COL_SITE_ID)[ESPECIALIDADES].last()
+    )
+    conteo_mes_actual = (
+        ultimos_meses[ultimos_meses["MES"] == mes_actual_str]
+        .set_index(COL_SITE_ID)[ESPECIALIDADES]
+        .reindex(conteo_mes_anterior.index, fill_value=0)
+    )
+    
+    # Especialidades faltantes: se hicieron el mes anterior pero no (o menos) este mes
+    faltantes = (conteo_mes_anterior - conteo_mes_actual).where(conteo_mes_anterior > 0, 0).clip(lower=0)
+    faltantes = faltantes.stack()
+    faltantes = faltantes[faltantes > 0].astype(int)
+    faltantes.index.names = [COL_SITE_ID, "especialidad"]
+    faltantes = faltantes.reset_index(name="cantidad")
+    especialidades_faltantes = (
+        (faltantes["especialidad"] + " (" + faltantes["cantidad"].astype(str) + ")")
+        .groupby(faltantes[COL_SITE_ID]).agg(", ".join)
+    )
+    
+    # Anulaciones registradas por sitio, en una sola agregación
+    df_anulaciones = datos['df_anulaciones']
+    df_anulaciones = df_anulaciones[df_anulaciones["Site Id"].isin(sitios)]
+    # Las anulaciones de sitio completo no indican especialidad
+    especialidad_anulada = df_anulaciones["Especialidad eliminada"].fillna("Todas").astype(str)
+    detalle_anulaciones = (
+        (especialidad_anulada + " (" + df_anulaciones["Tipo de anulación"].fillna("").astype(str) + ")")
+        .groupby(df_anulaciones["Site Id"]).agg("; ".join)
+    )
     
-    df_reporte = pd.DataFrame(reporte_data)
+    detalle_sitios = pd.DataFrame(index=conteo_mes_anterior.index)
+    detalle_sitios["Especialidades Faltantes"] = especialidades_faltantes.reindex(detalle_sitios.index).fillna("Ninguna")
+    detalle_sitios["Detalle Anulaciones"] = detalle_anulaciones.reindex(detalle_sitios.index).fillna("No")
+    detalle_sitios["Tiene Anulaciones"] = np.where(
+        detalle_sitios.index.isin(detalle_anulaciones.index), "Sí", "No"
+    )
+    detalle_sitios.index.name = "Site ID"
+    detalle_sitios = detalle_sitios.reset_index()
+    
+    if detalle_sitios.empty:
+        return pd.DataFrame()
+    
+    # Métricas de ejecución por sitio
+    df_info = pd.DataFrame.from_dict(sitios_incompletos, orient="index")
+    df_info.index.name = "Site ID"
+    df_info = df_info.reset_index()
+    
+    # Unir en un solo paso con la dimensión de sitios (nombre, prioridad y FLM)
+    dimension = datos['dim_sitios'][[COL_SITE, COL_PRIORIDAD, COL_FLM_ESPECIFICO]].rename(columns={
+        COL_SITE: "Site Name",
+        COL_PRIORIDAD: "Prioridad",
+        COL_FLM_ESPECIFICO: "FLM"
+    })
+    
+    df_reporte = (
+        df_info
+        .merge(dimension, left_on="Site ID", right_index=True, how="inner")
+        .merge(detalle_sitios, on="Site ID", how="inner")
+    )
+    df_reporte["FLM"] = df_reporte["FLM"].fillna("Sin Asignar")
+    
+    # Determinar nivel de criticidad
+    df_reporte["Criticidad"] = np.select(
+        [df_reporte["porcentaje_completado"] < 50, df_reporte["porcentaje_completado"] < 75],
+        ["CRÍTICO", "ALERTA"],
+        default="MONITOREO"
+    )
+    
+    df_reporte["Mes Analizado"] = mes_actual_str
+    df_reporte["% Completado"] = df_reporte["porcentaje_completado"].astype(str) + "%"
+    df_reporte = df_reporte.rename(columns={
+        "mes_anterior_total": "Mttos Mes Anterior",
+        "mes_actual_realizados": "Mttos Realizados Este Mes",
+        "faltantes": "Mttos Faltantes",
+        "ultimo_mtto_fecha": "Último Mantenimiento",
+        "dias_desde_ultimo": "Días Desde Último Mtto"
+    })[[
+        "Site ID", "Site Name", "Prioridad", "FLM", "Mes Analizado",
+        "Mttos Mes Anterior", "Mttos Realizados Este Mes", "Mttos Faltantes",
+        "% Completado", "Especialidades Faltantes", "Tiene Anulaciones",
+        "Detalle Anulaciones", "Último Mantenimiento", "Días Desde Último Mtto",
+        "Criticidad"
+    ]]
     
     # Ordenar por criticidad y luego por porcentaje completado
     orden_criticidad = {"CRÍTICO": 0, "ALERTA": 1, "MONITOREO": 2}
@@ -1327,7 +3799,11 @@ def generar_reporte_mantenimientos_perdidos(datos, meses_seleccionados=None):
         datos: Diccionario con los datos procesados
         meses_seleccionados: Lista de meses en formato ["YYYY-MM", ...] o un solo string.
                              Si es None, usa el último mes disponible.
+    
+    Con EXCLUIR_ANULADAS se parte del conteo sin las anulaciones (ver marcar_anuladas).
     """
+    conteo = datos['conteo_analisis']
+    
     # 1. Normalizar la entrada a una lista de meses
     if meses_seleccionados is None:
         meses_seleccionados = [datos['conteo_ejecutadas']['MES'].max()]
@@ -1339,10 +3815,8 @@ def generar_reporte_mantenimientos_perdidos(datos, meses_seleccionados=None):
     # 2. Iterar por cada mes en la lista
     for mes_actual in meses_seleccionados:
         
-        for site in datos['conteo_ejecutadas'][COL_SITE_ID].unique():
-            site_data = datos['conteo_ejecutadas'][
-                datos['conteo_ejecutadas'][COL_SITE_ID] == site
-            ].sort_values("MES")
+        for site in conteo[COL_SITE_ID].unique():
+            site_data = conteo[conteo[COL_SITE_ID] == site].sort_values("MES")
             
             # Verificar si el sitio tiene datos para el mes en evaluación
             if mes_actual not in site_data['MES'].values:
@@ -1362,7 +3836,10 @@ def generar_reporte_mantenimientos_perdidos(datos, meses_seleccionados=None):
                 if especialidad not in site_data_hasta_mes.columns:
                     continue
                 
-                serie = site_data_hasta_mes[especialidad].fillna(0).astype(int)
+                # Sin valor en el mes evaluado: especialidad anulada, no se compara
+                if pd.isna(site_data_hasta_mes[especialidad].iloc[-1]):
+                    continue
+                serie = site_data_hasta_mes[especialidad].dropna().astype(int)
                 
                 # Promedio histórico (excluyendo el mes actual de la iteración)
                 # Tomamos todos los registros previos al último en 'site_data_hasta_mes'
@@ -1379,30 +3856,33 @@ def generar_reporte_mantenimientos_perdidos(datos, meses_seleccionados=None):
             # 3. Agregar al reporte si se detectó caída en ese mes
             if tiene_caida and mantenimientos_perdidos_texto:
                 
-                site_info = datos['prioridad_df'][datos['prioridad_df'][COL_SITE_ID] == site]
-                
-                # Extraer Site Name y FLM
-                site_name = site_info[COL_SITE].iloc[0] if not site_info.empty else "N/A"
-                # Cambia 'FLM' por el nombre exacto de la columna en tu archivo (ej. 'Vendor' o 'Responsable')
-                flm_name = site_info['FLM'].iloc[0] if 'FLM' in site_info.columns and not site_info.empty else "Sin Asignar"
-                
                 total_actual = site_data.iloc[-1]['TOTAL']
                 promedio_total_h = site_data.iloc[:-1]['TOTAL'].mean()
                 
                 reporte_acumulado.append({
                     "Mes Analizado": mes_actual,
                     "Site Id": site,
-                    "Site Name": site_name,
-                    "FLM": COL_FLM_ESPECIFICO,  # <--- Nueva Columna
                     "Mantenimientos Perdidos": ", ".join(mantenimientos_perdidos_texto),
                     "Total Mes": int(total_actual),
                     "Promedio Histórico": round(promedio_total_h, 1),
                     "Diferencia": round(total_actual - promedio_total_h, 1)
                 })
     
-    # 4. Consolidar y ordenar
+    # 4. Consolidar, unir con la dimensión de sitios (Site Name y FLM) y ordenar
     df_reporte = pd.DataFrame(reporte_acumulado)
     if not df_reporte.empty:
+        dimension = datos['dim_sitios'][[COL_SITE, COL_FLM_ESPECIFICO]].rename(columns={
+            COL_SITE: "Site Name",
+            COL_FLM_ESPECIFICO: "FLM"
+        })
+        df_reporte = df_reporte.merge(dimension, left_on="Site Id", right_index=True, how="left")
+        df_reporte["Site Name"] = df_reporte["Site Name"].fillna("N/A")
+        df_reporte["FLM"] = df_reporte["FLM"].fillna("Sin Asignar")
+        df_reporte = df_reporte[[
+            "Mes Analizado", "Site Id", "Site Name", "FLM", "Mantenimientos Perdidos",
+            "Total Mes", "Promedio Histórico", "Diferencia"
+        ]]
+        
         # Ordenamos por mes (asc) y luego por la caída más fuerte (asc)
         df_reporte = df_reporte.sort_values('Mes Analizado', ascending=True)
     
@@ -1418,125 +3898,66 @@ def mostrar_sitios_con_especialidades_eliminadas(datos):
 
     st.markdown("---")
     
-    # Cargar anulaciones
-    try:
-        df_anulaciones_full = pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
-        df_anulaciones_full.columns = df_anulaciones_full.columns.str.strip()
-        tiene_anulaciones = True
-    except:
-        tiene_anulaciones = False
-
-    grupos_prioridades = {
-        "P1": "P_1", "P2": "P_2", "P3": "P_3",
-        "D1": "D_1", "D2": "D_2", "D3": "D_3",
-        "B1": "B_1", "B2": "B_2", "B3": "B_3"
-    }
-    
-    tabs = st.tabs([f"Sites {k}" for k in grupos_prioridades.keys()])
+    # Los sitios ya vienen agrupados por prioridad y nivel de riesgo
+    grupos = datos['grupos_problematicos']['eliminadas']
+    nombre_tab, codigo_prioridad = seleccionar_prioridad(grupos, "prioridad_eliminadas")
+    sitios_por_riesgo = grupos.get(codigo_prioridad, {})
+    total_sitios = sum(len(sitios) for sitios in sitios_por_riesgo.values())
     
-    for (nombre_tab, codigo_prioridad), tab in zip(grupos_prioridades.items(), tabs):
-        with tab:
-            # Filtrar sitios de esta prioridad
-            sitios_prioridad = datos['prioridad_df'][
-                datos['prioridad_df'][COL_PRIORIDAD] == codigo_prioridad
-            ][COL_SITE_ID].unique()
+    if total_sitios:
+        st.write(f"**⚠️ {total_sitios} sitios con especialidades eliminadas en {nombre_tab}**")
+        
+        sitios_pagina = paginar_sitios(
+            [(nivel, site) for nivel in NIVELES_RIESGO for site in sitios_por_riesgo.get(nivel, [])],
+            f"pagina_eliminadas_{codigo_prioridad}"
+        )
+        
+        nivel_anterior = None
+        for nivel_riesgo, site in sitios_pagina:
+            # Mostrar badge del nivel de riesgo al empezar cada grupo
+            if nivel_riesgo != nivel_anterior:
+                st.markdown(f":{COLOR_RIESGO[nivel_riesgo]}-badge[{nivel_riesgo}]")
+                nivel_anterior = nivel_riesgo
             
-            # Sitios con especialidades eliminadas en esta prioridad
-            sitios_con_alerta = [
-                s for s in sitios_prioridad 
-                if s in datos['eliminadas'] and datos['eliminadas'][s]
-            ]
+            total_perdidos = datos['mantenimientos_perdidos'].get(site, 0)
+            site_name = nombre_sitio(datos, site)
+            num_especialidades_eliminadas = len(datos['eliminadas'][site])
             
-            if sitios_con_alerta:
-                st.write(f"**⚠️ {len(sitios_con_alerta)} sitios con especialidades eliminadas en {nombre_tab}**")
+            expander = st.expander(
+                f"{site} — {site_name} — "
+                f"{num_especialidades_eliminadas} especialidad(es) eliminada(s), "
+                f"{total_perdidos} mttos perdidos",
+                key=f"exp_eliminadas_{site}",
+                on_change="rerun"
+            )
+            with expander:
+                # El detalle solo se dibuja cuando el usuario abre el expander
+                if not expander.open:
+                    continue
                 
-                # Agrupar sitios por nivel de riesgo
-                sitios_por_riesgo = {
-                    "ALTO RIESGO": [],
-                    "MEDIO RIESGO": [],
-                    "BAJO RIESGO": []
-                }
+                site_data = datos['conteo_ejecutadas'][
+                    datos['conteo_ejecutadas'][COL_SITE_ID] == site
+                ].sort_values("MES")
                 
-                for site in sitios_con_alerta:
-                    riesgo_sitio = datos['riesgos'].get(site, "BAJO RIESGO")
-                    sitios_por_riesgo[riesgo_sitio].append(site)
+                # Especialidades eliminadas
+                st.write("**Detalle de especialidades eliminadas:**")
+                for esp in datos['eliminadas'][site]:
+                    serie_esp = site_data[esp].fillna(0).astype(int)
+                    max_hist = serie_esp.max()
+                    actual = serie_esp.iloc[-1] if len(serie_esp) > 0 else 0
+                    perdidos = max_hist - actual
+                    st.write(f"- **{esp}**: {perdidos} mttos perdidos (máx histórico: {max_hist}, actual: {actual})")
                 
-                # Mostrar por grupos de riesgo
-                for nivel_riesgo in ["ALTO RIESGO", "MEDIO RIESGO", "BAJO RIESGO"]:
-                    sitios_nivel = sitios_por_riesgo[nivel_riesgo]
-                    
-                    if sitios_nivel:
-                        # Determinar color del badge
-                        if "ALTO" in nivel_riesgo:
-                            color_badge = "red"
-                        elif "MEDIO" in nivel_riesgo:
-                            color_badge = "orange"
-                        else:
-                            color_badge = "green"
-                        
-                        # Mostrar badge del nivel de riesgo
-                        
-                        st.markdown(f":{color_badge}-badge[{nivel_riesgo}]")
-                        
-                        
-                        # Mostrar cada sitio de este nivel de riesgo
-                        for site in sitios_nivel:
-                            site_data = datos['conteo_ejecutadas'][
-                                datos['conteo_ejecutadas'][COL_SITE_ID] == site
-                            ].sort_values("MES")
-                            
-                            total_perdidos = datos['mantenimientos_perdidos'].get(site, 0)
-                            
-                            site_name_row = datos['prioridad_df'][datos['prioridad_df'][COL_SITE_ID] == site]
-                            site_name = site_name_row[COL_SITE].iloc[0] if not site_name_row.empty else site
-                            
-                            num_especialidades_eliminadas = len(datos['eliminadas'][site])
-                            
-                            with st.expander(
-                                f"{site} — {site_name} — "
-                                f"{num_especialidades_eliminadas} especialidad(es) eliminada(s), "
-                                f"{total_perdidos} mttos perdidos"
-                            ):
-                                
-                                # Especialidades eliminadas
-                                st.write("**Detalle de especialidades eliminadas:**")
-                                for esp in datos['eliminadas'][site]:
-                                    serie_esp = site_data[esp].fillna(0).astype(int)
-                                    max_hist = serie_esp.max()
-                                    actual = serie_esp.iloc[-1] if len(serie_esp) > 0 else 0
-                                    perdidos = max_hist - actual
-                                    st.write(f"- **{esp}**: {perdidos} mttos perdidos (máx histórico: {max_hist}, actual: {actual})")
-                                
-                                # Verificar si hay anulaciones registradas
-                                if tiene_anulaciones:
-                                    anulaciones_sitio = df_anulaciones_full[df_anulaciones_full["Site Id"] == site]
-                                    
-                                    if not anulaciones_sitio.empty:
-                                        st.markdown("---")
-                                        st.write("**📋 Anulaciones registradas para este sitio:**")
-                                        
-                                        for _, anulacion in anulaciones_sitio.iterrows():
-                                            tipo_color = "🔴" if "Sitio completo" in str(anulacion["Tipo de anulación"]) else "🟡"
-                                            st.write(f"{tipo_color} **{anulacion['Especialidad eliminada']}** — {anulacion['Tipo de anulación']}")
-                                            st.caption(f"Justificación: {anulacion['Justificación']}")
-                                
-                                st.markdown("---")
-                                
-                                # Gráfico de evolución
-                                st.write("**Evolución temporal de especialidades realizadas:**")
-                                columnas_grafico = [
-                                    c for c in site_data.columns 
-                                    if c not in [COL_SITE_ID, "MES", "TOTAL"]
-                                ]
-                                df_grafico = site_data.melt(
-                                    id_vars=["MES"],
-                                    value_vars=columnas_grafico,
-                                    var_name="Especialidad",
-                                    value_name="Cantidad"
-                                )
-                                st.bar_chart(df_grafico, x="MES", y="Cantidad", color="Especialidad", horizontal=True)
-            else:
-                st.success(f"No hay sitios de tipo {nombre_tab} con especialidades eliminadas")
+                # Verificar si hay anulaciones registradas
+                mostrar_anulaciones_sitio(datos, site, "**📋 Anulaciones registradas para este sitio:**")
+                
+                st.markdown("---")
+                
+                # Gráfico de evolución
+                st.write("**Evolución temporal de especialidades realizadas:**")
+                mostrar_grafico_evolucion(site_data)
+    else:
+        st.success(f"No hay sitios de tipo {nombre_tab} con especialidades eliminadas")
 
 
 def mostrar_sitios_con_menos_mantenimientos(datos):
@@ -1547,140 +3968,83 @@ def mostrar_sitios_con_menos_mantenimientos(datos):
     
 
     
-    # Cargar anulaciones
-    try:
-        df_anulaciones_full = pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
-        df_anulaciones_full.columns = df_anulaciones_full.columns.str.strip()
-        tiene_anulaciones = True
-    except:
-        tiene_anulaciones = False
-
-    grupos_prioridades = {
-        "P1": "P_1", "P2": "P_2", "P3": "P_3",
-        "D1": "D_1", "D2": "D_2", "D3": "D_3",
-        "B1": "B_1", "B2": "B_2", "B3": "B_3"
-    }
+    # Los sitios ya vienen agrupados por prioridad y nivel de riesgo, ordenados por mayor caída
+    grupos = datos['grupos_problematicos']['decreciendo']
+    nombre_tab, codigo_prioridad = seleccionar_prioridad(grupos, "prioridad_decreciendo")
+    sitios_por_riesgo = grupos.get(codigo_prioridad, {})
+    total_sitios = sum(len(sitios) for sitios in sitios_por_riesgo.values())
     
-    tabs = st.tabs([f"Sites {k}" for k in grupos_prioridades.keys()])
-    
-    for (nombre_tab, codigo_prioridad), tab in zip(grupos_prioridades.items(), tabs):
-        with tab:
-            # Filtrar sitios de esta prioridad
-            sitios_prioridad = datos['prioridad_df'][
-                datos['prioridad_df'][COL_PRIORIDAD] == codigo_prioridad
-            ][COL_SITE_ID].unique()
+    if total_sitios:
+        st.write(f"**⚠️ {total_sitios} sitios con menos mantenimientos en {nombre_tab}**")
+        
+        sitios_pagina = paginar_sitios(
+            [(nivel, site) for nivel in NIVELES_RIESGO for site in sitios_por_riesgo.get(nivel, [])],
+            f"pagina_decreciendo_{codigo_prioridad}"
+        )
+        
+        nivel_anterior = None
+        for nivel_riesgo, site in sitios_pagina:
+            # Mostrar badge del nivel de riesgo al empezar cada grupo
+            if nivel_riesgo != nivel_anterior:
+                st.markdown(f":{COLOR_RIESGO[nivel_riesgo]}-badge[{nivel_riesgo}]")
+                nivel_anterior = nivel_riesgo
             
-            # Sitios con tendencia decreciente en esta prioridad
-            sitios_con_alerta = [
-                s for s in sitios_prioridad 
-                if s in datos['tendencias'] and "DECRECIENDO" in datos['tendencias'][s]["tendencia"]
-            ]
+            site_name = nombre_sitio(datos, site)
             
-            if sitios_con_alerta:
-                st.write(f"**⚠️ {len(sitios_con_alerta)} sitios con menos mantenimientos en {nombre_tab}**")
-                
-                # Agrupar sitios por nivel de riesgo
-                sitios_por_riesgo = {
-                    "ALTO RIESGO": [],
-                    "MEDIO RIESGO": [],
-                    "BAJO RIESGO": []
-                }
-                
-                for site in sitios_con_alerta:
-                    riesgo_sitio = datos['riesgos'].get(site, "BAJO RIESGO")
-                    sitios_por_riesgo[riesgo_sitio].append(site)
+            tend = datos['tendencias'][site]
+            caida = abs(tend['valor'])
+            
+            expander = st.expander(
+                f"{site} — {site_name} — "
+                f"Cayó {caida:.0f} mantenimiento(s)",
+                key=f"exp_decreciendo_{site}",
+                on_change="rerun"
+            )
+            with expander:
+                # El detalle solo se dibuja cuando el usuario abre el expander
+                if not expander.open:
+                    continue
                 
-                # Mostrar por grupos de riesgo
-                for nivel_riesgo in ["ALTO RIESGO", "MEDIO RIESGO", "BAJO RIESGO"]:
-                    sitios_nivel = sitios_por_riesgo[nivel_riesgo]
+                # Mostrar diferencia con mes anterior
+                if site in datos.get('diferencias_mtto', {}):
+                    dif_info = datos['diferencias_mtto'][site]
                     
-                    if sitios_nivel:
-                        # Determinar color del badge (igual que en la función anterior)
-                        if "ALTO" in nivel_riesgo:
-                            color_badge = "red"
-                        elif "MEDIO" in nivel_riesgo:
-                            color_badge = "orange"
-                        else:
-                            color_badge = "green"
-                        
-                        # Mostrar badge del nivel de riesgo
-                        st.markdown(f":{color_badge}-badge[{nivel_riesgo}]")
-                        
-                        # Ordenar por mayor caída dentro de cada nivel de riesgo
-                        sitios_ordenados = sorted(
-                            sitios_nivel,
-                            key=lambda s: abs(datos['tendencias'][s]['valor']),
-                            reverse=True
+                    col_dif1, col_dif2, col_dif3 = st.columns(3)
+                    
+                    with col_dif1:
+                        st.metric("Mes Anterior", f"{dif_info['mes_anterior']}")
+                    with col_dif2:
+                        st.metric("Mes Actual", f"{dif_info['mes_actual']}")
+                    with col_dif3:
+                        delta_valor = dif_info['diferencia']
+                        st.metric(
+                            "Diferencia", 
+                            f"{delta_valor:+d}",
+                            delta=f"{delta_valor:+d} mttos"
                         )
-                        
-                        # Mostrar cada sitio de este nivel de riesgo
-                        for site in sitios_ordenados:
-                            site_data = datos['conteo_ejecutadas'][
-                                datos['conteo_ejecutadas'][COL_SITE_ID] == site
-                            ].sort_values("MES")
-                            
-                            site_name_row = datos['prioridad_df'][datos['prioridad_df'][COL_SITE_ID] == site]
-                            site_name = site_name_row[COL_SITE].iloc[0] if not site_name_row.empty else site
-                            
-                            tend = datos['tendencias'][site]
-                            caida = abs(tend['valor'])
-                            
-                            with st.expander(
-                                f"{site} — {site_name} — "
-                                f"Cayó {caida:.0f} mantenimiento(s)"
-                            ):
-                                # Mostrar diferencia con mes anterior
-                                if site in datos.get('diferencias_mtto', {}):
-                                    dif_info = datos['diferencias_mtto'][site]
-                                    
-                                    col_dif1, col_dif2, col_dif3 = st.columns(3)
-                                    
-                                    with col_dif1:
-                                        st.metric("Mes Anterior", f"{dif_info['mes_anterior']}")
-                                    with col_dif2:
-                                        st.metric("Mes Actual", f"{dif_info['mes_actual']}")
-                                    with col_dif3:
-                                        delta_valor = dif_info['diferencia']
-                                        st.metric(
-                                            "Diferencia", 
-                                            f"{delta_valor:+d}",
-                                            delta=f"{delta_valor:+d} mttos"
-                                        )
-                                
-                                # Verificar si hay anulaciones registradas
-                                if tiene_anulaciones:
-                                    anulaciones_sitio = df_anulaciones_full[df_anulaciones_full["Site Id"] == site]
-                                    
-                                    if not anulaciones_sitio.empty:
-                                        st.markdown("---")
-                                        st.write("**📋 Anulaciones registradas para este sitio:**")
-                                        
-                                        for _, anulacion in anulaciones_sitio.iterrows():
-                                            tipo_color = "🔴" if "Sitio completo" in str(anulacion["Tipo de anulación"]) else "🟡"
-                                            st.write(f"{tipo_color} **{anulacion['Especialidad eliminada']}** — {anulacion['Tipo de anulación']}")
-                                            st.caption(f"Justificación: {anulacion['Justificación']}")
-                                
-                                # Mostrar también la tabla detallada
-                                columnas_grafico = [
-                                    c for c in site_data.columns 
-                                    if c not in [COL_SITE_ID, "MES", "TOTAL"]
-                                ]
-                                
-                                tabla_detallada = site_data[["MES"] + columnas_grafico].set_index("MES")
-                                
-                                st.markdown("---")
-                                st.write("**Visualización gráfica:**")
-                                df_grafico = site_data.melt(
-                                    id_vars=["MES"],
-                                    value_vars=columnas_grafico,
-                                    var_name="Especialidad",
-                                    value_name="Cantidad"
-                                )
-                                st.bar_chart(df_grafico, x="MES", y="Cantidad", color="Especialidad", horizontal=True)
-                                st.dataframe(tabla_detallada, width="stretch")
-                                
-            else:
-                st.success(f"No hay sitios de tipo {nombre_tab} con menos mantenimientos el ultimo mes ")
+                
+                # Verificar si hay anulaciones registradas
+                mostrar_anulaciones_sitio(datos, site, "**📋 Anulaciones registradas para este sitio:**")
+                
+                site_data = datos['conteo_ejecutadas'][
+                    datos['conteo_ejecutadas'][COL_SITE_ID] == site
+                ].sort_values("MES")
+                
+                # Mostrar también la tabla detallada
+                columnas_grafico = [
+                    c for c in site_data.columns 
+                    if c not in [COL_SITE_ID, "MES", "TOTAL"]
+                ]
+                
+                tabla_detallada = site_data[["MES"] + columnas_grafico].set_index("MES")
+                
+                st.markdown("---")
+                st.write("**Visualización gráfica:**")
+                mostrar_grafico_evolucion(site_data)
+                st.dataframe(tabla_detallada, width="stretch")
+                
+    else:
+        st.success(f"No hay sitios de tipo {nombre_tab} con menos mantenimientos el ultimo mes ")
 
 # === PÁGINA DE DETALLE POR ESPECIALIDAD ===
 def pagina_especialidades():
@@ -1694,6 +4058,11 @@ def pagina_especialidades():
     
     st.header("Análisis Detallado por Especialidad")
     
+    mostrar_analisis_especialidad(datos)
+
+@st.fragment
+def mostrar_analisis_especialidad(datos):
+    """Selector de especialidad y su análisis (se vuelve a ejecutar solo esta parte)"""
     # Seleccionar especialidad
     especialidad_seleccionada = st.selectbox(
         "Selecciona una especialidad para analizar:",
@@ -1701,34 +4070,33 @@ def pagina_especialidades():
     )
     
     if especialidad_seleccionada:
-        # Filtrar datos por especialidad
-        df_especialidad = datos['df'][datos['df'][COL_ESPECIALIDAD] == especialidad_seleccionada]
+        analisis = analisis_especialidad_memo(datos, datos.get('version'), especialidad_seleccionada)
         
         # Métricas de la especialidad
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_mttos = len(df_especialidad)
+            total_mttos = analisis['total']
             st.metric("Total Mantenimientos", total_mttos, border=True)
         
         with col2:
-            ejecutados = len(df_especialidad[df_especialidad[COL_ESTADO].str.lower() == "ejecutado"])
+            ejecutados = analisis['por_estado'].get("ejecutado", 0)
             porcentaje_ejecutado = (ejecutados / total_mttos * 100) if total_mttos > 0 else 0
             st.metric("Ejecutados", ejecutados, f"{porcentaje_ejecutado:.1f}%", border=True)
         
         with col3:
-            pendientes = len(df_especialidad[df_especialidad[COL_ESTADO].str.lower() == "pendiente"])
+            pendientes = analisis['por_estado'].get("pendiente", 0)
             porcentaje_pendiente = (pendientes / total_mttos * 100) if total_mttos > 0 else 0
             st.metric("Pendientes", pendientes, f"{porcentaje_pendiente:.1f}%", border=True)
         
         with col4:
-            cancelados = len(df_especialidad[df_especialidad[COL_ESTADO].str.lower() == "cancelado"])
+            cancelados = analisis['por_estado'].get("cancelado", 0)
             porcentaje_cancelado = (cancelados / total_mttos * 100) if total_mttos > 0 else 0
             st.metric("Cancelados", cancelados, f"{porcentaje_cancelado:.1f}%", delta_color="inverse", border=True)
         
         # Evolución temporal
         st.subheader(f"Evolución Temporal - {especialidad_seleccionada}")
-        evolucion = df_especialidad.groupby(["MES", COL_ESTADO]).size().unstack(fill_value=0)
+        evolucion = analisis['evolucion']
         if not evolucion.empty:
             st.line_chart(evolucion)
         else:
@@ -1738,13 +4106,7 @@ def pagina_especialidades():
         st.markdown("---")
         st.subheader(f"📈 Predicción de Mantenimientos - {especialidad_seleccionada}")
         
-        # Obtener predicciones
-        predicciones = predecir_mantenimientos_especialidad(
-            datos['df'], 
-            datos['df_frecuencias'], 
-            especialidad_seleccionada,
-            meses_a_predecir=1
-        )
+        predicciones = analisis['predicciones']
         
         if not predicciones.empty:
             st.write("**Mantenimientos esperados para los próximos meses:**")
@@ -1773,6 +4135,7 @@ def pagina_especialidades():
                             'ultimo_mtto': 'Último Mtto',
                             'meses_transcurridos': 'Meses Transcurridos',
                             'frecuencia_esperada_meses': 'Cada cuantos meses le toca mtto',
+                            'probabilidad': 'Probabilidad',
                             'mttos_esperados': 'Mttos Esperados'
                         })
                         
@@ -1787,9 +4150,7 @@ def pagina_especialidades():
             st.subheader("📊 Comparación: Histórico vs Predicción")
             
             # Obtener datos históricos del último año
-            df_historico = df_especialidad[
-                df_especialidad[COL_ESTADO].str.lower() == "ejecutado"
-            ].groupby("MES").size().reset_index(name="ejecutados")
+            df_historico = analisis['historico']
             
             # Combinar histórico con predicción
             if not df_historico.empty:
@@ -1812,14 +4173,59 @@ def pagina_especialidades():
         else:
             st.warning("No hay suficientes datos para generar predicciones para esta especialidad")
         
+        # === PRECISIÓN DE LA PREDICCIÓN ===
+        st.markdown("---")
+        st.subheader(f"🎯 Precisión Histórica de la Predicción - {especialidad_seleccionada}")
+        
+        backtest = backtest_memo(datos, datos.get('version'), HORIZONTE_BACKTEST)
+        backtest_especialidad = (
+            backtest[backtest["especialidad"] == especialidad_seleccionada]
+            if not backtest.empty else backtest
+        )
+        
+        if not backtest_especialidad.empty:
+            st.caption(
+                "Se repite la predicción en cada mes de la historia con los datos disponibles a ese mes "
+                f"y se compara con lo ejecutado en los {HORIZONTE_BACKTEST} meses siguientes. "
+                "Sesgo positivo: se predijo de más."
+            )
+            
+            # Totales de la especialidad por corte y horizonte (todas las prioridades)
+            totales = backtest_especialidad.groupby(["corte", "horizonte"], as_index=False)[["predichos", "reales", "error"]].sum()
+            resumen = resumir_backtest(totales, ["horizonte"])
+            
+            cols_bt = st.columns(len(resumen))
+            for col, fila in zip(cols_bt, resumen.itertuples()):
+                with col:
+                    st.metric(
+                        f"A {fila.horizonte} mes(es) — MAE",
+                        f"{fila.mae:.1f} mttos",
+                        f"sesgo {fila.sesgo:+.1f}",
+                        delta_color="off",
+                        border=True
+                    )
+            
+            st.dataframe(
+                resumir_backtest(backtest_especialidad, ["prioridad", "horizonte"]).rename(columns={
+                    "prioridad": "Prioridad",
+                    "horizonte": "Meses Adelante",
+                    "cortes": "Cortes Evaluados",
+                    "reales_promedio": "Reales (prom.)",
+                    "predichos_promedio": "Predichos (prom.)",
+                    "mae": "MAE",
+                    "sesgo": "Sesgo"
+                }),
+                hide_index=True,
+                width="stretch"
+            )
+        else:
+            st.info("No hay historia suficiente para evaluar la predicción de esta especialidad")
+        
         # Top sitios con problemas en esta especialidad
         st.markdown("---")
         st.subheader(f"Sitios con Problemas - {especialidad_seleccionada}")
         
-        sitios_problema = []
-        for site in datos['eliminadas']:
-            if especialidad_seleccionada in datos['eliminadas'][site]:
-                sitios_problema.append(site)
+        sitios_problema = analisis['sitios_problema']
         
         if sitios_problema:
             st.write(f"**{len(sitios_problema)} sitios tienen problemas con {especialidad_seleccionada}:**")
@@ -1838,130 +4244,201 @@ def pagina_anulaciones():
         st.info("⚠️ Por favor carga un archivo Excel para iniciar el análisis.")
         return
     
-    # Cargar el archivo de anulaciones
-    try:
-        df_anulaciones = pd.read_excel(ARCHIVO_ANULACIONES, sheet_name=HOJA_ANULACIONES)
-        df_anulaciones.columns = df_anulaciones.columns.str.strip()
-        df_anulaciones = df_anulaciones[columnas_anulaciones]
+    # Las anulaciones ya vienen cargadas con el resto de los datos
+    df_anulaciones = datos['df_anulaciones']
+    
+    if df_anulaciones.empty:
+        st.warning("No hay registros de anulaciones disponibles")
+        return
+    
+    # Métricas generales
+    st.subheader("Resumen")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        total_anulaciones = len(df_anulaciones)
+        st.metric("Total de Anulaciones", total_anulaciones, border=True)
+    
+    with col2:
+        sitios_afectados = df_anulaciones["Site Id"].nunique()
+        st.metric("Sitios Afectados", sitios_afectados, border=True)
+    
+    with col3:
+        especialidades_anuladas = df_anulaciones["Especialidad eliminada"].nunique()
+        st.metric("Especialidades Anuladas", especialidades_anuladas, border=True)
+    
+    st.markdown("---")
+    
+    mostrar_anulaciones_filtradas(datos)
 
-        
-        if df_anulaciones.empty:
-            st.warning("No hay registros de anulaciones disponibles")
-            return
-        
-        # Métricas generales
-        st.subheader("Resumen")
-        
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            total_anulaciones = len(df_anulaciones)
-            st.metric("Total de Anulaciones", total_anulaciones, border=True)
-        
-        with col2:
-            sitios_afectados = df_anulaciones["Site Id"].nunique()
-            st.metric("Sitios Afectados", sitios_afectados, border=True)
-        
-        with col3:
-            especialidades_anuladas = df_anulaciones["Especialidad eliminada"].nunique()
-            st.metric("Especialidades Anuladas", especialidades_anuladas, border=True)
-        
-        st.markdown("---")
-        
-        # Filtros
-        st.subheader("Filtros")
-        
-        col_filtro1, col_filtro2 = st.columns(2)
-        
-        with col_filtro1:
-            tipo_anulacion_filtro = st.multiselect(
-                "Filtrar por Tipo de Anulación:",
-                options=df_anulaciones["Tipo de anulación"].unique().tolist(),
-                default=df_anulaciones["Tipo de anulación"].unique().tolist()
-            )
-        
-        with col_filtro2:
-            especialidad_filtro = st.multiselect(
-                "Filtrar por Especialidad:",
-                options=df_anulaciones["Especialidad eliminada"].unique().tolist(),
-                default=df_anulaciones["Especialidad eliminada"].unique().tolist()
-            )
-        
-        # Aplicar filtros
-        df_filtrado = df_anulaciones[
-            (df_anulaciones["Tipo de anulación"].isin(tipo_anulacion_filtro)) &
-            (df_anulaciones["Especialidad eliminada"].isin(especialidad_filtro))
-        ]
-        
-        st.markdown("---")
-        
-        # Mostrar tabla completa
-        st.subheader(f"📋 Registro de Anulaciones ({len(df_filtrado)} registros)")
-        
-        # Función para aplicar estilos según tipo de anulación
-        def aplicar_estilos_anulaciones(df):
-            styles = pd.DataFrame('', index=df.index, columns=df.columns)
+@st.fragment
+def mostrar_anulaciones_filtradas(datos):
+    """Filtros, tabla y gráficos de anulaciones (se vuelve a ejecutar solo esta parte)"""
+    df_anulaciones = datos['df_anulaciones']
+    
+    # Filtros
+    st.subheader("Filtros")
+    
+    col_filtro1, col_filtro2 = st.columns(2)
+    
+    with col_filtro1:
+        tipo_anulacion_filtro = st.multiselect(
+            "Filtrar por Tipo de Anulación:",
+            options=df_anulaciones["Tipo de anulación"].unique().tolist(),
+            default=df_anulaciones["Tipo de anulación"].unique().tolist()
+        )
+    
+    with col_filtro2:
+        especialidad_filtro = st.multiselect(
+            "Filtrar por Especialidad:",
+            options=df_anulaciones["Especialidad eliminada"].unique().tolist(),
+            default=df_anulaciones["Especialidad eliminada"].unique().tolist()
+        )
+    
+    # Aplicar filtros
+    df_filtrado = anulaciones_filtradas_memo(
+        datos, datos.get('version'), tuple(tipo_anulacion_filtro), tuple(especialidad_filtro)
+    )
+    
+    st.markdown("---")
+    
+    # Mostrar tabla completa
+    st.subheader(f"📋 Registro de Anulaciones ({len(df_filtrado)} registros)")
+    
+    # Estilo según tipo de anulación, solo sobre la página visible
+    mostrar_tabla_paginada(
+        df_filtrado,
+        key="pagina_anulaciones",
+        estilos_columnas={'Tipo de anulación': estilos_tipo_anulacion},
+        width='stretch'
+    )
+    
+    # Análisis adicional
+    st.markdown("---")
+    st.subheader("Análisis por Tipo de Anulación")
+    
+    tipos_count = df_filtrado["Tipo de anulación"].value_counts()
+    
+    col_chart1, col_chart2 = st.columns(2)
+    
+    with col_chart1:
+        st.write("**Distribución por Tipo:**")
+        st.bar_chart(tipos_count)
+    
+    with col_chart2:
+        st.write("**Distribución por Especialidad:**")
+        esp_count = df_filtrado["Especialidad eliminada"].value_counts()
+        st.bar_chart(esp_count)
+    
+    # Top sitios con más anulaciones
+    st.markdown("---")
+    st.subheader("Sitios con Más Anulaciones")
+    
+    top_sitios = df_filtrado["Site Id"].value_counts().head(10)
+    
+    if not top_sitios.empty:
+        for site_id, count in top_sitios.items():
+            anulaciones_del_sitio = df_filtrado[df_filtrado["Site Id"] == site_id]
             
-            if 'Tipo de anulación' in df.columns:
-                for idx in df.index:
-                    tipo = df.loc[idx, 'Tipo de anulación']
-                    
-                    if 'Sitio Completo' in str(tipo) or 'permanente' in str(tipo):
-                        styles.loc[idx, 'Tipo de anulación'] = 'background-color: #fee2e2; color: #991b1b; font-weight: bold'
-                    elif 'Temporal' in str(tipo) or 'temporal' in str(tipo):
-                        styles.loc[idx, 'Tipo de anulación'] = 'background-color: #fef3c7; color: #92400e; font-weight: bold'
+            # Obtener nombre del sitio
+            site_name = nombre_sitio(datos, site_id)
             
-            return styles
-        
-        # Aplicar estilos
-        styled_anulaciones = df_filtrado.style.apply(aplicar_estilos_anulaciones, axis=None)
-        
-        st.dataframe(styled_anulaciones, hide_index=True, width='stretch')
-        
-        # Análisis adicional
-        st.markdown("---")
-        st.subheader("Análisis por Tipo de Anulación")
-        
-        tipos_count = df_filtrado["Tipo de anulación"].value_counts()
-        
-        col_chart1, col_chart2 = st.columns(2)
-        
-        with col_chart1:
-            st.write("**Distribución por Tipo:**")
-            st.bar_chart(tipos_count)
-        
-        with col_chart2:
-            st.write("**Distribución por Especialidad:**")
-            esp_count = df_filtrado["Especialidad eliminada"].value_counts()
-            st.bar_chart(esp_count)
-        
-        # Top sitios con más anulaciones
-        st.markdown("---")
-        st.subheader("Sitios con Más Anulaciones")
-        
-        top_sitios = df_filtrado["Site Id"].value_counts().head(10)
-        
-        if not top_sitios.empty:
-            for site_id, count in top_sitios.items():
-                anulaciones_sitio = df_filtrado[df_filtrado["Site Id"] == site_id]
-                
-                # Obtener nombre del sitio
-                site_name_row = datos['prioridad_df'][datos['prioridad_df'][COL_SITE_ID] == site_id]
-                site_name = site_name_row[COL_SITE].iloc[0] if not site_name_row.empty else site_id
-                
-                with st.expander(f"{site_id} — {site_name} ({count} anulaciones)"):
-                    st.dataframe(
-                        anulaciones_sitio[["Especialidad eliminada", "Tipo de anulación", "Justificación"]], 
-                        hide_index=True,
-                        width='stretch'
-                    )
-        
-    except FileNotFoundError:
-        st.error(f"❌ No se encontró el archivo: {ARCHIVO_ANULACIONES}")
-    except Exception as e:
-        st.error(f"❌ Error al cargar las anulaciones: {str(e)}")
+            with st.expander(f"{site_id} — {site_name} ({count} anulaciones)"):
+                st.dataframe(
+                    anulaciones_del_sitio[["Especialidad eliminada", "Tipo de anulación", "Justificación"]], 
+                    hide_index=True,
+                    width='stretch'
+                )
+
+# === PÁGINA DE DESEMPEÑO POR CONTRATISTA Y FLM ===
+def pagina_desempeno():
+    st.title("Desempeño por Contratista y FLM")
+    
+    datos = st.session_state.datos
+    
+    if datos is None:
+        st.info(" Por favor carga un archivo Excel para iniciar el análisis.")
+        return
+    
+    mostrar_desempeno(datos)
+
+@st.fragment
+def mostrar_desempeno(datos):
+    """Scorecard de un contratista o FLM, dibujado desde los resúmenes precalculados"""
+    nivel = st.segmented_control(
+        "Agrupar por:",
+        ["Contratista", "FLM"],
+        default="Contratista",
+        key="desempeno_nivel"
+    ) or "Contratista"
+    columna = COL_CONTRATISTA if nivel == "Contratista" else COL_FLM_ESPECIFICO
+    resumen = datos['desempeno'][columna]
+    
+    if resumen.empty:
+        st.info("No hay datos de desempeño disponibles")
+        return
+    
+    seleccionado = st.selectbox(f"{nivel}:", resumen[columna].tolist(), key=f"desempeno_{nivel}")
+    fila = resumen[resumen[columna] == seleccionado].iloc[0]
+    
+    # === SCORECARD ===
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Ejecución", f"{fila['porcentaje_ejecucion']:.1f}%", f"{fila['ejecutados']} de {fila['registros']}",
+                  delta_color="off", border=True)
+    with col2:
+        st.metric("Pendientes sin Ejecutar", fila['backlog_pendiente'], f"{fila['pendientes']} pendientes en total",
+                  delta_color="off", border=True)
+    with col3:
+        st.metric("Cancelación", f"{fila['porcentaje_cancelacion']:.1f}%", f"{fila['cancelados']} cancelados",
+                  delta_color="off", border=True)
+    with col4:
+        meses_resolucion = fila['meses_promedio_resolucion']
+        st.metric("Meses de Pendiente a Ejecutado",
+                  f"{meses_resolucion:.1f}" if pd.notna(meses_resolucion) else "—", border=True)
+    
+    col5, col6, col7, col8 = st.columns(4)
+    with col5:
+        st.metric("Sitios", fila['sitios'], border=True)
+    with col6:
+        st.metric("Sitios con Especialidades Eliminadas", fila['sitios_con_eliminadas'],
+                  f"{fila['especialidades_eliminadas']} especialidades", delta_color="off", border=True)
+    with col7:
+        st.metric("Sitios con Ejecución Incompleta", fila['sitios_ejecucion_incompleta'], border=True)
+    with col8:
+        cumplimiento = fila['cumplimiento_frecuencia']
+        st.metric(f"Cumplimiento de Frecuencia {datos['fecha_corte']:%Y}",
+                  f"{cumplimiento:.1f}%" if pd.notna(cumplimiento) else "—", border=True)
+    
+    # === COMPARATIVO ===
+    st.markdown("---")
+    st.subheader(f"Comparativo por {nivel}")
+    
+    st.dataframe(
+        resumen.sort_values("porcentaje_ejecucion")[[
+            columna, "sitios", "porcentaje_ejecucion", "backlog_pendiente", "porcentaje_cancelacion",
+            "sitios_con_eliminadas", "sitios_ejecucion_incompleta", "meses_promedio_resolucion",
+            "cumplimiento_frecuencia"
+        ]].rename(columns={
+            columna: nivel,
+            "sitios": "Sitios",
+            "porcentaje_ejecucion": "Ejecución %",
+            "backlog_pendiente": "Pendientes sin Ejecutar",
+            "porcentaje_cancelacion": "Cancelación %",
+            "sitios_con_eliminadas": "Sitios con Eliminadas",
+            "sitios_ejecucion_incompleta": "Ejecución Incompleta",
+            "meses_promedio_resolucion": "Meses a Ejecución",
+            "cumplimiento_frecuencia": "Cumplimiento Frecuencia %"
+        }),
+        hide_index=True,
+        width="stretch",
+        column_config={
+            "Ejecución %": st.column_config.ProgressColumn(format="%.1f%%", min_value=0, max_value=100),
+            "Cumplimiento Frecuencia %": st.column_config.ProgressColumn(format="%.1f%%", min_value=0, max_value=100)
+        }
+    )
 
-# === PÁGINA DE REGISTRO DE LAS ANULACIONES ===
 # === PÁGINA DE GENERAR REPORTES ===
 def pagina_reporte():
     st.title("Reportes para la Auditoría")
@@ -1972,6 +4449,11 @@ def pagina_reporte():
         st.info(" Por favor carga un archivo Excel para iniciar el análisis.")
         return
     
+    mostrar_reportes(datos)
+
+@st.fragment
+def mostrar_reportes(datos):
+    """Selector del tipo de reporte y su contenido (se vuelve a ejecutar solo esta parte)"""
     # Botones para seleccionar tipo de reporte
     col_btn1, col_btn2 = st.columns(2)
     
@@ -2025,20 +4507,11 @@ def mostrar_reporte_mantenimientos_perdidos(datos):
     
     # Generar y mostrar preview del reporte
     if meses_seleccionados:
-        # La función que modificamos antes ahora recibe la lista
-        df_reporte = generar_reporte_mantenimientos_perdidos(datos, meses_seleccionados)
+        # El reporte y su Excel se calculan una vez por combinación de meses
+        df_reporte, excel_reporte = reporte_perdidos_memo(datos, datos.get('version'), tuple(meses_seleccionados))
         
         if not df_reporte.empty:
             
-            # Preparar descarga en memoria
-            from io import BytesIO
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df_reporte.to_excel(writer, index=False, sheet_name='Mantenimientos Perdidos')
-            buffer.seek(0)
-
-            
-            
             # Nombre del archivo dinámico basado en la cantidad de meses
             nombre_archivo = f"reporte_mantenimientos_{len(meses_seleccionados)}_meses.xlsx"
             if len(meses_seleccionados) == 1:
@@ -2047,7 +4520,7 @@ def mostrar_reporte_mantenimientos_perdidos(datos):
             #boton de descarga del reporte
             st.download_button(
                 label=f" Descargar Reporte Completo (Excel)",
-                data=buffer,
+                data=excel_reporte,
                 file_name=nombre_archivo,
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 type="primary"
@@ -2077,24 +4550,15 @@ def mostrar_reporte_ejecucion_incompleta(datos):
         st.success("✅ No hay sitios con ejecución incompleta detectados en este momento")
     else:
         # Generar el reporte
-        df_reporte_incompleto = generar_reporte_ejecucion_incompleta(datos)
+        df_reporte_incompleto, excel_reporte = reporte_incompleta_memo(datos, datos.get('version'))
         
         if df_reporte_incompleto is not None and not df_reporte_incompleto.empty:
             # Botón de descarga
-            from io import BytesIO
-            from datetime import datetime
-            
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df_reporte_incompleto.to_excel(writer, index=False, sheet_name='Ejecución Incompleta')
-            
-            buffer.seek(0)
-            
             fecha_reporte = datetime.now().strftime("%Y-%m-%d")
             
             st.download_button(
                 label="Descargar Reporte Completo de Sitios con ejecución incompleta (Excel)",
-                data=buffer,
+                data=excel_reporte,
                 file_name=f"reporte_ejecucion_incompleta_{fecha_reporte}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 type="primary",
@@ -2105,32 +4569,31 @@ def mostrar_reporte_ejecucion_incompleta(datos):
             st.write(f"**Vista previa del reporte ({len(df_reporte_incompleto)} sitios con ejecución incompleta):**")
             
             # Aplicar estilos al dataframe
-            def aplicar_estilos_criticidad(df):
-                styles = pd.DataFrame('', index=df.index, columns=df.columns)
-                
-                if 'Criticidad' in df.columns:
-                    for idx in df.index:
-                        criticidad = df.loc[idx, 'Criticidad']
-                        
-                        if criticidad == 'CRÍTICO':
-                            styles.loc[idx, 'Criticidad'] = 'background-color: #fee2e2; color: #991b1b; font-weight: bold'
-                        elif criticidad == 'ALERTA':
-                            styles.loc[idx, 'Criticidad'] = 'background-color: #fef3c7; color: #92400e; font-weight: bold'
-                        else:
-                            styles.loc[idx, 'Criticidad'] = 'background-color: #d1fae5; color: #065f46; font-weight: bold'
-                
-                return styles
-            
-            styled_df = df_reporte_incompleto.head(10).style.apply(aplicar_estilos_criticidad, axis=None)
+            styled_df = aplicar_estilos_columnas(df_reporte_incompleto.head(10), {
+                'Criticidad': lambda valores: estilos_por_categoria(valores, ESTILOS_CRITICIDAD, ESTILO_VERDE)
+            })
             st.dataframe(styled_df, hide_index=True, width='stretch')
         
         else:
             st.info("No se pudo generar el reporte. Verifica que haya datos disponibles.")
 # === CONFIGURACIÓN PRINCIPAL ===
 def main():
-    # Inicializar datos en session_state si no existen
-    if 'datos' not in st.session_state:
-        st.session_state.datos = cargar_datos()
+    # Tomar la versión vigente de los datos compartidos (el vigilante la reemplaza
+    # en segundo plano cuando cambian los archivos)
+    # Solo la carga inicial (en primer plano) muestra la lectura del libro principal
+    barra_carga = st.empty()
+    actual = cargar_datos_compartidos(
+        progreso=lambda fraccion: barra_carga.progress(fraccion, text=f"Leyendo {ARCHIVO}... {fraccion:.0%}")
+    )['actual']
+    barra_carga.empty()
+    if st.session_state.get('version_datos') != actual['version']:
+        if 'version_datos' in st.session_state:
+            st.toast("Se cargaron datos actualizados")
+        st.session_state.datos = actual['datos']
+        st.session_state.version_datos = actual['version']
+    
+    if PUERTO_API:
+        iniciar_api(HOST_API, PUERTO_API)
     
     # Inicializar página actual si no existe
     if 'pagina_actual' not in st.session_state:
@@ -2142,7 +4605,7 @@ def main():
         pagina = st.pills(
             " ",
             ["Volver al Inicio", "Búsqueda por Site ID", "Mantenimientos Pendientes", 
-             "Sitios Problemáticos",  "Especialidades", "Anulaciones", "Generar Reporte"],
+             "Sitios Problemáticos",  "Especialidades", "Anulaciones", "Desempeño", "Generar Reporte"],
             selection_mode="single",
             width="stretch"
         )
@@ -2155,6 +4618,7 @@ def main():
             "Sitios Problemáticos": "Sitios Problemáticos",
             "Especialidades": "Especialidades",
             "Anulaciones": "Anulaciones", 
+            "Desempeño": "Desempeño",
             "Generar Reporte": "Generar Reporte"
         }
         
@@ -2176,6 +4640,8 @@ def main():
         pagina_pendientes()
     elif st.session_state.pagina_actual == "Anulaciones":
         pagina_anulaciones()
+    elif st.session_state.pagina_actual == "Desempeño":
+        pagina_desempeno()
     elif st.session_state.pagina_actual == "Generar Reporte":
         pagina_reporte()
 